@@ -0,0 +1,256 @@
+import os
+import cv2
+import time
+import queue
+import signal
+import logging
+import importlib
+import threading
+import multiprocessing
+import numpy as np
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Analytics settings
+ANALYSIS_WIDTH = 160  # Frames are analysed at this width (grayscale)
+ANALYSIS_FPS = 2  # Frames analysed per second and camera
+QUEUE_FRAMES = 32  # Frames waiting for the analytics process; newer frames are dropped when full
+MIN_BLOB_AREA = 6  # Smallest moving region counted as an animal, in pixels at analysis size
+BACKGROUND_HISTORY = 300  # Frames the background model remembers (150 s at 2 fps)
+
+class MotionAnalyzer:
+    """
+    Scores activity with MOG2 background subtraction and counts moving blobs.
+
+    The activity score is the fraction of pixels that differ from the learned
+    background; blobs are connected foreground regions of at least
+    ``min_blob_area`` pixels after a small opening removes speckle noise.
+    """
+
+    def __init__(self, history=BACKGROUND_HISTORY, var_threshold=16, min_blob_area=MIN_BLOB_AREA):
+        self.min_blob_area = min_blob_area
+        self._subtractor = cv2.createBackgroundSubtractorMOG2(history, var_threshold, detectShadows=False)
+        self._kernel = np.ones((3, 3), np.uint8)
+
+    def analyze(self, frame):
+        """
+        Analyse one grayscale frame.
+
+        Args:
+            frame (numpy.ndarray): Downscaled grayscale frame.
+
+        Returns:
+            dict: "activity" (0.0 to 1.0) and "blobs" (int).
+        """
+        mask = self._subtractor.apply(frame)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self._kernel)
+        _, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        blobs = int(np.count_nonzero(stats[1:, cv2.CC_STAT_AREA] >= self.min_blob_area))
+        return {"activity": float(np.count_nonzero(mask)) / mask.size, "blobs": blobs}
+
+def load_analyzer(spec):
+    """
+    Resolve an analyzer class from a "module.Class" string (e.g. from config.json).
+
+    Args:
+        spec (str or type): Dotted path, or the class itself.
+
+    Returns:
+        type: The analyzer class.
+    """
+    if not isinstance(spec, str):
+        return spec
+    module_name, _, class_name = spec.rpartition(".")
+    return getattr(importlib.import_module(module_name), class_name)
+
+def summarize_seconds(seconds):
+    """
+    Turn per-second accumulators into the index fields of a segment.
+
+    Args:
+        seconds (dict): Unix second -> [activity sum, frame count, max blobs].
+
+    Returns:
+        dict: Per-second scores as [second, activity, blobs] plus the segment's
+            mean and peak activity, its largest blob count and the first and
+            last analysed second.
+    """
+    per_second = [[second, round(total / count, 4), blobs]
+                  for second, (total, count, blobs) in sorted(seconds.items())]
+    scores = [activity for _, activity, _ in per_second]
+    return {
+        "activity": per_second,
+        "activity_mean": round(sum(scores) / len(scores), 4) if scores else 0.0,
+        "activity_peak": max(scores, default=0.0),
+        "max_blobs": max((blobs for _, _, blobs in per_second), default=0),
+        "activity_start": per_second[0][0] if per_second else None,
+        "activity_end": per_second[-1][0] if per_second else None,
+    }
+
+def _run_worker(frames, results, analyzer_class, analyzer_args):
+    """
+    Analytics process: analyse queued frames and report each finished segment.
+
+    Frames and end markers share one queue, so an end marker arrives only
+    after every frame of its segment has been analysed.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent shuts the stage down on Ctrl-C
+    try:
+        os.nice(10)
+    except OSError:
+        pass
+    analyzers = {}
+    segments = {}  # (camera, segment) -> {second: [activity sum, frame count, max blobs]}
+    while True:
+        item = frames.get()
+        if item is None:
+            return
+        kind, camera_name, segment, payload = item
+        key = (camera_name, segment)
+        if kind == "frame":
+            timestamp, frame = payload
+            if camera_name not in analyzers:
+                analyzers[camera_name] = analyzer_class(**analyzer_args)
+            result = analyzers[camera_name].analyze(frame)
+            bucket = segments.setdefault(key, {}).setdefault(int(timestamp), [0.0, 0, 0])
+            bucket[0] += result["activity"]
+            bucket[1] += 1
+            bucket[2] = max(bucket[2], result.get("blobs", 0))
+        elif kind == "end":
+            results.put((camera_name, segment, summarize_seconds(segments.pop(key, {}))))
+
+class AnalyticsStage:
+    """
+    Runs frame analysis in a separate process so it never slows capture.
+
+    The stage is a raw frame listener: at ``fps`` per camera it downscales a
+    frame to a small grayscale image on the capture thread (far cheaper than
+    pickling the full frame) and queues it without blocking; when the queue
+    is full the frame is dropped. When a segment is finished, its per-second
+    scores are handed to ``on_scores(camera_name, segment_path, summary)`` on
+    a collector thread.
+    """
+
+    def __init__(self, on_scores, analyzer="activity_analytics.MotionAnalyzer", analyzer_args=None,
+                 fps=ANALYSIS_FPS, width=ANALYSIS_WIDTH, queue_size=QUEUE_FRAMES):
+        """
+        Args:
+            on_scores (callable): Receives each finished segment's summary.
+            analyzer (str or type): Analyzer class or "module.Class"; it needs
+                analyze(frame) returning "activity" and optionally "blobs".
+            analyzer_args (dict): Keyword arguments for the analyzer.
+            fps (float): Frames analysed per second and camera.
+            width (int): Analysis width in pixels.
+            queue_size (int): Frames buffered for the analytics process.
+        """
+        self.on_scores = on_scores
+        self.analyzer_class = load_analyzer(analyzer)
+        self.analyzer_args = analyzer_args or {}
+        self.interval = 1.0 / fps
+        self.width = width
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._segments = {}  # camera -> path of the segment being recorded
+        self._next_frame = {}  # camera -> monotonic time the next frame is due
+        self._markers = deque()  # End markers waiting for queue space
+        self._lock = threading.Lock()
+        self._frames = None
+        self._results = None
+        self._process = None
+        self._collector = None
+
+    def start(self):
+        # Spawn rather than fork: the parent already runs capture threads
+        context = multiprocessing.get_context("spawn")
+        self._frames = context.Queue(self.queue_size)
+        self._results = context.Queue()
+        self._process = context.Process(target=_run_worker, name="analytics", daemon=True,
+                                        args=(self._frames, self._results, self.analyzer_class, self.analyzer_args))
+        self._process.start()
+        self._collector = threading.Thread(target=self._collect, name="analytics-results", daemon=True)
+        self._collector.start()
+        logger.info("Analytics stage started (%s, %.1f fps at %dpx).",
+                    self.analyzer_class.__name__, 1.0 / self.interval, self.width)
+
+    def attach(self, pipeline):
+        """
+        Analyse a camera pipeline's frames, starting with the segment it is recording now.
+        """
+        self._segments[pipeline.name] = pipeline.current_segment
+        pipeline.add_frame_listener(self.publish, raw=True)
+
+    def segment_opened(self, camera_name, segment_path):
+        self._segments[camera_name] = segment_path
+
+    def segment_finished(self, camera_name, segment_path):
+        self._segments[camera_name] = None
+        with self._lock:
+            self._markers.append(("end", camera_name, segment_path, None))
+            self._flush_markers()
+
+    def _flush_markers(self):
+        # Runs on capture threads, so it never blocks; markers left over are retried with the next frame
+        while self._markers:
+            try:
+                self._frames.put_nowait(self._markers[0])
+            except queue.Full:
+                return False
+            self._markers.popleft()
+        return True
+
+    def publish(self, camera_name, frame):
+        """
+        Offer a frame for analysis (raw frame listener for CameraPipeline).
+        """
+        segment = self._segments.get(camera_name)
+        now = time.monotonic()
+        if segment is None or now < self._next_frame.get(camera_name, 0.0):
+            return
+        self._next_frame[camera_name] = now + self.interval
+
+        height = max(1, int(frame.shape[0] * self.width / frame.shape[1]))
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        with self._lock:
+            try:
+                if not self._flush_markers():
+                    raise queue.Full
+                self._frames.put_nowait(("frame", camera_name, segment, (time.time(), small)))
+            except queue.Full:
+                self.dropped += 1
+
+    def _collect(self):
+        while True:
+            item = self._results.get()
+            if item is None:
+                return
+            camera_name, segment_path, summary = item
+            try:
+                self.on_scores(camera_name, segment_path, summary)
+            except Exception:
+                logger.exception("Failed to store activity scores for %s", segment_path)
+
+    def stop(self, timeout=5):
+        """
+        Analyse what is queued, then stop the analytics process.
+        """
+        if self._process is None:
+            return
+        try:
+            with self._lock:
+                for marker in self._markers:
+                    self._frames.put(marker, timeout=timeout)
+                self._markers.clear()
+            self._frames.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._results.put(None)
+        self._collector.join(timeout)
+        self._process = None
+        if self.dropped:
+            logger.info("Analytics dropped %d frames while the analytics process was busy.", self.dropped)
@@ -1,36 +1,37 @@
 import cv2
 import time
 import logging
-from pathlib import Path
+
+import backends
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-def start_camera(resolution=(1920, 1080), output_dir="segments/"):
+def start_camera(resolution=(1920, 1080), output_dir="segments/", device=0, fps=30, fourcc=None):
     """
     Initializes the camera and ensures the output directory exists.
 
     Args:
         resolution (tuple): Video resolution (width, height).
         output_dir (str): Directory to save video files.
+        device (int or str): Camera index or device path (e.g. "/dev/video2").
+        fps (int): Frame rate requested from the camera.
+        fourcc (str): Optional pixel format to request (e.g. "MJPG" to save USB bandwidth).
 
     Returns:
         cv2.VideoCapture: The camera object.
     """
     # Ensure the output directory exists
-    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    backends.filesystem.makedirs(output_dir, exist_ok=True)
 
-    # Initialize the camera
-    camera = cv2.VideoCapture(0)  # Use Pi camera or default camera
-    camera.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
-    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
-    camera.set(cv2.CAP_PROP_FPS, 30)  # Set frame rate
+    # Initialize the camera (cv2.VideoCapture unless a simulated source is in use)
+    camera = backends.camera_source.open(device, resolution, fps, fourcc)
 
     if not camera.isOpened():
-        logger.error("Failed to open the camera.")
+        logger.error("Failed to open the camera %s.", device)
         raise RuntimeError("Camera initialization failed.")
 
-    logger.info("Camera initialized successfully.")
+    logger.info("Camera %s initialized successfully.", device)
     return camera
 
 def stop_camera(camera):
@@ -41,8 +42,7 @@ def stop_camera(camera):
         camera (cv2.VideoCapture): The camera object to release.
     """
     if camera:
-        camera.release()
-        cv2.destroyAllWindows()
+        backends.camera_source.close(camera)
         logger.info("Camera stopped and resources released.")
 
 def record_segment(camera, output_dir="segments/", duration=60):
@@ -70,7 +70,7 @@ def record_segment(camera, output_dir="segments/", duration=60):
     )
     out = cv2.VideoWriter(filepath, fourcc, fps, resolution)
 
-    logger.info(f"Recording video segment: {filepath}")
+    logger.info("Recording video segment: %s", filepath)
 
     start_time = time.time()
     while time.time() - start_time < duration:
@@ -81,5 +81,5 @@ def record_segment(camera, output_dir="segments/", duration=60):
         out.write(frame)
 
     out.release()
-    logger.info(f"Video segment saved: {filepath}")
+    logger.info("Video segment saved: %s", filepath)
     return filepath
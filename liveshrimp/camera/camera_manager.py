@@ -0,0 +1,621 @@
+import os
+import cv2
+import glob
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+
+from camera_handler import start_camera, stop_camera
+from v4l2_capture import V4L2Camera, PassthroughSegmentWriter, DEFAULT_FORMATS, is_capture_device
+from frame_timing import FixedRateWriter, FrameRateMeter
+from io_scheduler import io_coordinator, lower_thread_priority
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SECONDS = 60  # Length of each recorded segment
+DECODE_EVERY = 6  # In passthrough mode, decode one packet in this many for frame listeners
+
+def discover_cameras():
+    """
+    Find the video capture devices attached to the system.
+
+    Every /dev/videoN node is asked for its V4L2 capabilities; USB cameras
+    also expose metadata nodes and the Pi has codec and ISP nodes, none of
+    which can capture and all of which are skipped. No device is opened for
+    capture, so discovery takes milliseconds and leaves every camera free
+    for its pipeline.
+
+    Returns:
+        list: Indices of the capture devices, or an empty list where
+            /dev/video* does not exist.
+    """
+    nodes = [path[len("/dev/video"):] for path in glob.glob("/dev/video*")]
+    found = [index for index in sorted(int(n) for n in nodes if n.isdigit()) if is_capture_device(index)]
+    logger.info("Discovered cameras: %s", found)
+    return found
+
+def camera_configs(config, discover=True):
+    """
+    Build the per-camera settings from the configuration.
+
+    Each entry in the optional "cameras" list overrides the shared "camera"
+    section. Without that list, one entry is created per discovered device.
+
+    Args:
+        config (dict): The full device configuration.
+        discover (bool): Without a "cameras" list, look for devices. If False,
+            only the default device (camera.device, else 0) is returned, so
+            boot can start recording before discovery runs.
+
+    Returns:
+        list: One settings dict per camera with name, device, resolution, frame_rate and fourcc.
+    """
+    defaults = config.get("camera", {})
+    entries = config.get("cameras")
+    if not entries:
+        devices = discover_cameras() if discover else []
+        entries = [{"device": device} for device in devices] or [{"device": defaults.get("device", 0)}]
+
+    settings = []
+    for i, entry in enumerate(entries):
+        merged = dict(defaults)
+        merged.update(entry)
+        merged.setdefault("name", f"cam{i}")
+        merged.setdefault("device", i)
+        settings.append(merged)
+    return settings
+
+class FairWorkQueue:
+    """
+    Worker pool shared by all cameras that serves their jobs round-robin.
+
+    Each camera has its own FIFO; workers take the next job from the camera
+    after the one served last, so a camera with a long backlog cannot starve
+    the others.
+    """
+
+    def __init__(self, name, workers=1, background=True):
+        """
+        Args:
+            name (str): Pool name, used for thread names and log messages.
+            workers (int): Number of worker threads.
+            background (bool): Run workers at lowered CPU and I/O priority so capture comes first.
+        """
+        self.name = name
+        self.background = background
+        self._queues = OrderedDict()
+        self._condition = threading.Condition()
+        self._running = True
+        self._beats = [None] * workers  # Start of each worker's current job, None while idle
+        self._threads = [None] * workers
+        for slot in range(workers):
+            self._threads[slot] = self._spawn(slot)
+
+    def _spawn(self, slot):
+        thread = threading.Thread(target=self._work, args=(slot,), name=f"{self.name}-{slot}", daemon=True)
+        thread.start()
+        return thread
+
+    def submit(self, camera_name, func, *args, **kwargs):
+        """
+        Queue a job on behalf of a camera.
+
+        Args:
+            camera_name (str): Camera the job belongs to.
+            func (callable): Function to run on a worker thread.
+            *args, **kwargs: Arguments for the function.
+        """
+        with self._condition:
+            self._queues.setdefault(camera_name, deque()).append((func, args, kwargs))
+            self._condition.notify()
+
+    def pending(self):
+        """
+        Returns:
+            dict: Number of queued jobs per camera.
+        """
+        with self._condition:
+            return {name: len(jobs) for name, jobs in self._queues.items()}
+
+    def _next_job(self):
+        for camera_name, jobs in self._queues.items():
+            if jobs:
+                self._queues.move_to_end(camera_name)
+                return jobs.popleft()
+        return None
+
+    def _work(self, slot):
+        if self.background:
+            lower_thread_priority()
+        while True:
+            with self._condition:
+                self._beats[slot] = None
+                job = self._next_job()
+                while job is None and self._running:
+                    self._condition.wait()  # Idle workers sleep until submit() or shutdown()
+                    job = self._next_job()
+                if job is None:
+                    return
+                self._beats[slot] = time.monotonic()
+            func, args, kwargs = job
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                logger.exception("%s job %s failed", self.name, getattr(func, "__name__", func))
+            if self._threads[slot] is not threading.current_thread():
+                return  # Replaced by revive() while this job was stuck
+
+    def heartbeat(self):
+        """
+        Returns:
+            float: The current monotonic time, or the start of the longest-running
+                job, so a job stuck for longer than the stall time counts as a
+                stall; None if a worker has died.
+        """
+        if any(not thread.is_alive() for thread in self._threads):
+            return None
+        return min((beat for beat in self._beats if beat is not None), default=time.monotonic())
+
+    def revive(self, max_age):
+        """
+        Replace workers that have died or been stuck in one job for longer than max_age seconds.
+
+        A stuck worker cannot be interrupted; it is left to finish its job and
+        then exits, while its replacement carries on with the queue.
+
+        Returns:
+            int: Number of workers replaced.
+        """
+        now = time.monotonic()
+        replaced = 0
+        for slot, thread in enumerate(self._threads):
+            beat = self._beats[slot]
+            if not thread.is_alive() or (beat is not None and now - beat > max_age):
+                logger.warning("Replacing %s worker %d (%s).", self.name, slot,
+                               "stuck" if thread.is_alive() else "died")
+                self._beats[slot] = None
+                self._threads[slot] = self._spawn(slot)
+                replaced += 1
+        return replaced
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stop the workers once the queued jobs are done.
+
+        Args:
+            wait (bool): Block until the workers have exited.
+            timeout (float): Longest total wait in seconds (None = no limit).
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if wait:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            for thread in self._threads:
+                thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+class CameraPipeline:
+    """
+    Capture loop for a single camera.
+
+    Frames are read at the camera's configured rate, stamped with their
+    monotonic capture time, passed through the optional frame callback
+    (overlays) and written to fixed-length segments in the camera's own
+    directory. A FixedRateWriter repeats or drops frames so each segment
+    plays back at exactly the configured rate and in real time.
+
+    With the "v4l2" backend and passthrough enabled, a camera that delivers
+    MJPEG or H.264 has its packets written to the segment unchanged. Frames
+    are then only decoded (every ``decode_every`` packets, at reduced size)
+    when frame listeners need them, and overlays are not burned in.
+    """
+
+    def __init__(self, name, device=0, resolution=(1920, 1080), fps=30, fourcc=None,
+                 output_dir="segments/", segment_seconds=SEGMENT_SECONDS,
+                 frame_callback=None, on_segment_closed=None, on_segment_opened=None,
+                 backend="opencv", passthrough=False, decode_every=DECODE_EVERY, decode_reduction=2):
+        self.name = name
+        self.device = device
+        self.resolution = tuple(resolution)
+        self.fps = fps
+        self.fourcc = fourcc
+        self.output_dir = os.path.join(output_dir, name)
+        self.segment_seconds = segment_seconds
+        self.frame_callback = frame_callback
+        self.on_segment_closed = on_segment_closed
+        self.on_segment_opened = on_segment_opened
+        self.backend = backend
+        self.passthrough = passthrough
+        self.decode_every = decode_every
+        self.decode_reduction = decode_reduction
+        self.frame_listeners = []
+        self.raw_frame_listeners = []
+        self.camera = None
+        self.is_recording = False
+        self._writer = None
+        self._segment_path = None
+        self._segment_started = 0.0
+        self._thread = None
+        self._generation = 0  # Bumped whenever a capture thread is replaced; stale threads stop writing
+        self._segment_lock = threading.Lock()
+        self.last_frame = None
+        self.restarts = 0
+        self.meter = FrameRateMeter()
+        self.last_segment_stats = None
+
+    def start(self):
+        """
+        Open the camera and start capturing on a background thread.
+        """
+        if self.backend == "v4l2":
+            os.makedirs(self.output_dir, exist_ok=True)
+            # The configured fourcc is preferred; the defaults are fallbacks
+            formats = tuple(dict.fromkeys(((self.fourcc,) if self.fourcc else ()) + DEFAULT_FORMATS))
+            camera = V4L2Camera(self.device, self.resolution, self.fps, formats)
+            try:
+                camera.open()
+            except OSError as e:
+                raise RuntimeError(f"V4L2 camera {self.device} failed to open: {e}")
+        else:
+            camera = start_camera(self.resolution, self.output_dir, self.device, self.fps, self.fourcc)
+        self.camera = camera
+        self.is_recording = True
+        self._generation += 1
+        self.last_frame = time.monotonic()  # Opening the camera counts as a sign of life
+        # The capture thread owns the camera: only it reads from it, and it releases it when it exits
+        self._thread = threading.Thread(target=self._run, args=(self._generation, camera),
+                                        name=f"capture-{self.name}", daemon=True)
+        self._thread.start()
+
+    def add_frame_listener(self, listener, raw=False):
+        """
+        Register a callable that observes decoded frames as listener(camera_name, frame).
+
+        Listeners must return quickly; they run on the capture thread.
+
+        Args:
+            listener (callable): The listener.
+            raw (bool): Receive frames before the frame callback draws overlays
+                (for analysis, where changing overlay text would read as motion).
+        """
+        (self.raw_frame_listeners if raw else self.frame_listeners).append(listener)
+
+    def _notify_listeners(self, frame, raw=False):
+        for listener in (self.raw_frame_listeners if raw else self.frame_listeners):
+            listener(self.name, frame)
+
+    def stop(self, timeout=5):
+        """
+        Stop capturing, close the active segment and release the camera.
+
+        Args:
+            timeout (float): Seconds to wait for the capture thread to finish.
+        """
+        self.is_recording = False
+        self._retire_thread(timeout)
+
+    def restart(self, timeout=1.0):
+        """
+        Replace a stalled or dead capture thread: flush its segment, reopen the camera and resume.
+
+        A thread stuck in read() is abandoned rather than having its camera
+        released under it (releasing a capture while another thread reads it
+        can crash the process); it releases the camera itself once the read
+        returns. Until then the device may still be busy, in which case the
+        reopen fails and the supervisor retries after its backoff.
+
+        Raises:
+            RuntimeError: If the camera cannot be reopened.
+        """
+        self.restarts += 1
+        logger.warning("Restarting camera %s (restart %d).", self.name, self.restarts)
+        self.is_recording = False
+        self._retire_thread(timeout)
+        self.start()
+
+    def heartbeat(self):
+        """
+        Returns:
+            float: Monotonic time of the last captured frame, or None if the capture thread has died.
+        """
+        if not self.is_recording or self._thread is None or not self._thread.is_alive():
+            return None
+        return self.last_frame
+
+    def _retire_thread(self, timeout):
+        # Wait for the capture thread; if it does not return, detach it and close its segment from here
+        if self._thread is None:
+            return
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error("Camera %s capture thread did not stop; closing its segment.", self.name)
+            with self._segment_lock:
+                self._generation += 1
+                self._close_segment()
+        self._thread = None
+
+    def _release_camera(self, camera):
+        if self.backend == "v4l2":
+            camera.release()
+        else:
+            stop_camera(camera)
+        if self.camera is camera:
+            self.camera = None
+
+    @property
+    def is_passthrough(self):
+        return self.passthrough and self.backend == "v4l2" and self.camera is not None and self.camera.is_compressed
+
+    def _open_segment(self, frame_size, start_time):
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        self._segment_path = os.path.join(self.output_dir, f"{timestamp}.mp4")
+        sequence = 1
+        while os.path.exists(self._segment_path):
+            # A restart within the same second must not overwrite the segment it just closed
+            self._segment_path = os.path.join(self.output_dir, f"{timestamp}_{sequence}.mp4")
+            sequence += 1
+        if self.is_passthrough and self.camera.pixel_format == "H264":
+            # Inter-coded packets cannot be repeated or dropped; each keeps its V4L2 capture time instead
+            self._writer = PassthroughSegmentWriter(self._segment_path, "H264", self.fps, timestamps=True)
+        elif self.is_passthrough:
+            # Every MJPEG packet is a complete frame, so it can be repeated or dropped like a decoded one
+            self._writer = FixedRateWriter(PassthroughSegmentWriter(self._segment_path, "MJPG", self.fps),
+                                           self.fps, start_time)
+        else:
+            fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # Use 'mp4v' codec for .mp4 files
+            self._writer = FixedRateWriter(cv2.VideoWriter(self._segment_path, fourcc, float(self.fps), frame_size),
+                                           self.fps, start_time)
+        self._segment_started = start_time
+        logger.info("Camera %s recording segment: %s", self.name, self._segment_path)
+        if self.on_segment_opened:
+            self.on_segment_opened(self.name, self._segment_path)
+
+    def _write(self, frame, timestamp, keyframe=False):
+        started = time.monotonic()
+        cpu_started = time.thread_time()
+        if isinstance(self._writer, FixedRateWriter):
+            self._writer.write(frame, timestamp)
+        else:
+            self._writer.write(frame, timestamp, keyframe)
+        # Only the time this thread spent blocked counts: encoding and duplicate
+        # fills run on the CPU, while a busy SD card parks the thread in I/O wait
+        blocked = (time.monotonic() - started) - (time.thread_time() - cpu_started)
+        io_coordinator.record_capture_write(blocked)
+
+    def _close_segment(self, end_time=None):
+        """
+        Close the active segment at end_time (monotonic, defaults to now).
+
+        Returns:
+            float: The time the segment ended, used as the next segment's start.
+        """
+        if end_time is None:
+            end_time = time.monotonic()
+        if self._writer is None:
+            return end_time
+        if isinstance(self._writer, FixedRateWriter):
+            self._writer.finish(end_time)
+            self.last_segment_stats = self._writer.stats()
+            logger.info("Camera %s segment %s: capture %.2f fps, wrote %d frames (%d repeated, %d dropped)",
+                        self.name, self._segment_path, self.meter.fps, self.last_segment_stats["written"],
+                        self.last_segment_stats["duplicated"], self.last_segment_stats["dropped"])
+        self._writer.release()
+        self._writer = None
+        if self.on_segment_closed:
+            self.on_segment_closed(self.name, self._segment_path)
+        return end_time
+
+    @property
+    def current_segment(self):
+        """
+        Returns:
+            str: Path of the segment being written, or None between segments.
+        """
+        return self._segment_path if self._writer is not None else None
+
+    @property
+    def effective_fps(self):
+        """
+        Returns:
+            float: Frames per second actually delivered by the camera recently.
+        """
+        return self.meter.fps
+
+    def _run(self, generation, camera):
+        try:
+            if self.is_passthrough:
+                self._run_passthrough(generation, camera)
+            else:
+                self._run_decoded(generation, camera)
+        finally:
+            with self._segment_lock:
+                if generation == self._generation:
+                    self._close_segment()
+            self._release_camera(camera)
+
+    def _run_passthrough(self, generation, camera):
+        logger.info("Camera %s writing %s packets without re-encoding.", self.name, camera.pixel_format)
+        packet_count = 0
+        segment_start = None
+        while self.is_recording and generation == self._generation:
+            packet, timestamp, is_keyframe = camera.read_packet()
+            if packet is None:
+                logger.error("Camera %s failed to deliver a frame.", self.name)
+                break
+            self.last_frame = timestamp
+            self.meter.tick(timestamp)
+
+            with self._segment_lock:
+                if generation != self._generation:
+                    break  # Replaced by restart() while reading
+                # Segments may only start on a keyframe (every MJPEG frame is one)
+                if self._writer is not None and is_keyframe and timestamp - self._segment_started >= self.segment_seconds:
+                    segment_start = self._close_segment(timestamp)
+                if self._writer is None:
+                    if not is_keyframe:
+                        continue
+                    self._open_segment((camera.width, camera.height), segment_start or timestamp)
+                self._write(packet, timestamp, is_keyframe)
+
+            packet_count += 1
+            if (self.frame_listeners or self.raw_frame_listeners) and packet_count % self.decode_every == 0:
+                frame = camera.decode(packet, self.decode_reduction)
+                if frame is not None:
+                    # Passthrough frames carry no overlay, so raw and regular listeners see the same frame
+                    self._notify_listeners(frame, raw=True)
+                    self._notify_listeners(frame)
+
+    def _run_decoded(self, generation, camera):
+        frame_interval = 1.0 / self.fps
+        next_frame = time.monotonic()
+        segment_start = None
+        while self.is_recording and generation == self._generation:
+            ret, frame = camera.read()
+            timestamp = time.monotonic()  # Stamp before overlays so processing time does not skew it
+            if not ret:
+                logger.error("Camera %s failed to deliver a frame.", self.name)
+                break
+            self.last_frame = timestamp
+            self.meter.tick(timestamp)
+
+            self._notify_listeners(frame, raw=True)
+            if self.frame_callback:
+                frame = self.frame_callback(self.name, frame)
+            self._notify_listeners(frame)
+
+            with self._segment_lock:
+                if generation != self._generation:
+                    break  # Replaced by restart() while reading
+                if self._writer is not None and timestamp - self._segment_started >= self.segment_seconds:
+                    # The next segment starts where this one ends, so no time is lost between them
+                    segment_start = self._close_segment(self._segment_started + self.segment_seconds)
+                if self._writer is None:
+                    self._open_segment((frame.shape[1], frame.shape[0]), segment_start or timestamp)
+                self._write(frame, timestamp)
+
+            # Pace to the configured rate so a fast camera leaves CPU and USB bandwidth for the others
+            next_frame += frame_interval
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_frame = time.monotonic()
+
+class CameraManager:
+    """
+    Runs one capture pipeline per camera and shares compression and upload workers between them.
+    """
+
+    def __init__(self, settings, output_dir, frame_callback=None, on_segment_closed=None,
+                 on_segment_opened=None, on_segment_finished=None,
+                 compression_workers=1, upload_workers=1, segment_seconds=SEGMENT_SECONDS):
+        """
+        Args:
+            settings (list): Per-camera settings as returned by camera_configs().
+            output_dir (str): Root directory; each camera records into its own subdirectory.
+            frame_callback (callable): Called as frame_callback(camera_name, frame) for every frame.
+            on_segment_closed (callable): Called as on_segment_closed(camera_name, path) on a
+                compression worker whenever a segment is finished.
+            on_segment_opened (callable): Called as on_segment_opened(camera_name, path) on the
+                capture thread when a segment starts; must return quickly.
+            on_segment_finished (callable): Called as on_segment_finished(camera_name, path) on the
+                capture thread as soon as a segment is closed; must return quickly.
+            compression_workers (int): Size of the shared compression pool.
+            upload_workers (int): Size of the shared upload pool.
+            segment_seconds (int): Default segment length for cameras that do not set one.
+        """
+        self.output_dir = output_dir
+        self.frame_callback = frame_callback
+        self.on_segment_closed = on_segment_closed
+        self.on_segment_opened = on_segment_opened
+        self.on_segment_finished = on_segment_finished
+        self.segment_seconds = segment_seconds
+        self.compression_queue = FairWorkQueue("compression", compression_workers)
+        self.upload_queue = FairWorkQueue("upload", upload_workers)
+        self.pipelines = [self._pipeline(s) for s in settings]
+
+    def _pipeline(self, s):
+        return CameraPipeline(
+            s["name"], s["device"],
+            resolution=s.get("resolution", (1920, 1080)),
+            fps=s.get("frame_rate", 30),
+            fourcc=s.get("fourcc"),
+            output_dir=self.output_dir,
+            segment_seconds=s.get("segment_seconds", self.segment_seconds),
+            frame_callback=self.frame_callback,
+            on_segment_closed=self._segment_closed,
+            on_segment_opened=self.on_segment_opened,
+            backend=s.get("backend", "opencv"),
+            passthrough=s.get("passthrough", False),
+        )
+
+    def add_camera(self, settings):
+        """
+        Start recording from one more camera, e.g. one found by discovery after boot.
+
+        Args:
+            settings (dict): Camera settings as returned by camera_configs().
+
+        Returns:
+            CameraPipeline: The started pipeline.
+
+        Raises:
+            RuntimeError: If the camera cannot be opened; it is then not added.
+        """
+        pipeline = self._pipeline(settings)
+        pipeline.start()
+        self.pipelines.append(pipeline)
+        return pipeline
+
+    def start(self):
+        """
+        Start every camera. A camera that fails to open is logged and skipped.
+
+        Cameras are opened in parallel, since opening one and negotiating its
+        format can take a second or more, and the first segment should start
+        as soon as possible after boot.
+
+        Returns:
+            list: The pipelines that started.
+        """
+        started = []
+
+        def start_pipeline(pipeline):
+            try:
+                pipeline.start()
+                started.append(pipeline)
+            except RuntimeError as e:
+                logger.error("Camera %s not started: %s", pipeline.name, e)
+
+        openers = [threading.Thread(target=start_pipeline, args=(pipeline,), name=f"open-{pipeline.name}")
+                   for pipeline in self.pipelines]
+        for opener in openers:
+            opener.start()
+        for opener in openers:
+            opener.join()
+        return [pipeline for pipeline in self.pipelines if pipeline in started]
+
+    def stop(self, job_timeout=None):
+        """
+        Stop every camera, then let queued compression and upload jobs finish.
+
+        Args:
+            job_timeout (float): Seconds to wait for each job pool (None = until done).
+        """
+        for pipeline in self.pipelines:
+            pipeline.stop()
+        self.compression_queue.shutdown(timeout=job_timeout)
+        self.upload_queue.shutdown(timeout=job_timeout)
+
+    def submit_upload(self, camera_name, func, *args, **kwargs):
+        """
+        Queue an upload job on the shared upload pool.
+        """
+        self.upload_queue.submit(camera_name, func, *args, **kwargs)
+
+    def _segment_closed(self, camera_name, path):
+        if self.on_segment_finished:
+            self.on_segment_finished(camera_name, path)
+        if self.on_segment_closed:
+            self.compression_queue.submit(camera_name, self.on_segment_closed, camera_name, path)
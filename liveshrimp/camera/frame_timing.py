@@ -0,0 +1,144 @@
+import time
+from collections import deque
+
+MAX_FILL_SECONDS = 2.0  # Longest gap filled with repeated frames before the timeline is re-anchored
+
+class FrameRateMeter:
+    """
+    Measures the effective frame rate over a sliding window of capture timestamps.
+    """
+
+    def __init__(self, window=5.0):
+        self.window = window
+        self._stamps = deque()
+
+    def tick(self, timestamp):
+        """
+        Record a frame captured at the given monotonic time.
+        """
+        self._stamps.append(timestamp)
+        while timestamp - self._stamps[0] > self.window:
+            self._stamps.popleft()
+
+    @property
+    def fps(self):
+        """
+        Returns:
+            float: Frames per second over the window, or 0.0 with fewer than two frames.
+        """
+        if len(self._stamps) < 2:
+            return 0.0
+        span = self._stamps[-1] - self._stamps[0]
+        return (len(self._stamps) - 1) / span if span > 0 else 0.0
+
+class FixedRateWriter:
+    """
+    Writes frames at a constant output rate based on when they were captured.
+
+    Output frame k covers the interval starting at ``start_time + k / fps``.
+    A frame is written into the slot of its capture time; empty slots before
+    it are filled by repeating the previous frame, and a frame whose slot is
+    already filled is dropped. The recording therefore plays back in real
+    time however irregularly frames arrive.
+
+    Gaps longer than ``max_fill`` seconds (e.g. a camera stall) are only
+    filled up to that length, after which the timeline is moved forward, so
+    a long stall cannot block the capture thread writing duplicates.
+    """
+
+    def __init__(self, writer, fps, start_time=None, max_fill=MAX_FILL_SECONDS):
+        """
+        Args:
+            writer: Object with write(frame) and release(), e.g. cv2.VideoWriter.
+            fps (float): Output frame rate.
+            start_time (float): Monotonic time of the first output slot
+                (defaults to the first frame's timestamp).
+            max_fill (float): Longest gap in seconds filled with repeated frames.
+        """
+        self.writer = writer
+        self.fps = float(fps)
+        self.start_time = start_time
+        self.max_fill = max_fill
+        self.written = 0
+        self.duplicated = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.meter = FrameRateMeter()
+        self._last = None
+
+    def _slot(self, timestamp):
+        # The small epsilon keeps float error from pushing a frame into the previous slot
+        return int((timestamp - self.start_time) * self.fps + 1e-6)
+
+    def _fill_to(self, slot):
+        max_frames = int(self.max_fill * self.fps)
+        missing = slot - self.written
+        if missing > max_frames:
+            # Re-anchor so the frames after a long stall line up with their slots
+            self.skipped += missing - max_frames
+            self.start_time += (missing - max_frames) / self.fps
+            missing = max_frames
+        for _ in range(missing):
+            self.writer.write(self._last)
+        self.written += missing
+        self.duplicated += missing
+
+    def write(self, frame, timestamp=None):
+        """
+        Place a frame on the output timeline.
+
+        Args:
+            frame: Frame (or independently decodable packet) to write.
+            timestamp (float): Monotonic capture time (defaults to now).
+
+        Returns:
+            int: Number of output frames written for this call (0 if dropped).
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if self.start_time is None:
+            self.start_time = timestamp
+        self.meter.tick(timestamp)
+
+        slot = self._slot(timestamp)
+        if slot < self.written:
+            self.dropped += 1
+            return 0
+
+        before = self.written
+        if self._last is None:
+            self._last = frame  # A late first frame also covers the slots before it
+        self._fill_to(slot)
+        self.writer.write(frame)
+        self.written += 1
+        self._last = frame
+        return self.written - before
+
+    def finish(self, end_time=None):
+        """
+        Repeat the last frame up to end_time so the output covers the full wall-clock span.
+
+        Args:
+            end_time (float): Monotonic time the recording ends (defaults to now).
+        """
+        if self._last is None:
+            return
+        if end_time is None:
+            end_time = time.monotonic()
+        self._fill_to(self._slot(end_time))
+
+    def release(self):
+        self.writer.release()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Effective capture fps and the output frame counts.
+        """
+        return {
+            "capture_fps": round(self.meter.fps, 2),
+            "written": self.written,
+            "duplicated": self.duplicated,
+            "dropped": self.dropped,
+            "skipped": self.skipped,
+        }
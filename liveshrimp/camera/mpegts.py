@@ -0,0 +1,136 @@
+import struct
+
+# MPEG transport stream settings
+PACKET_SIZE = 188
+PAYLOAD_SIZE = PACKET_SIZE - 4
+CLOCK_RATE = 90000  # PES timestamps count 90 kHz ticks
+PTS_OFFSET = CLOCK_RATE // 10  # First timestamp, so the decoder clock (PCR) can lead the first frame
+PMT_PID = 0x1000
+VIDEO_PID = 0x100
+STREAM_TYPE_H264 = 0x1B
+
+def crc32_mpeg(data):
+    """
+    CRC-32/MPEG-2 of a PSI section (polynomial 0x04C11DB7, not reflected).
+    """
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) & 0xFFFFFFFF if crc & 0x80000000 else (crc << 1) & 0xFFFFFFFF
+    return crc
+
+def _section(table_id, table_id_extension, body):
+    # Section syntax with version 0, current, a single section
+    length = 5 + len(body) + 4
+    section = bytes([table_id, 0xB0 | (length >> 8), length & 0xFF]) + struct.pack(">HBBB", table_id_extension, 0xC1, 0, 0) + body
+    return section + struct.pack(">I", crc32_mpeg(section))
+
+def _pts_bytes(pts):
+    return bytes([
+        0x21 | ((pts >> 29) & 0x0E),
+        (pts >> 22) & 0xFF,
+        0x01 | ((pts >> 14) & 0xFE),
+        (pts >> 7) & 0xFF,
+        0x01 | ((pts << 1) & 0xFE),
+    ])
+
+def _pcr_bytes(base):
+    return bytes([
+        (base >> 25) & 0xFF,
+        (base >> 17) & 0xFF,
+        (base >> 9) & 0xFF,
+        (base >> 1) & 0xFF,
+        ((base & 1) << 7) | 0x7E,
+        0,
+    ])
+
+class TransportStreamMuxer:
+    """
+    Wraps compressed video packets in an MPEG transport stream carrying their capture times.
+
+    Raw H.264 has no timestamps, so a muxer reading it from a pipe can only
+    stamp packets with their arrival time. In a transport stream each packet
+    carries its own presentation time, which FFmpeg keeps when it remuxes the
+    stream (``-f mpegts -i pipe:0 -c:v copy``).
+
+    Camera H.264 has no B-frames, so decode and presentation order are the
+    same and only a PTS is written.
+    """
+
+    def __init__(self, output, stream_type=STREAM_TYPE_H264):
+        """
+        Args:
+            output: Writable binary stream, e.g. FFmpeg's stdin.
+            stream_type (int): PMT stream type of the video.
+        """
+        self.output = output
+        self.stream_type = stream_type
+        self._origin = None
+        self._continuity = {}
+
+    def _packets(self, pid, payload, adaptation=None):
+        """
+        Split a PES packet into transport packets; the first carries the
+        optional adaptation field body and the last is padded with stuffing.
+        """
+        packets = bytearray()
+        start = True
+        pos = 0
+        while start or pos < len(payload):
+            body = adaptation if start else None
+            space = PAYLOAD_SIZE - (0 if body is None else 1 + len(body))
+            chunk = payload[pos:pos + space]
+            pos += len(chunk)
+            stuffing = space - len(chunk)
+            if stuffing:
+                if body is None:
+                    # An empty adaptation field takes one byte, a flags byte a second
+                    body = b"" if stuffing == 1 else b"\x00" + b"\xff" * (stuffing - 2)
+                else:
+                    body += b"\xff" * stuffing
+            counter = self._continuity.get(pid, 0)
+            self._continuity[pid] = (counter + 1) & 0x0F
+            control = 0x10 if body is None else 0x30
+            packets += bytes([0x47, (0x40 if start else 0) | (pid >> 8), pid & 0xFF, control | counter])
+            if body is not None:
+                packets += bytes([len(body)]) + body
+            packets += chunk
+            start = False
+        return packets
+
+    def _table_packet(self, pid, section):
+        counter = self._continuity.get(pid, 0)
+        self._continuity[pid] = (counter + 1) & 0x0F
+        # A pointer field of 0 precedes the section; the rest of the packet is 0xFF filler
+        packet = bytes([0x47, 0x40 | (pid >> 8), pid & 0xFF, 0x10 | counter, 0]) + section
+        return packet.ljust(PACKET_SIZE, b"\xff")
+
+    def _tables(self):
+        pat = _section(0x00, 1, struct.pack(">HH", 1, 0xE000 | PMT_PID))
+        pmt = _section(0x02, 1, struct.pack(">HHBHH", 0xE000 | VIDEO_PID, 0xF000, self.stream_type,
+                                            0xE000 | VIDEO_PID, 0xF000))
+        return self._table_packet(0, pat) + self._table_packet(PMT_PID, pmt)
+
+    def write(self, data, timestamp, keyframe=False):
+        """
+        Write one access unit (a camera packet) captured at the given time.
+
+        Args:
+            data (bytes): The packet, e.g. one H.264 frame in Annex B format.
+            timestamp (float): Capture time in seconds (any clock, e.g. the V4L2 buffer time).
+            keyframe (bool): The packet starts a GOP; program tables are repeated before it.
+        """
+        if self._origin is None:
+            self._origin = timestamp
+            keyframe = True  # Tables must come first
+        ticks = round((timestamp - self._origin) * CLOCK_RATE)
+        pts = (ticks + PTS_OFFSET) & (2 ** 33 - 1)
+        header = b"\x00\x00\x01\xe0"
+        length = 8 + len(data)
+        header += struct.pack(">H", length if length <= 0xFFFF else 0)  # 0 = unbounded, allowed for video
+        header += bytes([0x80, 0x80, 5]) + _pts_bytes(pts)
+        adaptation = bytes([0x10 | (0x40 if keyframe else 0)]) + _pcr_bytes(max(0, ticks) & (2 ** 33 - 1))
+        out = bytearray(self._tables() if keyframe else b"")
+        out += self._packets(VIDEO_PID, header + data, adaptation)
+        self.output.write(out)
@@ -1,15 +1,19 @@
 import cv2
 import time
+import logging
 
-def add_overlay(frame, gps_data=None, speed=None, elevation=None):
+logger = logging.getLogger(__name__)
+
+def add_overlay(frame, gps_data=None, speed=None, elevation=None, battery=None):
     """
-    Adds overlay information (GPS, speed, elevation, time) onto a video frame.
+    Adds overlay information (GPS, speed, elevation, battery, time) onto a video frame.
 
     Args:
         frame (numpy.ndarray): The current video frame.
         gps_data (tuple or None): GPS coordinates as (latitude, longitude).
         speed (float or None): Current speed in m/s.
         elevation (float or None): Current elevation in meters.
+        battery (dict or None): Battery status as returned by get_battery_status().
 
     Returns:
         numpy.ndarray: The video frame with overlay information.
@@ -29,6 +33,8 @@ def add_overlay(frame, gps_data=None, speed=None, elevation=None):
         overlay_text.append(f"Speed: {speed:.2f} m/s")
     if elevation is not None:
         overlay_text.append(f"Elevation: {elevation:.2f} m")
+    if battery:
+        overlay_text.append(f"Battery: {battery['percentage']:.0f}%")
 
     # Add time of day
     overlay_text.append(f"Time: {time.strftime('%H:%M:%S')}")
@@ -80,4 +86,4 @@ def apply_overlay_to_video(input_path, output_path, gps_func, speed_func, elevat
     cap.release()
     out.release()
 
-    print(f"Video with overlay saved to {output_path}")
+    logger.info("Video with overlay saved to %s", output_path)
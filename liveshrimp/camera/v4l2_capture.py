@@ -0,0 +1,485 @@
+import os
+import cv2
+import mmap
+import errno
+import fcntl
+import ctypes
+import time
+import select
+import logging
+import tempfile
+import subprocess
+import numpy as np
+
+from mpegts import TransportStreamMuxer
+
+logger = logging.getLogger(__name__)
+
+# Formats tried in order of preference: compressed formats can be written without re-encoding
+DEFAULT_FORMATS = ("MJPG", "H264", "YUYV")
+COMPRESSED_FORMATS = ("MJPG", "H264")
+BUFFER_COUNT = 4  # Kernel buffers queued for the driver
+FRAGMENT_MICROSECONDS = 1_000_000  # Shortest MP4 fragment of a passthrough segment (MJPEG frames are all keyframes)
+
+# V4L2 constants (linux/videodev2.h)
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+V4L2_MEMORY_MMAP = 1
+V4L2_FIELD_ANY = 0
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_STREAMING = 0x04000000
+V4L2_BUF_FLAG_KEYFRAME = 0x00000008
+V4L2_BUF_FLAG_TIMESTAMP_MASK = 0x0000e000
+V4L2_BUF_FLAG_TIMESTAMP_MONOTONIC = 0x00002000
+
+def fourcc_code(fourcc):
+    """
+    Convert a four-character code (e.g. "MJPG") to its V4L2 integer value.
+    """
+    return ord(fourcc[0]) | (ord(fourcc[1]) << 8) | (ord(fourcc[2]) << 16) | (ord(fourcc[3]) << 24)
+
+def fourcc_name(code):
+    """
+    Convert a V4L2 pixel format value back to its four-character code.
+    """
+    return "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4))
+
+class v4l2_capability(ctypes.Structure):
+    _fields_ = [
+        ("driver", ctypes.c_char * 16),
+        ("card", ctypes.c_char * 32),
+        ("bus_info", ctypes.c_char * 32),
+        ("version", ctypes.c_uint32),
+        ("capabilities", ctypes.c_uint32),
+        ("device_caps", ctypes.c_uint32),
+        ("reserved", ctypes.c_uint32 * 3),
+    ]
+
+class v4l2_fmtdesc(ctypes.Structure):
+    _fields_ = [
+        ("index", ctypes.c_uint32),
+        ("type", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("description", ctypes.c_char * 32),
+        ("pixelformat", ctypes.c_uint32),
+        ("mbus_code", ctypes.c_uint32),
+        ("reserved", ctypes.c_uint32 * 3),
+    ]
+
+class v4l2_pix_format(ctypes.Structure):
+    _fields_ = [
+        ("width", ctypes.c_uint32),
+        ("height", ctypes.c_uint32),
+        ("pixelformat", ctypes.c_uint32),
+        ("field", ctypes.c_uint32),
+        ("bytesperline", ctypes.c_uint32),
+        ("sizeimage", ctypes.c_uint32),
+        ("colorspace", ctypes.c_uint32),
+        ("priv", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("ycbcr_enc", ctypes.c_uint32),
+        ("quantization", ctypes.c_uint32),
+        ("xfer_func", ctypes.c_uint32),
+    ]
+
+class _v4l2_format_union(ctypes.Union):
+    # The kernel union also holds structs with pointers, which sets its alignment
+    _fields_ = [
+        ("pix", v4l2_pix_format),
+        ("raw_data", ctypes.c_uint8 * 200),
+        ("_align", ctypes.c_void_p),
+    ]
+
+class v4l2_format(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("fmt", _v4l2_format_union),
+    ]
+
+class v4l2_fract(ctypes.Structure):
+    _fields_ = [
+        ("numerator", ctypes.c_uint32),
+        ("denominator", ctypes.c_uint32),
+    ]
+
+class v4l2_captureparm(ctypes.Structure):
+    _fields_ = [
+        ("capability", ctypes.c_uint32),
+        ("capturemode", ctypes.c_uint32),
+        ("timeperframe", v4l2_fract),
+        ("extendedmode", ctypes.c_uint32),
+        ("readbuffers", ctypes.c_uint32),
+        ("reserved", ctypes.c_uint32 * 4),
+    ]
+
+class _v4l2_streamparm_union(ctypes.Union):
+    _fields_ = [
+        ("capture", v4l2_captureparm),
+        ("raw_data", ctypes.c_uint8 * 200),
+    ]
+
+class v4l2_streamparm(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("parm", _v4l2_streamparm_union),
+    ]
+
+class v4l2_requestbuffers(ctypes.Structure):
+    _fields_ = [
+        ("count", ctypes.c_uint32),
+        ("type", ctypes.c_uint32),
+        ("memory", ctypes.c_uint32),
+        ("capabilities", ctypes.c_uint32),
+        ("flags", ctypes.c_uint8),
+        ("reserved", ctypes.c_uint8 * 3),
+    ]
+
+class timeval(ctypes.Structure):
+    _fields_ = [
+        ("tv_sec", ctypes.c_long),
+        ("tv_usec", ctypes.c_long),
+    ]
+
+class v4l2_timecode(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("frames", ctypes.c_uint8),
+        ("seconds", ctypes.c_uint8),
+        ("minutes", ctypes.c_uint8),
+        ("hours", ctypes.c_uint8),
+        ("userbits", ctypes.c_uint8 * 4),
+    ]
+
+class _v4l2_buffer_m(ctypes.Union):
+    _fields_ = [
+        ("offset", ctypes.c_uint32),
+        ("userptr", ctypes.c_ulong),
+        ("planes", ctypes.c_void_p),
+        ("fd", ctypes.c_int32),
+    ]
+
+class v4l2_buffer(ctypes.Structure):
+    _fields_ = [
+        ("index", ctypes.c_uint32),
+        ("type", ctypes.c_uint32),
+        ("bytesused", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("field", ctypes.c_uint32),
+        ("timestamp", timeval),
+        ("timecode", v4l2_timecode),
+        ("sequence", ctypes.c_uint32),
+        ("memory", ctypes.c_uint32),
+        ("m", _v4l2_buffer_m),
+        ("length", ctypes.c_uint32),
+        ("reserved2", ctypes.c_uint32),
+        ("request_fd", ctypes.c_int32),
+    ]
+
+def _ioc(direction, number, struct_type):
+    return (direction << 30) | (ctypes.sizeof(struct_type) << 16) | (ord("V") << 8) | number
+
+_IOC_WRITE = 1
+_IOC_READ = 2
+VIDIOC_QUERYCAP = _ioc(_IOC_READ, 0, v4l2_capability)
+VIDIOC_ENUM_FMT = _ioc(_IOC_READ | _IOC_WRITE, 2, v4l2_fmtdesc)
+VIDIOC_S_FMT = _ioc(_IOC_READ | _IOC_WRITE, 5, v4l2_format)
+VIDIOC_REQBUFS = _ioc(_IOC_READ | _IOC_WRITE, 8, v4l2_requestbuffers)
+VIDIOC_QUERYBUF = _ioc(_IOC_READ | _IOC_WRITE, 9, v4l2_buffer)
+VIDIOC_QBUF = _ioc(_IOC_READ | _IOC_WRITE, 15, v4l2_buffer)
+VIDIOC_DQBUF = _ioc(_IOC_READ | _IOC_WRITE, 17, v4l2_buffer)
+VIDIOC_STREAMON = _ioc(_IOC_WRITE, 18, ctypes.c_int)
+VIDIOC_STREAMOFF = _ioc(_IOC_WRITE, 19, ctypes.c_int)
+VIDIOC_S_PARM = _ioc(_IOC_READ | _IOC_WRITE, 22, v4l2_streamparm)
+
+def device_path(device):
+    """
+    Turn a camera index into its /dev/video path; paths are returned unchanged.
+    """
+    return f"/dev/video{device}" if isinstance(device, int) else device
+
+def is_capture_device(device):
+    """
+    Check a device's V4L2 capabilities without starting it.
+
+    Only VIDIOC_QUERYCAP is issued, so metadata, codec and ISP nodes are told
+    apart from cameras without negotiating a format or allocating buffers.
+
+    Args:
+        device (int or str): Camera index or device path.
+
+    Returns:
+        bool: True if the node can stream video capture.
+    """
+    try:
+        fd = os.open(device_path(device), os.O_RDWR | os.O_NONBLOCK)
+    except OSError:
+        return False
+    try:
+        cap = v4l2_capability()
+        fcntl.ioctl(fd, VIDIOC_QUERYCAP, cap)
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+    caps = cap.device_caps or cap.capabilities
+    return bool(caps & V4L2_CAP_VIDEO_CAPTURE and caps & V4L2_CAP_STREAMING)
+
+class V4L2Camera:
+    """
+    Camera read directly through V4L2 with memory-mapped buffers.
+
+    The first format from ``formats`` that the camera supports is used. For
+    MJPEG and H.264 the compressed packets can be taken as-is with
+    read_packet(); read() decodes to BGR like cv2.VideoCapture.read().
+    """
+
+    def __init__(self, device=0, resolution=(1920, 1080), fps=30, formats=DEFAULT_FORMATS, buffer_count=BUFFER_COUNT):
+        self.device = device_path(device)
+        self.resolution = tuple(resolution)
+        self.fps = fps
+        self.formats = formats
+        self.buffer_count = buffer_count
+        self.pixel_format = None
+        self.width = None
+        self.height = None
+        self._fd = None
+        self._buffers = []
+
+    def _ioctl(self, request, arg):
+        fcntl.ioctl(self._fd, request, arg)
+
+    def supported_formats(self):
+        """
+        List the pixel formats the device can capture.
+
+        Returns:
+            list: Four-character codes such as "MJPG" or "YUYV".
+        """
+        formats = []
+        desc = v4l2_fmtdesc(type=V4L2_BUF_TYPE_VIDEO_CAPTURE)
+        while True:
+            try:
+                self._ioctl(VIDIOC_ENUM_FMT, desc)
+            except OSError:
+                return formats
+            formats.append(fourcc_name(desc.pixelformat))
+            desc.index += 1
+
+    def open(self):
+        """
+        Open the device, negotiate the format and start streaming.
+
+        Raises:
+            RuntimeError: If the device cannot stream any of the requested formats.
+        """
+        self._fd = os.open(self.device, os.O_RDWR | os.O_NONBLOCK)
+        try:
+            cap = v4l2_capability()
+            self._ioctl(VIDIOC_QUERYCAP, cap)
+            caps = cap.device_caps or cap.capabilities
+            if not caps & V4L2_CAP_VIDEO_CAPTURE or not caps & V4L2_CAP_STREAMING:
+                raise RuntimeError(f"{self.device} is not a streaming capture device.")
+
+            supported = self.supported_formats()
+            chosen = next((f for f in self.formats if f in supported), None)
+            if chosen is None:
+                raise RuntimeError(f"{self.device} supports none of {self.formats} (has {supported}).")
+
+            fmt = v4l2_format(type=V4L2_BUF_TYPE_VIDEO_CAPTURE)
+            fmt.fmt.pix.width, fmt.fmt.pix.height = self.resolution
+            fmt.fmt.pix.pixelformat = fourcc_code(chosen)
+            fmt.fmt.pix.field = V4L2_FIELD_ANY
+            self._ioctl(VIDIOC_S_FMT, fmt)
+            # The driver may adjust the request to the nearest supported mode
+            self.pixel_format = fourcc_name(fmt.fmt.pix.pixelformat)
+            self.width, self.height = fmt.fmt.pix.width, fmt.fmt.pix.height
+
+            parm = v4l2_streamparm(type=V4L2_BUF_TYPE_VIDEO_CAPTURE)
+            parm.parm.capture.timeperframe.numerator = 1
+            parm.parm.capture.timeperframe.denominator = int(self.fps)
+            try:
+                self._ioctl(VIDIOC_S_PARM, parm)
+            except OSError as e:
+                logger.warning("%s does not accept a frame rate: %s", self.device, e)
+
+            self._map_buffers()
+            self._ioctl(VIDIOC_STREAMON, ctypes.c_int(V4L2_BUF_TYPE_VIDEO_CAPTURE))
+        except Exception:
+            self.release()
+            raise
+
+        logger.info("V4L2 camera %s streaming %s at %dx%d.", self.device, self.pixel_format, self.width, self.height)
+
+    def _map_buffers(self):
+        req = v4l2_requestbuffers(count=self.buffer_count, type=V4L2_BUF_TYPE_VIDEO_CAPTURE, memory=V4L2_MEMORY_MMAP)
+        self._ioctl(VIDIOC_REQBUFS, req)
+        for index in range(req.count):
+            buf = v4l2_buffer(index=index, type=V4L2_BUF_TYPE_VIDEO_CAPTURE, memory=V4L2_MEMORY_MMAP)
+            self._ioctl(VIDIOC_QUERYBUF, buf)
+            self._buffers.append(mmap.mmap(self._fd, buf.length, mmap.MAP_SHARED,
+                                           mmap.PROT_READ | mmap.PROT_WRITE, offset=buf.m.offset))
+            self._ioctl(VIDIOC_QBUF, buf)
+
+    @property
+    def is_compressed(self):
+        return self.pixel_format in COMPRESSED_FORMATS
+
+    def isOpened(self):
+        return self._fd is not None
+
+    def get(self, prop):
+        """
+        Mirror the cv2.VideoCapture properties the pipeline reads.
+        """
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return 0
+
+    def read_packet(self, timeout=2.0):
+        """
+        Dequeue the next frame exactly as the camera delivered it.
+
+        The data is copied out of the mmap buffer and the buffer is handed
+        straight back to the driver.
+
+        Args:
+            timeout (float): Seconds to wait for a frame.
+
+        Returns:
+            tuple: (data bytes, monotonic capture time in seconds, is_keyframe),
+                or (None, None, False) on timeout.
+        """
+        buf = v4l2_buffer(type=V4L2_BUF_TYPE_VIDEO_CAPTURE, memory=V4L2_MEMORY_MMAP)
+        while True:
+            try:
+                self._ioctl(VIDIOC_DQBUF, buf)
+                break
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+                ready, _, _ = select.select([self._fd], [], [], timeout)
+                if not ready:
+                    return None, None, False
+
+        data = self._buffers[buf.index][:buf.bytesused]
+        self._ioctl(VIDIOC_QBUF, buf)
+        # Most drivers stamp buffers with CLOCK_MONOTONIC, the same clock as time.monotonic()
+        if buf.flags & V4L2_BUF_FLAG_TIMESTAMP_MASK == V4L2_BUF_FLAG_TIMESTAMP_MONOTONIC:
+            timestamp = buf.timestamp.tv_sec + buf.timestamp.tv_usec / 1e6
+        else:
+            timestamp = time.monotonic()
+        is_keyframe = self.pixel_format == "MJPG" or bool(buf.flags & V4L2_BUF_FLAG_KEYFRAME)
+        return data, timestamp, is_keyframe
+
+    def decode(self, data, reduction=1):
+        """
+        Decode a packet to a BGR frame.
+
+        Args:
+            data (bytes): Packet from read_packet().
+            reduction (int): 1, 2, 4 or 8. MJPEG is decoded directly at the
+                reduced size, which is far cheaper than a full decode.
+
+        Returns:
+            numpy.ndarray: The frame, or None if it could not be decoded.
+        """
+        if self.pixel_format == "MJPG":
+            flags = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                     4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}[reduction]
+            return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+        if self.pixel_format == "YUYV":
+            yuyv = np.frombuffer(data, dtype=np.uint8).reshape(self.height, self.width, 2)
+            frame = cv2.cvtColor(yuyv, cv2.COLOR_YUV2BGR_YUYV)
+            return frame[::reduction, ::reduction] if reduction > 1 else frame
+        return None  # H.264 packets depend on each other and are not decoded individually
+
+    def read(self):
+        """
+        Read and decode the next frame, like cv2.VideoCapture.read().
+
+        Returns:
+            tuple: (success, frame)
+        """
+        data, _, _ = self.read_packet()
+        if data is None:
+            return False, None
+        frame = self.decode(data)
+        return frame is not None, frame
+
+    def release(self):
+        """
+        Stop streaming, unmap the buffers and close the device.
+        """
+        if self._fd is None:
+            return
+        try:
+            self._ioctl(VIDIOC_STREAMOFF, ctypes.c_int(V4L2_BUF_TYPE_VIDEO_CAPTURE))
+        except OSError:
+            pass
+        for buffer in self._buffers:
+            buffer.close()
+        self._buffers = []
+        os.close(self._fd)
+        self._fd = None
+
+class PassthroughSegmentWriter:
+    """
+    Writes a camera's compressed packets into an MP4 segment without re-encoding.
+
+    Packets are piped to FFmpeg, which only remuxes them (``-c:v copy``).
+    With ``timestamps`` each packet is written with its V4L2 buffer time
+    inside an MPEG transport stream (see TransportStreamMuxer), giving a
+    variable-frame-rate file whose frames sit at the moments they were
+    captured; this is used for H.264, whose packets cannot be repeated or
+    dropped. Without it the packets are read at the nominal frame rate.
+    """
+
+    def __init__(self, output_file, pixel_format, fps, timestamps=False):
+        if timestamps:
+            timing = ["-f", "mpegts"]
+        else:
+            timing = ["-f", {"MJPG": "mjpeg", "H264": "h264"}[pixel_format], "-framerate", str(fps)]
+        command = [
+            "ffmpeg", "-y", "-v", "error",
+            *timing,
+            "-i", "pipe:0",
+            "-c:v", "copy",
+            # Fragmented: closing a segment must not rewrite it to move the index to the front,
+            # which would block the capture thread for seconds at every rollover
+            "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+            "-min_frag_duration", str(FRAGMENT_MICROSECONDS),
+            output_file
+        ]
+        self.output_file = output_file
+        # FFmpeg's messages go to a file, not a pipe nobody reads until the end, so they can never block it
+        self._errors = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self._errors)
+        self._muxer = TransportStreamMuxer(self._process.stdin) if timestamps else None
+
+    def write(self, packet, timestamp=None, keyframe=False):
+        """
+        Write one packet.
+
+        Args:
+            packet (bytes): Packet from V4L2Camera.read_packet().
+            timestamp (float): Its capture time; required when writing with timestamps.
+            keyframe (bool): Whether the packet is a keyframe.
+        """
+        if self._muxer:
+            self._muxer.write(packet, timestamp, keyframe)
+        else:
+            self._process.stdin.write(packet)
+
+    def release(self):
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass  # FFmpeg already exited; its messages say why
+        if self._process.wait() != 0:
+            self._errors.seek(0)
+            logger.error("FFmpeg failed to write %s: %s", self.output_file, self._errors.read().decode(errors="replace"))
+        self._errors.close()
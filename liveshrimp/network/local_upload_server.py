@@ -0,0 +1,98 @@
+import os
+import json
+import logging
+import argparse
+import email.parser
+import email.policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from upload_bundler import ChunkedReader, unpack_bundle
+
+logger = logging.getLogger(__name__)
+
+class LimitedReader:
+    """
+    Read at most a fixed number of bytes from a stream (a request body with Content-Length).
+    """
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size=-1):
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.stream.read(size) if size else b""
+        self.remaining -= len(data)
+        return data
+
+class UploadHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in for the upload server: accepts single multipart uploads on
+    /upload and tar bundles on /bundle, storing files in the server's directory.
+    """
+
+    def _body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            return ChunkedReader(self.rfile)
+        return LimitedReader(self.rfile, int(self.headers.get("Content-Length", 0)))
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path.startswith("/bundle"):
+            received = unpack_bundle(self._body(), self.server.storage_dir)
+            logger.info("Bundle from %s: %d files", self.client_address[0], len(received))
+            self._reply(200, {"received": received})
+        elif self.path.startswith("/upload"):
+            self._receive_multipart()
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def _receive_multipart(self):
+        # The stand-in parses the whole form in memory; fine for testing, not for production traffic
+        head = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(head + self._body().read())
+        fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+        if "file" not in fields:
+            self._reply(400, {"error": "missing file"})
+            return
+        name = os.path.basename(fields["file"].get_filename() or "upload.bin")
+        with open(os.path.join(self.server.storage_dir, name), "wb") as f:
+            f.write(fields["file"].get_payload(decode=True))
+        if "metadata" in fields:
+            with open(os.path.join(self.server.storage_dir, name + ".json"), "wb") as f:
+                f.write(fields["metadata"].get_payload(decode=True))
+        logger.info("Upload from %s: %s", self.client_address[0], name)
+        self._reply(200, {"received": [name]})
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+def serve(storage_dir, host="0.0.0.0", port=8000):
+    """
+    Run the stand-in upload server until interrupted.
+    """
+    os.makedirs(storage_dir, exist_ok=True)
+    server = ThreadingHTTPServer((host, port), UploadHandler)
+    server.storage_dir = storage_dir
+    logger.info("Upload server stand-in on %s:%d storing into %s", host, port, storage_dir)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the upload server.")
+    parser.add_argument("storage_dir", help="Directory to store received files in.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    serve(args.storage_dir, args.host, args.port)
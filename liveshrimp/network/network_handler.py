@@ -1,8 +1,12 @@
 import os
-import time
+import logging
 import subprocess
-import requests
-from schedule import every, run_pending
+
+import backends
+from storage_handler import remove_from_index
+from task_scheduler import TaskScheduler
+
+logger = logging.getLogger(__name__)
 
 def check_connectivity(url="http://google.com", timeout=5):
     """
@@ -15,11 +19,7 @@ def check_connectivity(url="http://google.com", timeout=5):
     Returns:
         bool: True if connected, False otherwise.
     """
-    try:
-        requests.get(url, timeout=timeout)
-        return True
-    except (requests.ConnectionError, requests.Timeout):
-        return False
+    return backends.transport.reachable(url, timeout)
 
 def start_live_stream(camera_stream_url, restreamer_url):
     """
@@ -53,15 +53,11 @@ def upload_video(file_path, upload_url):
     Returns:
         bool: True if upload was successful, False otherwise.
     """
-    try:
-        with open(file_path, 'rb') as video_file:
-            response = requests.post(upload_url, files={"file": video_file})
-            response.raise_for_status()
-        print(f"Uploaded: {file_path}")
+    if backends.transport.upload(file_path, upload_url):
+        logger.info("Uploaded: %s", file_path)
         return True
-    except requests.RequestException as e:
-        print(f"Upload failed for {file_path}: {e}")
-        return False
+    logger.error("Upload failed for %s", file_path)
+    return False
 
 def upload_offline_videos(video_folder, upload_url):
     """
@@ -71,17 +67,18 @@ def upload_offline_videos(video_folder, upload_url):
         video_folder (str): Path to the folder containing video files.
         upload_url (str): URL where the videos will be uploaded.
     """
-    for file_name in sorted(os.listdir(video_folder)):
+    for file_name in sorted(backends.filesystem.listdir(video_folder)):
         if file_name.endswith(".mp4"):
             file_path = os.path.join(video_folder, file_name)
             if upload_video(file_path, upload_url):
-                os.remove(file_path)  # Delete the file after successful upload
-                print(f"Deleted: {file_path}")
+                backends.filesystem.remove(file_path)  # Delete the file after successful upload
+                remove_from_index([file_path])
+                logger.info("Deleted: %s", file_path)
             else:
-                print(f"Retry needed for: {file_path}")
+                logger.warning("Retry needed for: %s", file_path)
                 break
 
-def manage_network(camera_stream_url, restreamer_url, video_folder, upload_url, check_interval=10):
+def manage_network(camera_stream_url, restreamer_url, video_folder, upload_url, check_interval=10, scheduler=None):
     """
     Manage live streaming and video uploads based on network status.
 
@@ -91,39 +88,49 @@ def manage_network(camera_stream_url, restreamer_url, video_folder, upload_url,
         video_folder (str): Path to the folder containing offline video files.
         upload_url (str): URL for uploading video files.
         check_interval (int): Interval (in seconds) to check network connectivity.
+        scheduler (TaskScheduler): Scheduler to add the check to. Without one,
+            the checks run in the calling thread, which does not return.
+
+    Returns:
+        Job: The scheduled job, when a scheduler is given.
     """
-    is_streaming = False
-    ffmpeg_process = None
+    state = {"process": None}
 
-    while True:
+    def check_network():
         if check_connectivity():
-            if not is_streaming:
-                print("Starting live stream...")
-                ffmpeg_process = start_live_stream(camera_stream_url, restreamer_url)
-                is_streaming = True
+            if state["process"] is None:
+                logger.info("Starting live stream...")
+                state["process"] = start_live_stream(camera_stream_url, restreamer_url)
 
             # Upload offline videos in the background
             upload_offline_videos(video_folder, upload_url)
-        else:
-            if is_streaming:
-                print("Stopping live stream due to lost connectivity...")
-                if ffmpeg_process:
-                    ffmpeg_process.terminate()
-                    ffmpeg_process = None
-                is_streaming = False
+        elif state["process"] is not None:
+            logger.warning("Stopping live stream due to lost connectivity...")
+            state["process"].terminate()
+            state["process"] = None
 
-        time.sleep(check_interval)
+    return _run_periodically(scheduler, check_interval, check_network, name="network", delay=0)
 
 # Scheduled task to retry offline uploads
-def schedule_offline_uploads(video_folder, upload_url):
+def schedule_offline_uploads(video_folder, upload_url, scheduler=None):
     """
     Schedule uploads of offline videos to run periodically.
 
     Args:
         video_folder (str): Path to the folder containing offline video files.
         upload_url (str): URL for uploading video files.
+        scheduler (TaskScheduler): Scheduler to add the uploads to. Without one,
+            they run in the calling thread, which does not return.
+
+    Returns:
+        Job: The scheduled job, when a scheduler is given.
     """
-    every(10).minutes.do(upload_offline_videos, video_folder, upload_url)
-    while True:
-        run_pending()
-        time.sleep(1)
+    return _run_periodically(scheduler, 10 * 60, upload_offline_videos, video_folder, upload_url,
+                             name="offline-uploads", jitter=60)
+
+def _run_periodically(scheduler, interval, func, *args, **kwargs):
+    if scheduler is not None:
+        return scheduler.every(interval, func, *args, **kwargs)
+    scheduler = TaskScheduler(workers=0)
+    scheduler.every(interval, func, *args, **kwargs)
+    scheduler.run()
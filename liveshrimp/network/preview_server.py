@@ -0,0 +1,363 @@
+import os
+import cv2
+import math
+import asyncio
+import logging
+import tempfile
+import threading
+import subprocess
+from urllib.parse import unquote
+
+from thumbnail_extractor import probe_duration, is_segment
+from io_scheduler import background_command
+
+logger = logging.getLogger(__name__)
+
+# Preview settings
+PREVIEW_WIDTH = 640
+PREVIEW_FPS = 5
+JPEG_QUALITY = 70
+HLS_SEGMENTS = 5  # Closed segments listed in the rolling playlist
+BOUNDARY = "liveshrimpframe"
+CHUNK_SIZE = 64 * 1024
+TEMP_SUFFIX = ".tmp"  # HLS conversions in progress
+
+INDEX_PAGE = """<!DOCTYPE html>
+<html><head><meta name="viewport" content="width=device-width, initial-scale=1"><title>liveshrimp preview</title></head>
+<body style="background:#111;color:#eee;font-family:sans-serif">
+{cameras}
+</body></html>
+"""
+CAMERA_BLOCK = """<h2>{name}</h2>
+<img src="/stream/{name}.mjpg" style="max-width:100%">
+<p><a href="/hls/{name}/index.m3u8" style="color:#8cf">Recent segments (HLS)</a></p>
+"""
+
+class PreviewHub:
+    """
+    Shares one low-resolution JPEG per camera between all preview clients.
+
+    Capture threads hand over frames with publish(), which only keeps a
+    reference and does nothing while nobody is watching. While a camera has
+    viewers, a single encoder task resizes and JPEG-encodes its newest frame
+    at the preview rate; every client is sent the same encoded bytes.
+    """
+
+    def __init__(self, width=PREVIEW_WIDTH, fps=PREVIEW_FPS, quality=JPEG_QUALITY):
+        self.width = width
+        self.fps = fps
+        self.quality = quality
+        self._lock = threading.Lock()
+        self._known = set()
+        self._latest = {}  # camera -> newest raw frame
+        self._viewers = {}  # camera -> number of connected clients
+        self._jpeg = {}  # camera -> (sequence, encoded bytes)
+        self._updated = {}  # camera -> asyncio.Condition
+        self._encoders = {}  # camera -> encoder task
+
+    def publish(self, camera_name, frame):
+        """
+        Offer a captured frame for preview (frame listener for CameraPipeline).
+        """
+        self._known.add(camera_name)
+        if self._viewers.get(camera_name):
+            with self._lock:
+                self._latest[camera_name] = frame
+
+    def cameras(self):
+        return sorted(self._known)
+
+    def _encode(self, frame):
+        height = int(frame.shape[0] * self.width / frame.shape[1])
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        ok, jpeg = cv2.imencode(".jpg", small, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        return jpeg.tobytes() if ok else None
+
+    async def _encode_loop(self, camera_name):
+        loop = asyncio.get_running_loop()
+        condition = self._updated[camera_name]
+        sequence = 0
+        last_frame = None
+        while self._viewers.get(camera_name):
+            with self._lock:
+                frame = self._latest.get(camera_name)
+            if frame is not None and frame is not last_frame:
+                last_frame = frame
+                jpeg = await loop.run_in_executor(None, self._encode, frame)
+                if jpeg:
+                    sequence += 1
+                    self._jpeg[camera_name] = (sequence, jpeg)
+                    async with condition:
+                        condition.notify_all()
+            await asyncio.sleep(1.0 / self.fps)
+        with self._lock:
+            self._latest.pop(camera_name, None)
+        # Sequence numbers restart with the next encoder, so its viewers must not be handed this session's frame
+        self._jpeg.pop(camera_name, None)
+        self._encoders.pop(camera_name, None)
+
+    def register(self, camera_name):
+        """
+        Add a viewer; starts the camera's encoder if it is the first one. Must run on the server loop.
+        """
+        self._viewers[camera_name] = self._viewers.get(camera_name, 0) + 1
+        self._updated.setdefault(camera_name, asyncio.Condition())
+        if camera_name not in self._encoders:
+            self._encoders[camera_name] = asyncio.get_running_loop().create_task(self._encode_loop(camera_name))
+
+    def unregister(self, camera_name):
+        self._viewers[camera_name] -= 1
+
+    async def next_jpeg(self, camera_name, after=0):
+        """
+        Wait for an encoded frame newer than the given sequence number.
+
+        Returns:
+            tuple: (sequence, JPEG bytes)
+        """
+        condition = self._updated[camera_name]
+        async with condition:
+            await condition.wait_for(lambda: self._jpeg.get(camera_name, (0, None))[0] > after)
+        return self._jpeg[camera_name]
+
+class HlsPlaylist:
+    """
+    Rolling HLS playlist over the newest closed segments of one camera.
+
+    Segments are turned into MPEG-TS on first request and cached: H.264
+    segments are only remuxed, others are transcoded once at preview size.
+    """
+
+    def __init__(self, pipeline, width=PREVIEW_WIDTH, size=HLS_SEGMENTS):
+        self.pipeline = pipeline
+        self.width = width
+        self.size = size
+        self.cache_dir = os.path.join(pipeline.output_dir, "hls")
+        self._sequence = {}  # segment name -> media sequence number
+        self._durations = {}
+
+    def segments(self):
+        current = os.path.basename(self.pipeline.current_segment or "")
+        names = sorted(f for f in os.listdir(self.pipeline.output_dir) if is_segment(f) and f != current)
+        for name in names:
+            self._sequence.setdefault(name, len(self._sequence))
+        return names[-self.size:]
+
+    def playlist(self):
+        """
+        Returns:
+            str: The m3u8 playlist text.
+        """
+        names = self.segments()
+        durations = []
+        for name in names:
+            if name not in self._durations:
+                path = os.path.join(self.pipeline.output_dir, name)
+                self._durations[name] = probe_duration(path) or self.pipeline.segment_seconds
+            durations.append(self._durations[name])
+
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{math.ceil(max(durations, default=self.pipeline.segment_seconds))}",
+            f"#EXT-X-MEDIA-SEQUENCE:{self._sequence[names[0]] if names else 0}",
+        ]
+        for name, duration in zip(names, durations):
+            lines.append(f"#EXTINF:{duration:.3f},")
+            lines.append(os.path.splitext(name)[0] + ".ts")
+        return "\n".join(lines) + "\n"
+
+    def transport_stream(self, ts_name):
+        """
+        Get the cached MPEG-TS for a playlist entry, creating it if needed. Blocking.
+
+        Returns:
+            str: Path to the .ts file, or None if the segment is not in the playlist.
+        """
+        source_name = os.path.splitext(ts_name)[0] + ".mp4"
+        names = self.segments()
+        if source_name not in names:
+            return None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        target = os.path.join(self.cache_dir, ts_name)
+        if not os.path.exists(target):
+            source = os.path.join(self.pipeline.output_dir, source_name)
+            # Each request converts into its own temporary file, so concurrent requests cannot clobber each other
+            fd, temporary = tempfile.mkstemp(prefix=ts_name + ".", suffix=TEMP_SUFFIX, dir=self.cache_dir)
+            os.close(fd)
+            try:
+                # The bitstream filter rejects anything but H.264, which then falls through to a transcode
+                remux = ["-c:v", "copy", "-bsf:v", "h264_mp4toannexb"]
+                transcode = ["-c:v", "libx264", "-preset", "ultrafast", "-vf", f"scale={self.width}:-2"]
+                for codec_args in (remux, transcode):
+                    command = ["ffmpeg", "-y", "-v", "error", "-i", source, *codec_args, "-an", "-f", "mpegts", temporary]
+                    if subprocess.run(background_command(command), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0:
+                        os.replace(temporary, target)
+                        break
+                else:
+                    logger.error("Could not prepare %s for HLS preview.", source)
+                    return None
+            except OSError as e:
+                logger.error("Could not prepare %s for HLS preview: %s", source, e)
+                return None
+            finally:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+
+        # Drop cached streams that have rolled out of the playlist; conversions in progress are left alone
+        keep = {os.path.splitext(n)[0] + ".ts" for n in names}
+        for cached in os.listdir(self.cache_dir):
+            if cached not in keep and not cached.endswith(TEMP_SUFFIX):
+                try:
+                    os.remove(os.path.join(self.cache_dir, cached))
+                except FileNotFoundError:
+                    pass  # Removed by a concurrent request
+        return target
+
+class PreviewServer:
+    """
+    Minimal asyncio HTTP server for on-site preview.
+
+    Routes:
+        /                          Page with every camera's live view.
+        /stream/<camera>.mjpg      Live MJPEG stream.
+        /snapshot/<camera>.jpg     Single current frame.
+        /hls/<camera>/index.m3u8   Rolling HLS playlist of recent segments.
+    """
+
+    def __init__(self, hub, pipelines=(), host="0.0.0.0", port=8080):
+        self.hub = hub
+        self.host = host
+        self.port = port
+        self.pipelines = {p.name: p for p in pipelines}
+        self.playlists = {p.name: HlsPlaylist(p, hub.width) for p in pipelines}
+
+    async def _send_response(self, writer, status, content_type, body=b""):
+        headers = (
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Cache-Control: no-cache\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(headers.encode() + body)
+        await writer.drain()
+
+    async def _send_file(self, writer, path, content_type):
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            # Rolled out of the playlist and dropped from the cache since it was prepared
+            await self._send_response(writer, "404 Not Found", "text/plain", b"Not found\n")
+            return
+        with f:
+            writer.write((
+                "HTTP/1.1 200 OK\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {os.fstat(f.fileno()).st_size}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode())
+            await writer.drain()
+            await asyncio.get_running_loop().sendfile(writer.transport, f)
+
+    async def _stream_mjpeg(self, writer, camera_name):
+        writer.write((
+            "HTTP/1.1 200 OK\r\n"
+            f"Content-Type: multipart/x-mixed-replace; boundary={BOUNDARY}\r\n"
+            "Cache-Control: no-cache\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode())
+        self.hub.register(camera_name)
+        try:
+            sequence = 0
+            while True:
+                # A slow client simply skips to the newest frame
+                sequence, jpeg = await self.hub.next_jpeg(camera_name, sequence)
+                writer.write((
+                    f"--{BOUNDARY}\r\n"
+                    "Content-Type: image/jpeg\r\n"
+                    f"Content-Length: {len(jpeg)}\r\n\r\n"
+                ).encode() + jpeg + b"\r\n")
+                await writer.drain()
+        finally:
+            self.hub.unregister(camera_name)
+
+    async def _snapshot(self, writer, camera_name):
+        self.hub.register(camera_name)
+        try:
+            _, jpeg = await asyncio.wait_for(self.hub.next_jpeg(camera_name), timeout=5)
+        except asyncio.TimeoutError:
+            await self._send_response(writer, "503 Service Unavailable", "text/plain", b"No frame available\n")
+            return
+        finally:
+            self.hub.unregister(camera_name)
+        await self._send_response(writer, "200 OK", "image/jpeg", jpeg)
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode(errors="replace").split()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # Headers are not needed
+            if len(request_line) < 2 or request_line[0] != "GET":
+                await self._send_response(writer, "405 Method Not Allowed", "text/plain")
+                return
+            await self._route(writer, unquote(request_line[1].split("?", 1)[0]))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, writer, path):
+        parts = [p for p in path.split("/") if p]
+        cameras = sorted(set(self.hub.cameras()) | set(self.pipelines))
+        loop = asyncio.get_running_loop()
+
+        if not parts:
+            body = INDEX_PAGE.format(cameras="".join(CAMERA_BLOCK.format(name=name) for name in cameras))
+            await self._send_response(writer, "200 OK", "text/html; charset=utf-8", body.encode())
+        # Only known cameras get a viewer: an unknown one would start an encoder that never sees a frame
+        elif len(parts) == 2 and parts[0] == "stream" and parts[1].endswith(".mjpg") \
+                and parts[1][:-len(".mjpg")] in cameras:
+            await self._stream_mjpeg(writer, parts[1][:-len(".mjpg")])
+        elif len(parts) == 2 and parts[0] == "snapshot" and parts[1].endswith(".jpg") \
+                and parts[1][:-len(".jpg")] in cameras:
+            await self._snapshot(writer, parts[1][:-len(".jpg")])
+        elif len(parts) == 3 and parts[0] == "hls" and parts[1] in self.playlists:
+            playlist = self.playlists[parts[1]]
+            if parts[2] == "index.m3u8":
+                body = await loop.run_in_executor(None, playlist.playlist)
+                await self._send_response(writer, "200 OK", "application/vnd.apple.mpegurl", body.encode())
+                return
+            ts_path = None
+            if parts[2].endswith(".ts"):
+                ts_path = await loop.run_in_executor(None, playlist.transport_stream, parts[2])
+            if ts_path:
+                await self._send_file(writer, ts_path, "video/mp2t")
+            else:
+                await self._send_response(writer, "404 Not Found", "text/plain", b"Not found\n")
+        else:
+            await self._send_response(writer, "404 Not Found", "text/plain", b"Not found\n")
+
+    async def serve(self):
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("Preview server listening on %s:%d", self.host, self.port)
+        async with server:
+            await server.serve_forever()
+
+def start_preview_server(hub, pipelines=(), host="0.0.0.0", port=8080):
+    """
+    Run the preview server on its own event loop in a background thread.
+
+    Args:
+        hub (PreviewHub): Hub the capture pipelines publish frames to.
+        pipelines (list): CameraPipeline objects whose segments are offered over HLS.
+        host (str): Address to listen on.
+        port (int): Port to listen on.
+
+    Returns:
+        threading.Thread: The server thread.
+    """
+    server = PreviewServer(hub, pipelines, host, port)
+    thread = threading.Thread(target=asyncio.run, args=(server.serve(),), name="preview-server", daemon=True)
+    thread.start()
+    return thread
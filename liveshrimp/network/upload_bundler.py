@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import tarfile
+import http.client
+from urllib.parse import urlsplit
+
+from io_scheduler import io_coordinator, advise_sequential, drop_cache
+from rate_control import upload_meter
+
+logger = logging.getLogger(__name__)
+
+# Bundle settings
+BUNDLE_TARGET_BYTES = 32 * 1024 * 1024  # A bundle is closed once it holds this much
+SMALL_FILE_BYTES = 8 * 1024 * 1024  # Files up to this size are bundled; larger ones go on their own
+READ_CHUNK_BYTES = 256 * 1024
+BUNDLE_TIMEOUT = 60  # Seconds without progress before a bundle upload is abandoned
+MANIFEST_NAME = "manifest.json"
+TELEMETRY_NAME = "telemetry.json"
+
+def plan_uploads(file_sizes, target_bytes=BUNDLE_TARGET_BYTES, small_file_bytes=SMALL_FILE_BYTES):
+    """
+    Group files, in upload order, into bundles and single uploads.
+
+    Consecutive small files share a bundle until it reaches target_bytes; a
+    large file closes the open bundle and is uploaded on its own, so the
+    upload order is kept.
+
+    Args:
+        file_sizes (list): (file name, size in bytes) pairs in upload order.
+        target_bytes (int): Bundle size at which a new bundle is started.
+        small_file_bytes (int): Largest file that is bundled.
+
+    Returns:
+        list: ("bundle", [names]) and ("file", name) entries.
+    """
+    plan = []
+    bundle, bundle_bytes = [], 0
+    for name, size in file_sizes:
+        if size > small_file_bytes:
+            if bundle:
+                plan.append(("bundle", bundle))
+                bundle, bundle_bytes = [], 0
+            plan.append(("file", name))
+            continue
+        bundle.append(name)
+        bundle_bytes += size
+        if bundle_bytes >= target_bytes:
+            plan.append(("bundle", bundle))
+            bundle, bundle_bytes = [], 0
+    if bundle:
+        plan.append(("bundle", bundle))
+    return plan
+
+def _tar_member(name, size, mtime=None):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = 0o644
+    info.mtime = int(mtime if mtime is not None else time.time())
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+def _tar_padding(size):
+    return b"\0" * (-size % tarfile.BLOCKSIZE)
+
+def bundle_stream(folder, file_names, metadata_callback=None, telemetry=None, chunk_size=READ_CHUNK_BYTES):
+    """
+    Generate a tar archive of files without holding more than one chunk in memory.
+
+    The archive holds the optional telemetry, the files, and finally a
+    manifest with each file's size, SHA-256 and metadata. The manifest is
+    written last so the checksums can be computed while the files stream.
+
+    Args:
+        folder (str): Directory of the files.
+        file_names (list): Files to pack.
+        metadata_callback (callable): Returns the metadata (sidecar) of a file name.
+        telemetry (dict): Optional device status to include.
+        chunk_size (int): Read size.
+
+    Yields:
+        bytes: Consecutive pieces of the archive.
+    """
+    if telemetry is not None:
+        data = json.dumps(telemetry).encode()
+        yield _tar_member(TELEMETRY_NAME, len(data)) + data + _tar_padding(len(data))
+
+    entries = []
+    for name in file_names:
+        path = os.path.join(folder, name)
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            advise_sequential(f.fileno())
+            yield _tar_member(name, size, os.fstat(f.fileno()).st_mtime)
+            digest = hashlib.sha256()
+            remaining = size
+            while remaining:
+                io_coordinator.throttle(min(chunk_size, remaining))
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise OSError(f"{path} shrank while it was bundled")
+                digest.update(chunk)
+                remaining -= len(chunk)
+                yield chunk
+            drop_cache(f.fileno())
+        yield _tar_padding(size)
+        entries.append({
+            "name": name,
+            "size": size,
+            "sha256": digest.hexdigest(),
+            "metadata": metadata_callback(name) if metadata_callback else None,
+        })
+
+    manifest = json.dumps({"version": 1, "files": entries}).encode()
+    yield _tar_member(MANIFEST_NAME, len(manifest)) + manifest + _tar_padding(len(manifest))
+    yield b"\0" * (2 * tarfile.BLOCKSIZE)  # End-of-archive marker
+
+def upload_bundle(folder, file_names, bundle_url, metadata_callback=None, telemetry=None, device_id=None):
+    """
+    Upload files as one streamed tar bundle in a single chunked POST.
+
+    Args:
+        folder (str): Directory of the files.
+        file_names (list): Files to pack.
+        bundle_url (str): URL of the server's bundle endpoint.
+        metadata_callback (callable): Returns the metadata of a file name.
+        telemetry (dict): Optional device status to include.
+        device_id (str): Optional device identifier, sent as X-Device-Id.
+
+    Returns:
+        list: Names of the files the server confirmed; empty on failure.
+    """
+    url = urlsplit(bundle_url)
+    connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+    connection = connection_class(url.hostname, url.port, timeout=BUNDLE_TIMEOUT)
+    headers = {"Content-Type": "application/x-tar"}
+    if device_id:
+        headers["X-Device-Id"] = device_id
+    started = time.monotonic()
+    try:
+        # An iterable body without a length is sent with chunked transfer encoding
+        connection.request("POST", (url.path or "/") + (f"?{url.query}" if url.query else ""),
+                           body=bundle_stream(folder, file_names, metadata_callback, telemetry),
+                           headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+        if response.status >= 400:
+            raise http.client.HTTPException(f"{response.status} {response.reason}")
+        received = json.loads(body).get("received", [])
+    except (OSError, ValueError, http.client.HTTPException) as e:
+        logger.error("Failed to upload bundle of %d files from %s: %s", len(file_names), folder, e)
+        return []
+    finally:
+        connection.close()
+    confirmed = set(received)
+    sent = sum(os.path.getsize(path) for path in (os.path.join(folder, name) for name in file_names)
+               if os.path.exists(path))
+    upload_meter.record_transfer(sent, time.monotonic() - started)
+    logger.info("Uploaded bundle of %d/%d files from %s.", len(confirmed), len(file_names), folder)
+    return [name for name in file_names if name in confirmed]
+
+class ChunkedReader:
+    """
+    Read the body of an HTTP request sent with chunked transfer encoding.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._remaining = 0
+        self._done = False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(READ_CHUNK_BYTES), b""))
+        if self._done:
+            return b""
+        if self._remaining == 0:
+            line = self.stream.readline()
+            self._remaining = int(line.split(b";")[0].strip() or b"0", 16)
+            if self._remaining == 0:
+                while self.stream.readline() not in (b"\r\n", b"\n", b""):
+                    pass  # Skip trailers
+                self._done = True
+                return b""
+        data = self.stream.read(min(size, self._remaining))
+        self._remaining -= len(data)
+        if self._remaining == 0:
+            self.stream.readline()  # CRLF after the chunk
+        return data
+
+def unpack_bundle(stream, dest_dir):
+    """
+    Unpack a streamed bundle, keeping only files that match the manifest.
+
+    Files are written as ``.part`` while they arrive and renamed once the
+    manifest confirms their size and checksum; each file's metadata is saved
+    next to it as ``<name>.json`` and the telemetry as
+    ``telemetry_<time>_<random>.json``, unique even for bundles received in
+    the same second.
+
+    Args:
+        stream: File-like object delivering the tar archive.
+        dest_dir (str): Directory to store the files in.
+
+    Returns:
+        list: Names of the files received intact.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    digests = {}
+    manifest = None
+    with tarfile.open(fileobj=stream, mode="r|") as archive:
+        for member in archive:
+            name = os.path.basename(member.name)
+            if not member.isfile() or not name or name != member.name:
+                continue  # Only flat regular files are accepted
+            source = archive.extractfile(member)
+            if name == MANIFEST_NAME:
+                manifest = json.loads(source.read())
+                continue
+            if name == TELEMETRY_NAME:
+                with open(os.path.join(dest_dir, f"telemetry_{int(time.time())}_{uuid.uuid4().hex[:8]}.json"), "wb") as f:
+                    f.write(source.read())
+                continue
+            digest = hashlib.sha256()
+            with open(os.path.join(dest_dir, name + ".part"), "wb") as f:
+                for chunk in iter(lambda: source.read(READ_CHUNK_BYTES), b""):
+                    digest.update(chunk)
+                    f.write(chunk)
+            digests[name] = (member.size, digest.hexdigest())
+
+    received = []
+    for entry in (manifest or {}).get("files", []):
+        name = entry["name"]
+        part = os.path.join(dest_dir, name + ".part")
+        if digests.pop(name, None) != (entry["size"], entry["sha256"]):
+            logger.warning("Bundled file %s is missing or corrupt.", name)
+            if os.path.exists(part):
+                os.remove(part)
+            continue
+        os.replace(part, os.path.join(dest_dir, name))
+        if entry.get("metadata") is not None:
+            with open(os.path.join(dest_dir, name + ".json"), "w") as f:
+                json.dump(entry["metadata"], f)
+        received.append(name)
+    for name in digests:
+        os.remove(os.path.join(dest_dir, name + ".part"))  # Not in the manifest
+    return received
@@ -1,10 +1,82 @@
 import os
-import requests
+import re
 import json
+import uuid
+import socket
+import logging
+import http.client
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import backends
+from io_scheduler import send_file
+from rate_control import upload_meter
+from storage_handler import remove_from_index
+from upload_bundler import plan_uploads, upload_bundle
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_TIMEOUT = 60  # Seconds without progress before an upload is abandoned
+MACHINE_ID_FILE = "/etc/machine-id"  # Stable per-installation ID written by systemd
+
+# Upload order by file type: previews go first so operators can triage before full video arrives
+UPLOAD_PRIORITY = {".jpg": 0, ".mp4": 2}
+TIMELAPSE_PRIORITY = 1
+
+_device_id = None
+
+def get_device_id(configured=None):
+    """
+    Get the identifier this device reports to the upload server.
+
+    Args:
+        configured (str): Identifier set in the configuration, if any.
+
+    Returns:
+        str: The configured identifier, else the machine ID, else the hostname.
+    """
+    global _device_id
+    if configured:
+        return configured
+    if _device_id is None:
+        try:
+            with open(MACHINE_ID_FILE) as f:
+                _device_id = f.read().strip()
+        except OSError:
+            pass
+        _device_id = _device_id or socket.gethostname()
+    return _device_id
+
+def multipart_envelope(file_name, metadata, boundary):
+    """
+    Build the multipart/form-data parts around a file's content.
+
+    The form matches what the server has always received: an optional
+    "metadata" field holding JSON, followed by the file in a "file" field.
+
+    Args:
+        file_name (str): File name reported to the server.
+        metadata (dict): Optional metadata to send with the file.
+        boundary (str): Multipart boundary.
+
+    Returns:
+        tuple: (bytes before the file content, bytes after it)
+    """
+    preamble = b""
+    if metadata:
+        preamble += (f"--{boundary}\r\n"
+                     'Content-Disposition: form-data; name="metadata"\r\n\r\n'
+                     f"{json.dumps(metadata)}\r\n").encode()
+    preamble += (f"--{boundary}\r\n"
+                 f'Content-Disposition: form-data; name="file"; filename="{file_name}"\r\n'
+                 "Content-Type: application/octet-stream\r\n\r\n").encode()
+    epilogue = f"\r\n--{boundary}--\r\n".encode()
+    return preamble, epilogue
 
 def upload_file(file_path, upload_url, metadata=None):
     """
-    Upload a single file to a specified server.
+    Upload a single file to a specified server through the transport backend
+    (post_file() unless a simulated network is in use).
 
     Args:
         file_path (str): Path to the file to upload.
@@ -14,19 +86,98 @@ def upload_file(file_path, upload_url, metadata=None):
     Returns:
         bool: True if upload was successful, False otherwise.
     """
+    started = backends.clock.monotonic()
+    if not backends.transport.upload(file_path, upload_url, metadata):
+        return False
+    upload_meter.record_transfer(backends.filesystem.getsize(file_path), backends.clock.monotonic() - started)
+    return True
+
+def post_file(file_path, upload_url, metadata=None):
+    """
+    Upload a single file over HTTP as multipart/form-data.
+
+    The file is streamed from disk with sendfile rather than read into memory,
+    yielding to capture writes between chunks and leaving the page cache as
+    it found it.
+
+    Args:
+        file_path (str): Path to the file to upload.
+        upload_url (str): URL of the server to upload to.
+        metadata (dict): Optional metadata to send with the file.
+
+    Returns:
+        bool: True if upload was successful, False otherwise.
+    """
+    url = urlsplit(upload_url)
+    connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+    connection = connection_class(url.hostname, url.port, timeout=UPLOAD_TIMEOUT)
+    boundary = uuid.uuid4().hex
     try:
         with open(file_path, 'rb') as video_file:
-            files = {"file": video_file}
-            data = {"metadata": json.dumps(metadata)} if metadata else {}
-            response = requests.post(upload_url, files=files, data=data)
-            response.raise_for_status()
-        print(f"Uploaded: {file_path}")
+            size = os.fstat(video_file.fileno()).st_size
+            preamble, epilogue = multipart_envelope(os.path.basename(file_path), metadata, boundary)
+            connection.putrequest("POST", (url.path or "/") + (f"?{url.query}" if url.query else ""))
+            connection.putheader("Content-Type", f"multipart/form-data; boundary={boundary}")
+            connection.putheader("Content-Length", str(len(preamble) + size + len(epilogue)))
+            if metadata and metadata.get("device_id"):
+                connection.putheader("X-Device-Id", metadata["device_id"])
+            connection.endheaders(preamble)
+            if send_file(connection.sock, video_file, size) != size:
+                raise OSError("file changed size during upload")
+            connection.send(epilogue)
+            response = connection.getresponse()
+            response.read()
+        if response.status >= 400:
+            raise http.client.HTTPException(f"{response.status} {response.reason}")
+        logger.info("Uploaded: %s", file_path)
         return True
-    except requests.RequestException as e:
-        print(f"Failed to upload {file_path}: {e}")
+    except (OSError, http.client.HTTPException) as e:
+        logger.error("Failed to upload %s: %s", file_path, e)
         return False
+    finally:
+        connection.close()
 
-def upload_pending_files(video_folder, upload_url, metadata_callback=None):
+def upload_priority(file_name):
+    """
+    Get the upload priority of a file in the video folder.
+
+    Args:
+        file_name (str): Name of the file.
+
+    Returns:
+        int: Priority (lower uploads first), or None if the file is not uploaded.
+    """
+    if file_name.startswith("timelapse_") and file_name.endswith(".mp4"):
+        return TIMELAPSE_PRIORITY
+    return UPLOAD_PRIORITY.get(os.path.splitext(file_name)[1])
+
+def source_segment(file_name):
+    """
+    Get the name of the recorded segment a file was made from ("compressed_X.mp4" -> "X.mp4").
+    """
+    return file_name[len("compressed_"):] if file_name.startswith("compressed_") else file_name
+
+def pending_uploads(video_folder, activity=None, exclude=()):
+    """
+    List the files waiting for upload, in upload order.
+
+    Args:
+        video_folder (str): Directory containing video files.
+        activity (dict): Optional activity score per segment name; within a
+            priority, more active segments are uploaded first.
+        exclude (iterable): File names to leave out, such as segments still being recorded.
+
+    Returns:
+        list: File names ordered by priority, then activity, then name.
+    """
+    activity = activity or {}
+    exclude = set(exclude)
+    names = [f for f in backends.filesystem.listdir(video_folder)
+             if upload_priority(f) is not None and f not in exclude]
+    return sorted(names, key=lambda f: (upload_priority(f), -activity.get(source_segment(f), 0.0), f))
+
+def upload_pending_files(video_folder, upload_url, metadata_callback=None, activity=None,
+                         bundle_url=None, telemetry=None, device_id=None, exclude=()):
     """
     Upload all pending video files in a folder.
 
@@ -34,41 +185,134 @@ def upload_pending_files(video_folder, upload_url, metadata_callback=None):
         video_folder (str): Directory containing video files.
         upload_url (str): URL of the server to upload to.
         metadata_callback (callable): Function to generate metadata for each file.
+        activity (dict): Optional activity score per segment name, see pending_uploads().
+        bundle_url (str): Optional bundle endpoint; small files are then sent
+            together in tar bundles instead of one request each.
+        telemetry (dict): Optional device status sent with the first bundle.
+        device_id (str): Device identifier sent with bundles, see get_device_id().
+        exclude (iterable): File names not to upload, see pending_uploads().
 
     Returns:
         None
     """
-    for file_name in sorted(os.listdir(video_folder)):
-        if file_name.endswith(".mp4"):
-            file_path = os.path.join(video_folder, file_name)
+    if bundle_url:
+        upload_bundled_files(video_folder, upload_url, bundle_url, metadata_callback, activity, telemetry, device_id,
+                             exclude)
+        return
 
-            # Generate metadata if callback is provided
-            metadata = metadata_callback(file_name) if metadata_callback else None
+    for file_name in pending_uploads(video_folder, activity, exclude):
+        file_path = os.path.join(video_folder, file_name)
 
-            if upload_file(file_path, upload_url, metadata):
-                os.remove(file_path)  # Remove file after successful upload
-                print(f"Deleted: {file_path}")
-            else:
-                print(f"Retry needed for: {file_path}")
-                break
+        # Generate metadata if callback is provided
+        metadata = metadata_callback(file_name) if metadata_callback else None
 
-def generate_metadata(file_name):
+        if upload_file(file_path, upload_url, metadata):
+            backends.filesystem.remove(file_path)  # Remove file after successful upload
+            remove_from_index([file_path])
+            logger.info("Deleted: %s", file_path)
+        else:
+            logger.warning("Retry needed for: %s", file_path)
+            break
+
+def upload_bundled_files(video_folder, upload_url, bundle_url, metadata_callback=None, activity=None, telemetry=None,
+                         device_id=None, exclude=()):
+    """
+    Upload pending files in priority order, packing runs of small files into bundles.
+
+    Per-request overhead dominates on satellite and cellular links, so the
+    number of round trips should follow the bytes sent, not the file count.
+    Large files are still uploaded on their own with upload_file().
+
+    Args:
+        video_folder (str): Directory containing video files.
+        upload_url (str): URL for single-file uploads.
+        bundle_url (str): URL of the bundle endpoint.
+        metadata_callback (callable): Function to generate metadata for each file.
+        activity (dict): Optional activity score per segment name, see pending_uploads().
+        telemetry (dict): Optional device status sent with the first bundle.
+        device_id (str): Device identifier sent with bundles, see get_device_id().
+        exclude (iterable): File names not to upload, see pending_uploads().
+
+    Returns:
+        None
+    """
+    names = pending_uploads(video_folder, activity, exclude)
+    plan = plan_uploads([(name, backends.filesystem.getsize(os.path.join(video_folder, name))) for name in names])
+    for kind, entry in plan:
+        if kind == "file":
+            metadata = metadata_callback(entry) if metadata_callback else None
+            uploaded = [entry] if upload_file(os.path.join(video_folder, entry), upload_url, metadata) else []
+            expected = [entry]
+        else:
+            uploaded = upload_bundle(video_folder, entry, bundle_url, metadata_callback, telemetry, device_id)
+            expected = entry
+            if uploaded:
+                telemetry = None
+        for file_name in uploaded:
+            backends.filesystem.remove(os.path.join(video_folder, file_name))  # Remove file after successful upload
+        remove_from_index([os.path.join(video_folder, file_name) for file_name in uploaded])
+        if uploaded:
+            logger.info("Deleted %d uploaded files from %s", len(uploaded), video_folder)
+        if len(uploaded) < len(expected):
+            logger.warning("Retry needed for %d files in %s", len(expected) - len(uploaded), video_folder)
+            break
+
+def parse_segment_time(file_name):
+    """
+    Read the recording start time from a segment name such as "compressed_20240101_120000.mp4".
+
+    Args:
+        file_name (str): Name of the video file.
+
+    Returns:
+        float: Unix time, or None if the name carries no timestamp.
+    """
+    match = re.search(r"(\d{8}_\d{6})", file_name)
+    if not match:
+        return None
+    return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S").timestamp()
+
+def generate_metadata(file_name, track_store=None, camera_name=None, index=None, device_id=None):
     """
     Generate metadata for a given video file.
 
     Args:
         file_name (str): Name of the video file.
+        track_store (GpsTrackStore): Optional GPS track store to read the segment's track from.
+        camera_name (str): Camera that recorded the file, used to build the segment ID.
+        index (dict): Optional storage index of the camera, for activity scores.
+        device_id (str): Device identifier, see get_device_id().
 
     Returns:
         dict: Metadata including filename, GPS, timestamp, etc.
     """
-    # Example metadata
+    segment_name = source_segment(file_name)
+    summary = None
+    if track_store is not None and camera_name:
+        summary = track_store.segment_summary(f"{camera_name}/{segment_name}")
+
     metadata = {
         "filename": file_name,
-        "timestamp": file_name.split('_')[0],  # Assuming filename starts with a timestamp
+        "timestamp": parse_segment_time(file_name),
         "gps_coordinates": get_current_gps(),  # Stub function for GPS data
-        "device_id": "raspberry_pi_4",  # Example device identifier
+        "device_id": get_device_id(device_id),
     }
+    if camera_name:
+        metadata["camera"] = camera_name
+    if summary:
+        metadata["timestamp"] = summary["start"]
+        metadata["end_timestamp"] = summary.get("end")
+        if summary.get("bbox"):
+            min_lat, min_lon, max_lat, max_lon = summary["bbox"]
+            metadata["gps_bbox"] = summary["bbox"]
+            metadata["gps_coordinates"] = {"latitude": (min_lat + max_lat) / 2, "longitude": (min_lon + max_lon) / 2}
+    entry = (index or {}).get(segment_name, {})
+    if "activity_mean" in entry:
+        metadata["activity"] = {
+            "mean": entry["activity_mean"],
+            "peak": entry["activity_peak"],
+            "max_blobs": entry["max_blobs"],
+        }
     return metadata
 
 def get_current_gps():
@@ -98,9 +342,9 @@ def retry_failed_uploads(video_folder, upload_url, retry_limit=3, metadata_callb
         None
     """
     for _ in range(retry_limit):
-        pending_files = [f for f in os.listdir(video_folder) if f.endswith(".mp4")]
+        pending_files = pending_uploads(video_folder)
         if not pending_files:
-            print("All files uploaded successfully.")
+            logger.info("All files uploaded successfully.")
             break
         upload_pending_files(video_folder, upload_url, metadata_callback)
 
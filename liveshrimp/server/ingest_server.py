@@ -0,0 +1,627 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import tarfile
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Server settings
+READ_CHUNK_BYTES = 256 * 1024
+MAX_HEADER_BYTES = 16 * 1024
+MAX_METADATA_BYTES = 1024 * 1024
+DEVICE_BYTES_PER_SECOND = 4 * 1024 * 1024  # Sustained receive rate per device
+DEVICE_BURST_BYTES = 16 * 1024 * 1024  # Bytes a device may send at full speed before it is throttled
+DEVICE_MAX_REQUESTS = 2  # Concurrent uploads per device; more are refused with 429
+IDLE_TIMEOUT = 60  # Seconds a connection may stay silent
+DISK_THREADS = 8  # Threads writing received data; keeps slow disks off the event loop
+INDEX_FILE = "index.db"
+MANIFEST_NAME = "manifest.json"  # Same names as upload_bundler on the device
+TELEMETRY_NAME = "telemetry.json"
+SAFE_NAME = re.compile(r"[^A-Za-z0-9._-]")
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 408: "Request Timeout",
+           411: "Length Required", 413: "Payload Too Large", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+def safe_name(name):
+    """
+    Reduce a client-supplied name to a safe flat file name.
+    """
+    name = SAFE_NAME.sub("_", os.path.basename(name or "")).lstrip(".")
+    return name or "upload.bin"
+
+class TokenBucket:
+    """
+    Byte-rate limiter: consume() waits until the bytes fit the rate.
+
+    Waiting inside the read loop stops reading from the socket, so TCP flow
+    control slows the device down instead of the server buffering its data.
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def delay(self, nbytes):
+        """
+        Take nbytes from the bucket.
+
+        Returns:
+            float: Seconds the caller should wait before using them.
+        """
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= nbytes
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    async def consume(self, nbytes):
+        delay = self.delay(nbytes)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class DeviceLimits:
+    """
+    Per-device byte rate and concurrent request limits.
+    """
+
+    def __init__(self, rate=DEVICE_BYTES_PER_SECOND, burst=DEVICE_BURST_BYTES, max_requests=DEVICE_MAX_REQUESTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_requests = max_requests
+        self.buckets = {}
+        self.active = {}
+
+    def acquire(self, device_id):
+        """
+        Returns:
+            TokenBucket: The device's bucket, or None if it already has max_requests uploads running.
+        """
+        if self.active.get(device_id, 0) >= self.max_requests:
+            return None
+        self.active[device_id] = self.active.get(device_id, 0) + 1
+        if device_id not in self.buckets:
+            self.buckets[device_id] = TokenBucket(self.rate, self.burst)
+        return self.buckets[device_id]
+
+    def release(self, device_id):
+        self.active[device_id] -= 1
+        if not self.active[device_id]:
+            del self.active[device_id]
+
+class BodyReader:
+    """
+    Reads a request body delimited by Content-Length or chunked encoding,
+    charging every byte to the device's rate limit.
+    """
+
+    def __init__(self, reader, length=None, chunked=False, bucket=None, timeout=IDLE_TIMEOUT):
+        self.reader = reader
+        self.remaining = length
+        self.chunked = chunked
+        self.bucket = bucket
+        self.timeout = timeout
+        self.received = 0
+        self._chunk_left = 0
+        self._done = False
+
+    async def _read(self, coroutine):
+        try:
+            return await asyncio.wait_for(coroutine, self.timeout)
+        except asyncio.TimeoutError:
+            raise HttpError(408, "body timed out")
+
+    async def read(self, size=READ_CHUNK_BYTES):
+        """
+        Returns:
+            bytes: Up to size bytes of the body; b"" at its end.
+        """
+        if self._done:
+            return b""
+        if self.chunked:
+            if self._chunk_left == 0:
+                line = await self._read(self.reader.readline())
+                try:
+                    self._chunk_left = int(line.split(b";")[0].strip(), 16)
+                except ValueError:
+                    raise HttpError(400, "bad chunk size")
+                if self._chunk_left == 0:
+                    while (await self._read(self.reader.readline())) not in (b"\r\n", b"\n", b""):
+                        pass
+                    self._done = True
+                    return b""
+            size = min(size, self._chunk_left)
+        else:
+            size = min(size, self.remaining)
+            if size == 0:
+                self._done = True
+                return b""
+        data = await self._read(self.reader.read(size))
+        if not data:
+            raise HttpError(400, "connection closed mid-body")
+        if self.chunked:
+            self._chunk_left -= len(data)
+            if self._chunk_left == 0:
+                await self._read(self.reader.readline())
+        else:
+            self.remaining -= len(data)
+        self.received += len(data)
+        if self.bucket:
+            await self.bucket.consume(len(data))
+        return data
+
+    async def read_exactly(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = await self.read(size - len(data))
+            if not chunk:
+                raise HttpError(400, "body ended early")
+            data += chunk
+        return data
+
+    async def drain(self):
+        while await self.read():
+            pass
+
+class MultipartReader:
+    """
+    Streams the parts of a multipart/form-data body without buffering file contents.
+    """
+
+    def __init__(self, body, boundary):
+        self.body = body
+        self.delimiter = b"\r\n--" + boundary.encode()
+        self.buffer = b"\r\n"  # Lets the first boundary match the same delimiter as the others
+        self.finished = False
+
+    async def _fill(self):
+        data = await self.body.read()
+        if not data:
+            raise HttpError(400, "multipart body ended early")
+        self.buffer += data
+
+    async def next_part(self):
+        """
+        Advance to the next part.
+
+        Returns:
+            dict: The part's headers (lower-case names), or None after the last part.
+        """
+        if self.finished:
+            return None
+        while True:
+            index = self.buffer.find(self.delimiter)
+            if index >= 0 and len(self.buffer) >= index + len(self.delimiter) + 2:
+                break
+            # Discard the rest of the previous part (or the preamble) while searching
+            self.buffer = self.buffer[-len(self.delimiter) - 2:] if index < 0 else self.buffer
+            await self._fill()
+        self.buffer = self.buffer[index + len(self.delimiter):]
+        if self.buffer.startswith(b"--"):
+            self.finished = True
+            await self.body.drain()
+            return None
+        while b"\r\n\r\n" not in self.buffer:
+            if len(self.buffer) > MAX_HEADER_BYTES:
+                raise HttpError(400, "part headers too large")
+            await self._fill()
+        head, self.buffer = self.buffer.split(b"\r\n\r\n", 1)
+        headers = {}
+        for line in head.decode("latin-1").split("\r\n")[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return headers
+
+    async def read(self):
+        """
+        Returns:
+            bytes: The next piece of the current part's content; b"" at its end.
+        """
+        while True:
+            index = self.buffer.find(self.delimiter)
+            if index >= 0:
+                data, self.buffer = self.buffer[:index], self.buffer[index:]
+                return data
+            keep = len(self.delimiter) - 1  # A delimiter may be split across reads
+            if len(self.buffer) > keep:
+                data, self.buffer = self.buffer[:-keep], self.buffer[-keep:]
+                return data
+            await self._fill()
+
+def disposition_params(value):
+    """
+    Parse the parameters of a Content-Disposition header (name, filename).
+    """
+    params = {}
+    for item in value.split(";")[1:]:
+        key, _, val = item.strip().partition("=")
+        params[key.lower()] = val.strip().strip('"')
+    return params
+
+class UploadIndex:
+    """
+    SQLite index of received files. All access goes through one thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="index")
+        self._connection = None
+        self.executor.submit(self._open).result()
+
+    def _open(self):
+        self._connection = sqlite3.connect(self.path, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")  # Lets several server processes share it
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS uploads (
+            id INTEGER PRIMARY KEY, device_id TEXT, file_name TEXT, path TEXT, size INTEGER,
+            sha256 TEXT, received_at REAL, segment_time REAL, metadata TEXT)""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS uploads_device ON uploads (device_id, segment_time)")
+        self._connection.commit()
+
+    def _add(self, record):
+        self._connection.execute(
+            "INSERT INTO uploads (device_id, file_name, path, size, sha256, received_at, segment_time, metadata) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (record["device_id"], record["file_name"], record["path"], record["size"], record["sha256"],
+             record["received_at"], record["segment_time"], json.dumps(record["metadata"])))
+        self._connection.commit()
+
+    async def add(self, record):
+        await asyncio.get_running_loop().run_in_executor(self.executor, self._add, record)
+
+    def query(self, sql, params=()):
+        return self.executor.submit(lambda: self._connection.execute(sql, params).fetchall()).result()
+
+    def close(self):
+        self.executor.submit(self._connection.close).result()
+        self.executor.shutdown()
+
+class IngestServer:
+    """
+    Receives device uploads: the multipart contract of upload_handler.upload_file()
+    on /upload (an optional "metadata" JSON field, then the "file" field), and
+    tar bundles from upload_bundler on /bundle.
+
+    File contents are streamed to ``<storage>/<device>/<day>/`` and hashed on
+    the way; nothing is held in memory beyond one chunk per connection.
+    Every file is recorded in an SQLite index. Devices are identified by
+    the X-Device-Id header, the metadata's device_id, or their address.
+    """
+
+    def __init__(self, storage_dir, limits=None, disk_threads=DISK_THREADS):
+        self.storage_dir = storage_dir
+        os.makedirs(storage_dir, exist_ok=True)
+        self.limits = limits or DeviceLimits()
+        self.index = UploadIndex(os.path.join(storage_dir, INDEX_FILE))
+        self.disk = ThreadPoolExecutor(disk_threads, thread_name_prefix="disk")
+        self.stats = {"requests": 0, "files": 0, "bytes": 0, "rejected": 0, "errors": 0}
+        self._server = None
+
+    async def start(self, host="0.0.0.0", port=8000, reuse_port=False):
+        self._server = await asyncio.start_server(self._handle, host, port, reuse_port=reuse_port or None,
+                                                  limit=MAX_HEADER_BYTES)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        self.disk.shutdown()
+        self.index.close()
+
+    async def _handle(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, 400, {"error": "headers too large"}, close=True)
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                method, path, _ = (lines[0].split(" ") + ["", ""])[:3]
+                headers = {}
+                for line in lines[1:]:
+                    if line:
+                        name, _, value = line.partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self.stats["requests"] += 1
+                try:
+                    status, payload = await self._route(method, path, headers, reader, peer)
+                except HttpError as e:
+                    self.stats["errors" if e.status != 429 else "rejected"] += 1
+                    # The rest of the body was not read, so the connection cannot be reused
+                    await self._respond(writer, e.status, {"error": str(e)}, close=True,
+                                        extra={"Retry-After": "5"} if e.status == 429 else None)
+                    return
+                await self._respond(writer, status, payload, close=not keep_alive)
+                if not keep_alive:
+                    return
+        except Exception:
+            self.stats["errors"] += 1
+            logger.exception("Request from %s failed", peer)
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, payload, close=False, extra=None):
+        data = json.dumps(payload).encode()
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", "Content-Type: application/json",
+                f"Content-Length: {len(data)}"]
+        head += [f"{name}: {value}" for name, value in (extra or {}).items()]
+        if close:
+            head.append("Connection: close")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _route(self, method, path, headers, reader, peer):
+        if method == "GET" and path.startswith("/stats"):
+            return 200, self.stats
+        if method != "POST" or not path.startswith(("/upload", "/bundle")):
+            raise HttpError(404, "not found")
+
+        device_id = safe_name(headers.get("x-device-id") or (peer[0] if peer else "unknown"))
+        bucket = self.limits.acquire(device_id)
+        if bucket is None:
+            raise HttpError(429, "too many concurrent uploads from this device")
+        try:
+            chunked = headers.get("transfer-encoding", "").lower() == "chunked"
+            if not chunked and "content-length" not in headers:
+                raise HttpError(411, "length required")
+            body = BodyReader(reader, None if chunked else int(headers["content-length"]), chunked, bucket)
+            if path.startswith("/bundle"):
+                return 200, {"received": await self._receive_bundle(body, device_id, bool(headers.get("x-device-id")))}
+            match = re.search(r'boundary="?([^";]+)"?', headers.get("content-type", ""))
+            if not match:
+                raise HttpError(400, "expected multipart/form-data")
+            received = await self._receive_multipart(MultipartReader(body, match.group(1)), device_id,
+                                                     bool(headers.get("x-device-id")))
+            return 200, {"received": received}
+        finally:
+            self.limits.release(device_id)
+
+    async def _receive_multipart(self, parts, device_id, device_from_header):
+        metadata = None
+        received = []
+        while True:
+            headers = await parts.next_part()
+            if headers is None:
+                return received
+            params = disposition_params(headers.get("content-disposition", ""))
+            if params.get("name") == "metadata":
+                data = b""
+                while chunk := await parts.read():
+                    data += chunk
+                    if len(data) > MAX_METADATA_BYTES:
+                        raise HttpError(413, "metadata too large")
+                try:
+                    metadata = json.loads(data)
+                except ValueError:
+                    raise HttpError(400, "metadata is not JSON")
+                if not device_from_header and isinstance(metadata, dict) and metadata.get("device_id"):
+                    device_id = safe_name(str(metadata["device_id"]))
+            elif params.get("name") == "file":
+                received.append(await self._store_file(parts, safe_name(params.get("filename")), device_id, metadata))
+            else:
+                while await parts.read():
+                    pass
+
+    async def _store_file(self, parts, file_name, device_id, metadata):
+        loop = asyncio.get_running_loop()
+        segment_time = (metadata or {}).get("timestamp") if isinstance(metadata, dict) else None
+        day = datetime.fromtimestamp(segment_time or time.time(), timezone.utc).strftime("%Y%m%d")
+        directory = os.path.join(self.storage_dir, device_id, day)
+        path = os.path.join(directory, file_name)
+        await loop.run_in_executor(self.disk, lambda: os.makedirs(directory, exist_ok=True))
+        f = await loop.run_in_executor(self.disk, open, path + ".part", "wb")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            while chunk := await parts.read():
+                digest.update(chunk)
+                size += len(chunk)
+                await loop.run_in_executor(self.disk, f.write, chunk)
+        except BaseException:
+            await loop.run_in_executor(self.disk, f.close)
+            await loop.run_in_executor(self.disk, os.remove, path + ".part")
+            raise
+        await loop.run_in_executor(self.disk, f.close)
+        await loop.run_in_executor(self.disk, os.replace, path + ".part", path)
+
+        await self.index.add({
+            "device_id": device_id, "file_name": file_name, "path": os.path.relpath(path, self.storage_dir),
+            "size": size, "sha256": digest.hexdigest(), "received_at": time.time(),
+            "segment_time": segment_time, "metadata": metadata,
+        })
+        self.stats["files"] += 1
+        self.stats["bytes"] += size
+        logger.info("Received %s from %s (%d bytes)", file_name, device_id, size)
+        return file_name
+
+    async def _receive_bundle(self, body, device_id, device_from_header):
+        """
+        Unpack a tar bundle from upload_bundler as it streams in.
+
+        Files are kept as .part until the closing manifest confirms their
+        size and checksum; then they are stored and indexed like single uploads.
+        Each request stages its parts in a directory of its own, removed with
+        whatever is left in it however the request ends.
+        """
+        loop = asyncio.get_running_loop()
+        incoming = os.path.join(self.storage_dir, device_id, "incoming")
+        await loop.run_in_executor(self.disk, lambda: os.makedirs(incoming, exist_ok=True))
+        directory = await loop.run_in_executor(self.disk, lambda: tempfile.mkdtemp(prefix="bundle_", dir=incoming))
+        try:
+            return await self._unpack_bundle(body, directory, device_id, device_from_header)
+        finally:
+            await loop.run_in_executor(self.disk, shutil.rmtree, directory, True)
+
+    async def _unpack_bundle(self, body, directory, device_id, device_from_header):
+        loop = asyncio.get_running_loop()
+        parts = {}  # name -> (size, sha256)
+        manifest = None
+        telemetry = None
+        pax = {}
+        while True:
+            header = await body.read_exactly(tarfile.BLOCKSIZE)
+            if header == b"\0" * tarfile.BLOCKSIZE:
+                break
+            try:
+                info = tarfile.TarInfo.frombuf(header, "utf-8", "surrogateescape")
+            except tarfile.HeaderError:
+                raise HttpError(400, "bad tar header")
+            size = int(pax.get("size", info.size))
+            name = pax.get("path", info.name)
+            padded = size + (-size % tarfile.BLOCKSIZE)
+            pax = {}
+            if info.type in (tarfile.XHDTYPE, tarfile.XGLTYPE):
+                for record in (await body.read_exactly(padded))[:size].decode("utf-8", "replace").split("\n"):
+                    key, _, value = record.partition(" ")[2].partition("=")
+                    if key:
+                        pax[key] = value
+                continue
+            if name in (MANIFEST_NAME, TELEMETRY_NAME) or not info.isfile():
+                if size > MAX_METADATA_BYTES:
+                    raise HttpError(413, f"{name} too large")
+                data = (await body.read_exactly(padded))[:size]
+                if name == MANIFEST_NAME:
+                    manifest = json.loads(data)
+                elif name == TELEMETRY_NAME:
+                    telemetry = data
+                continue
+
+            file_name = safe_name(name)
+            digest = hashlib.sha256()
+            f = await loop.run_in_executor(self.disk, open, os.path.join(directory, file_name + ".part"), "wb")
+            try:
+                remaining = size
+                while remaining:
+                    chunk = await body.read(min(READ_CHUNK_BYTES, remaining))
+                    if not chunk:
+                        raise HttpError(400, "body ended early")
+                    digest.update(chunk)
+                    remaining -= len(chunk)
+                    await loop.run_in_executor(self.disk, f.write, chunk)
+            finally:
+                await loop.run_in_executor(self.disk, f.close)
+            await body.read_exactly(padded - size)
+            parts[file_name] = (size, digest.hexdigest())
+        await body.drain()
+
+        received = []
+        owner = device_id
+        for entry in (manifest or {}).get("files", []):
+            file_name = safe_name(entry.get("name"))
+            part = os.path.join(directory, file_name + ".part")
+            if parts.pop(file_name, None) != (entry.get("size"), entry.get("sha256")):
+                logger.warning("Bundled file %s from %s is missing or corrupt.", file_name, device_id)
+                continue
+            metadata = entry.get("metadata")
+            if not device_from_header and isinstance(metadata, dict) and metadata.get("device_id"):
+                owner = safe_name(str(metadata["device_id"]))
+            segment_time = metadata.get("timestamp") if isinstance(metadata, dict) else None
+            day = datetime.fromtimestamp(segment_time or time.time(), timezone.utc).strftime("%Y%m%d")
+            path = os.path.join(self.storage_dir, owner, day, file_name)
+            await loop.run_in_executor(self.disk, self._move, part, path)
+            await self.index.add({
+                "device_id": owner, "file_name": file_name, "path": os.path.relpath(path, self.storage_dir),
+                "size": entry["size"], "sha256": entry["sha256"], "received_at": time.time(),
+                "segment_time": segment_time, "metadata": metadata,
+            })
+            self.stats["files"] += 1
+            self.stats["bytes"] += entry["size"]
+            received.append(entry.get("name"))
+        if telemetry is not None:
+            path = os.path.join(self.storage_dir, owner, f"telemetry_{int(time.time())}_{uuid.uuid4().hex[:8]}.json")
+            await loop.run_in_executor(self.disk, self._write_file, path, telemetry)
+        logger.info("Received bundle of %d files from %s", len(received), device_id)
+        return received
+
+    @staticmethod
+    def _write_file(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    @staticmethod
+    def _move(source, target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(source, target)
+
+def run_server(storage_dir, host, port, reuse_port=False, limits=None):
+    async def main():
+        server = IngestServer(storage_dir, limits)
+        await server.start(host, port, reuse_port)
+        logger.info("Ingest server (pid %d) listening on %s:%d", os.getpid(), host, port)
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+def serve(storage_dir, host="0.0.0.0", port=8000, workers=1, limits=None):
+    """
+    Run the ingest server. With several workers, each process accepts
+    connections on the same port (SO_REUSEPORT) and the kernel spreads
+    devices across them. Rate limits then apply per process.
+    """
+    if workers <= 1:
+        run_server(storage_dir, host, port, limits=limits)
+        return
+    processes = [multiprocessing.Process(target=run_server, args=(storage_dir, host, port, True, limits))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reference ingest server for device uploads.")
+    parser.add_argument("storage_dir", help="Directory to store received files and the index in.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="Server processes sharing the port.")
+    parser.add_argument("--device-rate-mb", type=float, default=DEVICE_BYTES_PER_SECOND / (1024 * 1024),
+                        help="Sustained receive rate per device in MB/s.")
+    parser.add_argument("--device-max-requests", type=int, default=DEVICE_MAX_REQUESTS,
+                        help="Concurrent uploads allowed per device.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+    limits = DeviceLimits(rate=args.device_rate_mb * 1024 * 1024, max_requests=args.device_max_requests)
+    serve(args.storage_dir, args.host, args.port, args.workers, limits)
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+
+# Load settings
+SEND_CHUNK_BYTES = 64 * 1024
+RETRY_AFTER_SECONDS = 5  # Used when a 429 response carries no Retry-After
+MAX_ATTEMPTS = 5
+
+def multipart_request(host, path, device_id, file_name, metadata, size, boundary):
+    """
+    Build the head of an upload in the upload_file() format, up to the file content.
+
+    Returns:
+        tuple: (bytes before the file content, bytes after it)
+    """
+    preamble = (f"--{boundary}\r\n"
+                'Content-Disposition: form-data; name="metadata"\r\n\r\n'
+                f"{json.dumps(metadata)}\r\n"
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="file"; filename="{file_name}"\r\n'
+                "Content-Type: application/octet-stream\r\n\r\n").encode()
+    epilogue = f"\r\n--{boundary}--\r\n".encode()
+    head = (f"POST {path} HTTP/1.1\r\n"
+            f"Host: {host}\r\n"
+            f"Content-Type: multipart/form-data; boundary={boundary}\r\n"
+            f"Content-Length: {len(preamble) + size + len(epilogue)}\r\n"
+            f"X-Device-Id: {device_id}\r\n"
+            "Connection: close\r\n\r\n").encode()
+    return head + preamble, epilogue
+
+async def read_response(reader):
+    """
+    Returns:
+        tuple: (status code, headers dict, body bytes)
+    """
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ")[1])
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return status, headers, body
+
+class LoadResults:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+        self.bytes_sent = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    def summary(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))], 3) if latencies else None
+
+        return {
+            "seconds": round(elapsed, 2),
+            "uploads_ok": self.statuses.get(200, 0),
+            "statuses": self.statuses,
+            "connection_errors": self.errors,
+            "mb_sent": round(self.bytes_sent / (1024 * 1024), 2),
+            "mb_per_second": round(self.bytes_sent / (1024 * 1024) / elapsed, 2) if elapsed else None,
+            "latency_p50": percentile(50),
+            "latency_p95": percentile(95),
+            "latency_p99": percentile(99),
+        }
+
+async def upload(url, device_id, file_name, payload, results, link_bytes_per_second=0):
+    """
+    Upload one file, retrying after 429 responses. Returns when it is stored or attempts run out.
+    """
+    target = urlsplit(url)
+    for _ in range(MAX_ATTEMPTS):
+        boundary = uuid.uuid4().hex
+        metadata = {"filename": file_name, "device_id": device_id, "timestamp": time.time()}
+        head, tail = multipart_request(target.netloc, target.path or "/", device_id, file_name, metadata,
+                                       len(payload), boundary)
+        started = time.monotonic()
+        try:
+            reader, writer = await asyncio.open_connection(target.hostname, target.port or 80)
+            try:
+                writer.write(head)
+                for offset in range(0, len(payload), SEND_CHUNK_BYTES):
+                    chunk = payload[offset:offset + SEND_CHUNK_BYTES]
+                    writer.write(chunk)
+                    await writer.drain()
+                    if link_bytes_per_second:
+                        await asyncio.sleep(len(chunk) / link_bytes_per_second)
+                writer.write(tail)
+                await writer.drain()
+                status, headers, _ = await read_response(reader)
+            finally:
+                writer.close()
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            results.errors += 1
+            await asyncio.sleep(random.uniform(0, RETRY_AFTER_SECONDS))
+            continue
+        results.statuses[status] = results.statuses.get(status, 0) + 1
+        if status == 200:
+            results.latencies.append(time.monotonic() - started)
+            results.bytes_sent += len(payload)
+            return True
+        if status != 429:
+            return False
+        await asyncio.sleep(float(headers.get("retry-after", RETRY_AFTER_SECONDS)) * random.uniform(0.5, 1.5))
+    return False
+
+async def simulate_device(url, device_id, files, payload, results, parallel, link_bytes_per_second, start_delay):
+    await asyncio.sleep(start_delay)
+    queue = [f"{device_id}_{i:05d}.mp4" for i in range(files)]
+
+    async def worker():
+        while queue:
+            await upload(url, device_id, queue.pop(0), payload, results, link_bytes_per_second)
+
+    await asyncio.gather(*(worker() for _ in range(parallel)))
+
+async def run_load(url, devices, files, size, parallel=1, ramp_seconds=0.0, link_kbps=0):
+    """
+    Simulate devices reconnecting and uploading their backlog.
+
+    Args:
+        url (str): Upload URL of the ingest server.
+        devices (int): Number of simulated devices.
+        files (int): Files each device uploads.
+        size (int): Size of each file in bytes.
+        parallel (int): Concurrent uploads per device.
+        ramp_seconds (float): Devices start spread over this time (0 = all at once).
+        link_kbps (float): Per-upload link speed in kbit/s (0 = unlimited).
+
+    Returns:
+        dict: Summary of the run.
+    """
+    payload = os.urandom(size)
+    results = LoadResults()
+    link = link_kbps * 1000 / 8
+    await asyncio.gather(*(
+        simulate_device(url, f"sim-{n:05d}", files, payload, results, parallel, link,
+                        random.uniform(0, ramp_seconds) if ramp_seconds else 0.0)
+        for n in range(devices)
+    ))
+    results.finished = time.monotonic()
+    return results.summary()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate many devices uploading to an ingest server.")
+    parser.add_argument("url", help="Upload URL, e.g. http://localhost:8000/upload")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--files", type=int, default=5, help="Files per device.")
+    parser.add_argument("--size-kb", type=int, default=1024, help="Size of each file.")
+    parser.add_argument("--parallel", type=int, default=1, help="Concurrent uploads per device.")
+    parser.add_argument("--ramp", type=float, default=0.0, help="Seconds over which devices come online.")
+    parser.add_argument("--link-kbps", type=float, default=0, help="Simulated uplink speed per upload.")
+    args = parser.parse_args()
+    summary = asyncio.run(run_load(args.url, args.devices, args.files, args.size_kb * 1024,
+                                   args.parallel, args.ramp, args.link_kbps))
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,527 @@
+import io
+import os
+import csv
+import json
+import time
+import bisect
+import random
+import logging
+import argparse
+from datetime import datetime
+
+import backends
+from task_scheduler import TaskScheduler
+from storage_handler import check_storage_limit, get_all_files, update_index
+from upload_handler import pending_uploads, upload_pending_files
+from network_handler import check_connectivity
+from rate_control import RateController, choose_encoding, predict_bits_per_second, upload_meter
+
+logger = logging.getLogger(__name__)
+
+# Simulation defaults
+SIM_EPOCH = 1_700_000_000.0  # Wall time at the start of every run, so file names and results repeat
+SEGMENT_SECONDS = 60
+FRAME_RATE = 30
+RAW_BITS_PER_SECOND = 8_000_000  # Size of the recorded (uncompressed-by-us) segments
+STORAGE_CAPACITY = 32 * 1024 ** 3  # Simulated SD card
+MAX_STORAGE_BYTES = 10_000_000_000  # video_storage.max_storage_limit
+STORAGE_CHECK_SECONDS = 5 * 60  # Same cadence as main.schedule_tasks
+NETWORK_CHECK_SECONDS = 10 * 60
+SAMPLE_SECONDS = 60 * 60  # Timeline resolution of the report
+REQUEST_SECONDS = 0.5  # Round trip of a connectivity check or upload request
+UPLOAD_URL = "http://ingest.invalid/upload"
+
+class SimClock:
+    """
+    Virtual time: sleep() advances it instantly, so days run in seconds.
+    """
+
+    def __init__(self, epoch=SIM_EPOCH):
+        self.epoch = epoch
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.epoch + self.now
+
+    def sleep(self, seconds):
+        self.now += max(0.0, seconds)
+
+class LatencyTrace:
+    """
+    A step-wise recording of one quantity over time, e.g. SD write latency
+    or link bandwidth, repeated from the start when it runs out.
+    """
+
+    def __init__(self, points, period=None):
+        """
+        Args:
+            points (list): (seconds since start, value) pairs; the first at 0.
+            period (float): Length after which the trace repeats; defaults to
+                the last point plus the step before it.
+        """
+        points = sorted(points)
+        if not points or points[0][0] != 0:
+            raise ValueError("A trace needs a point at 0 seconds.")
+        self.times = [float(t) for t, _ in points]
+        self.values = [float(v) for _, v in points]
+        if period is None:
+            period = self.times[-1] + (self.times[-1] - self.times[-2] if len(points) > 1 else 1.0)
+        self.period = float(period)
+
+    @classmethod
+    def constant(cls, value):
+        return cls([(0, value)])
+
+    @classmethod
+    def periodic(cls, base, peak, period, peak_seconds):
+        """
+        A trace at peak for the first peak_seconds of every period, else at base.
+        """
+        return cls([(0, peak), (peak_seconds, base)], period)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a trace from a CSV file of "seconds,value" rows (lines starting with # are skipped).
+        """
+        with open(path, newline="") as f:
+            rows = [row for row in csv.reader(f) if row and not row[0].lstrip().startswith("#")]
+        return cls([(float(t), float(v)) for t, v in rows])
+
+    def _position(self, t):
+        base = (t // self.period) * self.period
+        return base, bisect.bisect_right(self.times, t - base) - 1
+
+    def at(self, t):
+        return self.values[self._position(t)[1]]
+
+    def next_change(self, t):
+        """
+        Returns:
+            float: The first time after t at which the value may change.
+        """
+        base, i = self._position(t)
+        return base + (self.times[i + 1] if i + 1 < len(self.times) else self.period)
+
+class MemoryFile(io.BytesIO):
+    """
+    A file of MemoryFileSystem; written files are stored when they are closed.
+    """
+
+    def __init__(self, filesystem, path, data=b"", writable=True):
+        super().__init__(data)
+        self._filesystem = filesystem
+        self._path = path
+        self._writable = writable
+
+    def close(self):
+        if not self.closed and self._writable:
+            self._filesystem._store(self._path, self.getvalue())
+        super().close()
+
+class MemoryFileSystem:
+    """
+    An in-memory SD card whose operations cost virtual time.
+
+    Every metadata operation (stat, list, remove, ...) advances the clock by
+    ``op_latency``; writes advance it by ``write_latency`` seconds per MB.
+    Segment files carry only a size, so directories of tens of thousands of
+    files cost no real memory.
+    """
+
+    def __init__(self, clock, capacity=STORAGE_CAPACITY, op_latency=None, write_latency=None):
+        self.clock = clock
+        self.capacity = capacity
+        self.op_latency = op_latency or LatencyTrace.constant(0.0005)
+        self.write_latency = write_latency or LatencyTrace.constant(0.05)
+        self.files = {}  # path -> [size, ctime, data]
+        self.children = {"/": set()}  # directory -> names of its files and subdirectories
+        self.used = 0
+        self.operations = 0
+
+    def _op(self, count=1):
+        self.operations += count
+        self.clock.sleep(self.op_latency.at(self.clock.now) * count)
+
+    @staticmethod
+    def _norm(path):
+        if path.startswith("/") and "//" not in path and "/." not in path and not path.endswith("/"):
+            return path  # Already normal; the common case, kept off the slow path
+        return os.path.normpath(os.path.join("/", path))
+
+    def _store(self, path, data):
+        self.create(path, len(data), data=data)
+
+    def _add(self, path, entry):
+        old = self.files.get(path)
+        if old is not None:
+            self.used -= old[0]
+        self.files[path] = entry
+        self.used += entry[0]
+        parent, _, name = path.rpartition("/")
+        self.makedirs(parent or "/")
+        self.children[parent or "/"].add(name)
+
+    def _discard(self, path):
+        entry = self.files.pop(path, None)
+        if entry is None:
+            raise FileNotFoundError(path)
+        self.used -= entry[0]
+        parent, _, name = path.rpartition("/")
+        self.children[parent or "/"].discard(name)
+        return entry
+
+    def create(self, path, size, ctime=None, data=None):
+        """
+        Write a file of the given size (simulation helper; contents are optional).
+
+        Returns:
+            float: Seconds the write took.
+        """
+        took = self.write_latency.at(self.clock.now) * size / (1024 * 1024)
+        self.clock.sleep(took)
+        self._add(self._norm(path), [size, self.clock.time() if ctime is None else ctime, data])
+        return took
+
+    def walk(self, top):
+        top = self._norm(top)
+        self._op()
+        if top not in self.children:
+            return
+        prefix = top.rstrip("/") + "/"
+        subdirs = sorted(name for name in self.children[top] if prefix + name in self.children)
+        files = sorted(name for name in self.children[top] if prefix + name in self.files)
+        yield top, subdirs, files
+        for name in subdirs:  # The caller may prune subdirs, as with os.walk
+            yield from self.walk(prefix + name)
+
+    def listdir(self, path):
+        path = self._norm(path)
+        self._op()
+        if path not in self.children:
+            raise FileNotFoundError(path)
+        return sorted(self.children[path])
+
+    def exists(self, path):
+        path = self._norm(path)
+        self._op()
+        return path in self.files or path in self.children
+
+    def isdir(self, path):
+        self._op()
+        return self._norm(path) in self.children
+
+    def _entry(self, path):
+        self._op()
+        try:
+            return self.files[self._norm(path)]
+        except KeyError:
+            raise FileNotFoundError(path) from None
+
+    def getsize(self, path):
+        return self._entry(path)[0]
+
+    def getctime(self, path):
+        return self._entry(path)[1]
+
+    def makedirs(self, path, exist_ok=True):
+        path = self._norm(path)
+        while path not in self.children:
+            self.children[path] = set()
+            parent, _, name = path.rpartition("/")
+            parent = parent or "/"
+            self.makedirs(parent)
+            self.children[parent].add(name)
+
+    def remove(self, path):
+        self._op()
+        self._discard(self._norm(path))
+
+    def replace(self, source, target):
+        self._op()
+        self._add(self._norm(target), self._discard(self._norm(source)))
+
+    def open(self, path, mode="r"):
+        path = self._norm(path)
+        if "w" in mode:
+            handle = MemoryFile(self, path)
+        else:
+            handle = MemoryFile(self, path, self._entry(path)[2] or b"", writable=False)
+        return handle if "b" in mode else io.TextIOWrapper(handle, encoding="utf-8")
+
+    def disk_usage(self, path):
+        return self.capacity, self.used, self.capacity - self.used
+
+class SimTransport:
+    """
+    A network link whose bandwidth (bytes per second, 0 = down) follows a trace.
+    """
+
+    def __init__(self, clock, filesystem, bandwidth, request_seconds=REQUEST_SECONDS, timeout=60):
+        self.clock = clock
+        self.filesystem = filesystem
+        self.bandwidth = bandwidth
+        self.request_seconds = request_seconds
+        self.timeout = timeout
+        self.uploaded_files = 0
+        self.uploaded_bytes = 0
+        self.failed_uploads = 0
+
+    def reachable(self, url, timeout):
+        if self.bandwidth.at(self.clock.now) > 0:
+            self.clock.sleep(self.request_seconds)
+            return True
+        self.clock.sleep(timeout)
+        return False
+
+    def upload(self, file_path, upload_url, metadata=None):
+        remaining = self.filesystem.getsize(file_path)
+        size = remaining
+        self.clock.sleep(self.request_seconds)
+        while remaining > 0:
+            now = self.clock.monotonic()
+            rate = self.bandwidth.at(now)
+            if rate <= 0:
+                self.clock.sleep(self.timeout)  # The link dropped mid-transfer
+                self.failed_uploads += 1
+                return False
+            step = min(remaining / rate, self.bandwidth.next_change(now) - now)
+            self.clock.sleep(step)
+            remaining -= rate * step
+        self.uploaded_files += 1
+        self.uploaded_bytes += size
+        return True
+
+class SimCapture:
+    """
+    Stand-in for cv2.VideoCapture that returns frames from a factory.
+    """
+
+    def __init__(self, frame_factory=None):
+        self.frame_factory = frame_factory or (lambda: None)
+        self.properties = {}
+        self.released = False
+
+    def isOpened(self):
+        return not self.released
+
+    def set(self, prop, value):
+        self.properties[prop] = value
+        return True
+
+    def get(self, prop):
+        return self.properties.get(prop, 0)
+
+    def read(self):
+        return True, self.frame_factory()
+
+    def release(self):
+        self.released = True
+
+class SimCameraSource:
+    """
+    Camera backend handing out SimCapture objects.
+    """
+
+    def __init__(self, frame_factory=None):
+        self.frame_factory = frame_factory
+
+    def open(self, device, resolution, fps, fourcc=None):
+        return SimCapture(self.frame_factory)
+
+    def close(self, camera):
+        camera.release()
+
+class FieldSimulation:
+    """
+    Replays field conditions against the storage, upload, scheduling and
+    rate-control code of the device, in virtual time.
+
+    Cameras record a segment every SEGMENT_SECONDS; a frame write slower
+    than the frame interval (from the SD latency trace) costs frames. Each
+    segment is compressed to the size the rate controller's choice predicts
+    for the scene complexity trace. The storage check, network check and
+    backlog upload then run through the real storage_handler,
+    network_handler and upload_handler functions on a TaskScheduler, with
+    every file and network operation going to the simulated backends.
+
+    Jobs run one at a time; a long upload delays the other jobs as it
+    would delay them on a busy device, and capture catches up afterwards.
+    """
+
+    def __init__(self, cameras=1, sd_latency=None, bandwidth=None, complexity=None, existing_files=0,
+                 max_storage_bytes=MAX_STORAGE_BYTES, capacity=STORAGE_CAPACITY, rate_control=True, seed=0):
+        """
+        Args:
+            cameras (int): Cameras recording.
+            sd_latency (LatencyTrace): Seconds per frame write.
+            bandwidth (LatencyTrace): Uplink bytes per second (0 = offline).
+            complexity (LatencyTrace): Scene complexity as probe bits per second (see rate_control).
+            existing_files (int): Small old files placed on the card before the run.
+            max_storage_bytes (int): video_storage.max_storage_limit.
+            capacity (int): Size of the simulated card.
+            rate_control (bool): Size segments with the rate controller; otherwise 1 Mbit/s.
+            seed (int): Seed for the scheduler jitter.
+        """
+        self.clock = SimClock()
+        self.sd_latency = sd_latency or LatencyTrace.periodic(0.005, 0.2, 6 * 3600, 30)
+        self.filesystem = MemoryFileSystem(self.clock, capacity)
+        self.transport = SimTransport(self.clock, self.filesystem,
+                                      bandwidth or LatencyTrace.periodic(0, 125_000, 3600, 40 * 60))
+        self.camera_source = SimCameraSource()
+        self.complexity = complexity or LatencyTrace.periodic(60_000, 200_000, 86400, 12 * 3600)
+        self.storage_dir = "/videos"
+        self.camera_dirs = [os.path.join(self.storage_dir, f"camera{n}") for n in range(cameras)]
+        self.max_storage_bytes = max_storage_bytes
+        self.rate_control = rate_control
+        self.controller = RateController(self.storage_dir, max_storage_bytes, streams=cameras,
+                                         segment_seconds=SEGMENT_SECONDS)
+        self.scheduler = TaskScheduler(workers=0, clock=self.clock.monotonic, rng=random.Random(seed).uniform)
+        self.next_segment = 0.0
+        self.stats = {"segments": 0, "frames_dropped": 0, "recorded_bytes": 0, "compressed_bytes": 0}
+        self.timeline = []
+        for n in range(existing_files):
+            path = os.path.join(self.camera_dirs[n % cameras], "compressed", f"old_{n:06d}.jpg")
+            self.filesystem._add(path, [20_000, self.clock.time() - 86400, None])
+
+    def _record_segments(self):
+        # Capture runs alongside the other jobs on a device; catch up on the segments due since the last run
+        while self.next_segment + SEGMENT_SECONDS <= self.clock.monotonic():
+            start = self.next_segment
+            self.next_segment += SEGMENT_SECONDS
+            for camera_dir in self.camera_dirs:
+                self._record_segment(camera_dir, start)
+
+    def _record_segment(self, camera_dir, start):
+        frame_interval = 1.0 / FRAME_RATE
+        dropped = 0
+        for second in range(SEGMENT_SECONDS):
+            latency = self.sd_latency.at(start + second)
+            if latency > frame_interval:
+                dropped += FRAME_RATE - int(1.0 / latency)
+        name = "segment_" + datetime.fromtimestamp(self.clock.epoch + start).strftime("%Y%m%d_%H%M%S") + ".mp4"
+        raw_size = RAW_BITS_PER_SECOND * SEGMENT_SECONDS // 8
+        self.filesystem.create(os.path.join(camera_dir, name), raw_size, ctime=self.clock.epoch + start)
+
+        probe_bps = self.complexity.at(start)
+        if self.rate_control:
+            budget_bps = self.controller.budget_bytes_per_hour() * 8 / 3600
+            resolution, crf = choose_encoding(probe_bps, budget_bps, self.controller.resolutions,
+                                              self.controller.quality, self.controller.max_crf)
+            bits_per_second = predict_bits_per_second(probe_bps, resolution, crf)
+            update_index(name, camera_dir, encoding={"resolution": f"{resolution[0]}x{resolution[1]}", "crf": crf})
+        else:
+            bits_per_second = 1_000_000
+        compressed_size = int(bits_per_second * SEGMENT_SECONDS / 8)
+        self.filesystem.create(os.path.join(camera_dir, "compressed", f"compressed_{name}"), compressed_size,
+                               ctime=self.clock.epoch + start + SEGMENT_SECONDS)
+
+        self.stats["segments"] += 1
+        self.stats["frames_dropped"] += dropped
+        self.stats["recorded_bytes"] += raw_size
+        self.stats["compressed_bytes"] += compressed_size
+
+    def _check_network(self):
+        # As main.check_device_status: measure the link, then upload every camera's backlog
+        connected = check_connectivity()
+        upload_meter.record_connectivity(connected)
+        if connected:
+            for camera_dir in self.camera_dirs:
+                folder = os.path.join(camera_dir, "compressed")
+                if self.filesystem.isdir(folder):
+                    upload_pending_files(folder, UPLOAD_URL)
+
+    def backlog(self):
+        """
+        Returns:
+            tuple: (files, bytes) waiting for upload.
+        """
+        files = size = 0
+        for camera_dir in self.camera_dirs:
+            folder = os.path.join(camera_dir, "compressed")
+            if self.filesystem.isdir(folder):
+                for name in pending_uploads(folder):
+                    files += 1
+                    size += self.filesystem.files[self.filesystem._norm(os.path.join(folder, name))][0]
+        return files, size
+
+    def _sample(self):
+        files, size = self.backlog()
+        self.timeline.append({
+            "hour": round(self.clock.monotonic() / 3600, 2),
+            "backlog_files": files,
+            "backlog_mb": round(size / (1024 * 1024), 1),
+            "stored_mb": round(self.filesystem.disk_usage("/")[1] / (1024 * 1024), 1),
+            "uploaded_mb": round(self.transport.uploaded_bytes / (1024 * 1024), 1),
+            "budget_mb_per_hour": round(self.controller.budget_bytes_per_hour() / (1024 * 1024), 1),
+            "frames_dropped": self.stats["frames_dropped"],
+        })
+
+    def run(self, hours):
+        """
+        Simulate the given number of hours.
+
+        Returns:
+            dict: Totals, per-job metrics (in virtual seconds) and an hourly timeline.
+        """
+        started = time.monotonic()
+        with backends.use_backends(clock=self.clock, filesystem=self.filesystem, transport=self.transport,
+                                   camera_source=self.camera_source):
+            upload_meter.reset()
+            self.scheduler.every(SEGMENT_SECONDS, self._record_segments, name="capture", delay=SEGMENT_SECONDS)
+            self.scheduler.every(STORAGE_CHECK_SECONDS, check_storage_limit, self.max_storage_bytes / (1024 * 1024),
+                                 self.storage_dir, name="storage", jitter=30)
+            self.scheduler.every(NETWORK_CHECK_SECONDS, self._check_network, name="device-status", jitter=60)
+            self.scheduler.every(SAMPLE_SECONDS, self._sample, name="sample")
+            end = hours * 3600
+            while True:
+                delay = self.scheduler.run_pending()
+                if delay is None or self.clock.monotonic() + delay > end:
+                    break
+                self.clock.sleep(delay)
+            self._record_segments()  # Segments finished while the last job ran
+            files, size = self.backlog()
+            summary = dict(self.stats)
+            summary.update({
+                "hours": hours,
+                "uploaded_files": self.transport.uploaded_files,
+                "uploaded_mb": round(self.transport.uploaded_bytes / (1024 * 1024), 1),
+                "failed_uploads": self.transport.failed_uploads,
+                "backlog_files": files,
+                "backlog_mb": round(size / (1024 * 1024), 1),
+                "files_on_card": len(get_all_files(self.storage_dir)),
+                "filesystem_operations": self.filesystem.operations,
+                "jobs": self.scheduler.status(),
+                "timeline": self.timeline,
+                "real_seconds": round(time.monotonic() - started, 2),
+            })
+        return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay field conditions against the device pipeline in virtual time.")
+    parser.add_argument("--hours", type=float, default=72)
+    parser.add_argument("--cameras", type=int, default=1)
+    parser.add_argument("--sd-trace", help="CSV of seconds,frame write latency in seconds.")
+    parser.add_argument("--link-trace", help="CSV of seconds,uplink bytes per second (0 = offline).")
+    parser.add_argument("--complexity-trace", help="CSV of seconds,scene complexity in probe bits per second.")
+    parser.add_argument("--existing-files", type=int, default=0, help="Old files on the card at the start.")
+    parser.add_argument("--max-storage-gb", type=float, default=MAX_STORAGE_BYTES / 1e9)
+    parser.add_argument("--no-rate-control", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)  # The pipeline logs every upload; keep the report readable
+
+    simulation = FieldSimulation(
+        cameras=args.cameras,
+        sd_latency=LatencyTrace.load(args.sd_trace) if args.sd_trace else None,
+        bandwidth=LatencyTrace.load(args.link_trace) if args.link_trace else None,
+        complexity=LatencyTrace.load(args.complexity_trace) if args.complexity_trace else None,
+        existing_files=args.existing_files,
+        max_storage_bytes=int(args.max_storage_gb * 1e9),
+        rate_control=not args.no_rate_control,
+        seed=args.seed,
+    )
+    print(json.dumps(simulation.run(args.hours), indent=2))
@@ -1,39 +1,78 @@
 import os
+import logging
 import subprocess
 
-def compress_video(input_file, output_file, resolution="640x360", bitrate="1M"):
+from io_scheduler import CoalescingWriter, background_command, drop_cache
+
+logger = logging.getLogger(__name__)
+
+PIPE_READ_BYTES = 64 * 1024  # Read size from the encoder's output pipe
+
+def compress_video(input_file, output_file, resolution="640x360", bitrate="1M", crf=None, maxrate=None):
     """
     Compress a video using FFmpeg.
 
+    With a CRF the encoder keeps a constant quality and spends bits where
+    the scene needs them (see rate_control); otherwise it encodes at the
+    fixed bitrate.
+
+    FFmpeg runs at idle I/O priority and writes a fragmented MP4 to a pipe;
+    its output reaches the card through a CoalescingWriter, in large aligned
+    chunks that yield to capture writes.
+
     Args:
         input_file (str): Path to the input video file.
         output_file (str): Path to save the compressed video file.
         resolution (str): Target resolution (e.g., "640x360").
-        bitrate (str): Target bitrate (e.g., "1M" for 1 Mbps).
+        bitrate (str): Target bitrate (e.g., "1M" for 1 Mbps), used without a CRF.
+        crf (int): Constant quality (0 = best, 51 = worst).
+        maxrate (int): Peak bitrate cap in bits per second when encoding with a CRF.
 
     Returns:
         bool: True if compression is successful, False otherwise.
     """
+    if crf is None:
+        rate = ["-b:v", bitrate]
+    else:
+        rate = ["-crf", str(crf)]
+        if maxrate:
+            rate += ["-maxrate", str(maxrate), "-bufsize", str(2 * maxrate)]
+    # Command to compress video using FFmpeg
+    command = [
+        "ffmpeg", "-v", "error", "-i", input_file,
+        "-vf", f"scale={resolution}",
+        *rate,
+        "-c:v", "libx264",
+        "-preset", "fast",
+        "-c:a", "aac",
+        "-strict", "experimental",
+        # A pipe cannot be rewound to move the index to the front, so fragment instead (still streamable)
+        "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+        "-f", "mp4", "pipe:1"
+    ]
+    process = None
     try:
-        # Command to compress video using FFmpeg
-        command = [
-            "ffmpeg", "-i", input_file,
-            "-vf", f"scale={resolution}",
-            "-b:v", bitrate,
-            "-c:v", "libx264",
-            "-preset", "fast",
-            "-c:a", "aac",
-            "-strict", "experimental",
-            "-movflags", "faststart",  # Optimize for streaming
-            output_file
-        ]
-        # Run the command
-        subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        print(f"Compressed: {input_file} -> {output_file}")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"Failed to compress {input_file}: {e}")
+        process = subprocess.Popen(background_command(command), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Written under a temporary name so an interrupted run never leaves a truncated file to upload
+        with CoalescingWriter(output_file + ".part") as output:
+            for chunk in iter(lambda: process.stdout.read(PIPE_READ_BYTES), b""):
+                output.write(chunk)
+        errors = process.stderr.read().decode(errors="replace").strip()
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, command, stderr=errors)
+        os.replace(output_file + ".part", output_file)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.error("Failed to compress %s: %s %s", input_file, e, getattr(e, "stderr", "") or "")
+        if process and process.poll() is None:
+            process.kill()
+            process.wait()
+        if os.path.exists(output_file + ".part"):
+            os.remove(output_file + ".part")
         return False
+    # The original is not read again soon; keep it from crowding out capture's cache
+    drop_cache(input_file)
+    logger.info("Compressed: %s -> %s", input_file, output_file)
+    return True
 
 def compress_all_videos(input_folder, output_folder, resolution="640x360", bitrate="1M"):
     """
@@ -70,4 +109,4 @@ def delete_original_files(input_folder):
     for file_name in os.listdir(input_folder):
         if file_name.endswith(".mp4") and not file_name.startswith("compressed_"):
             os.remove(os.path.join(input_folder, file_name))
-            print(f"Deleted original: {file_name}")
+            logger.info("Deleted original: %s", file_name)
@@ -0,0 +1,268 @@
+import os
+import time
+import shutil
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# I/O scheduling settings
+BLOCK_SIZE = 4096  # Flash page/filesystem block size that background writes are aligned to
+COALESCE_BYTES = 1024 * 1024  # Background output is written in chunks of this size
+SYNC_EVERY_BYTES = 8 * 1024 * 1024  # Written data is flushed and dropped from the page cache this often
+SEND_CHUNK_BYTES = 256 * 1024  # Uploads yield to capture between chunks of this size
+CAPTURE_STALL_SECONDS = 0.05  # A capture write slower than this means the card is congested
+CAPTURE_QUIET_SECONDS = 1.0  # Background I/O waits this long after a slow capture write
+MAX_BACKGROUND_WAIT = 5.0  # Background I/O never waits longer than this per chunk
+BACKGROUND_NICE = 10  # CPU niceness of background work; also lowers best-effort I/O priority
+
+class IoCoordinator:
+    """
+    Gives capture writes priority over background disk I/O.
+
+    Capture threads report how long each segment write took. While those
+    writes are slow, background readers and writers (compression output,
+    uploads) pause between chunks, so the SD card serves the recording
+    first. An optional byte rate caps background I/O at all times.
+    """
+
+    def __init__(self, stall_seconds=CAPTURE_STALL_SECONDS, quiet_seconds=CAPTURE_QUIET_SECONDS,
+                 background_bytes_per_second=0, clock=time.monotonic, sleep=time.sleep):
+        """
+        Args:
+            stall_seconds (float): Time blocked in one capture write regarded as a stall.
+            quiet_seconds (float): Time after the last stall before background I/O resumes.
+            background_bytes_per_second (int): Background I/O rate limit (0 = unlimited).
+            clock (callable): Monotonic time source.
+            sleep (callable): Sleep function.
+        """
+        self.stall_seconds = stall_seconds
+        self.quiet_seconds = quiet_seconds
+        self.background_bytes_per_second = background_bytes_per_second
+        self.clock = clock
+        self.sleep = sleep
+        self.capture_stalls = 0
+        self.background_waits = 0.0
+        self._last_stall = None
+        self._next_allowed = 0.0
+        self._lock = threading.Lock()
+
+    def record_capture_write(self, duration):
+        """
+        Report how long a capture write blocked on I/O (wall time minus the
+        writing thread's CPU time). Called on the capture thread; cheap.
+        """
+        if duration >= self.stall_seconds:
+            self._last_stall = self.clock()
+            self.capture_stalls += 1
+
+    def capture_congested(self):
+        """
+        Returns:
+            bool: True while capture writes have recently been slow.
+        """
+        return self._last_stall is not None and self.clock() - self._last_stall < self.quiet_seconds
+
+    def throttle(self, nbytes=0, max_wait=MAX_BACKGROUND_WAIT):
+        """
+        Wait before a background transfer of nbytes: until capture is no longer
+        congested and the rate limit allows it, but at most max_wait seconds.
+        """
+        started = self.clock()
+        deadline = started + max_wait
+        while self.capture_congested() and self.clock() < deadline:
+            self.sleep(min(self.quiet_seconds, deadline - self.clock()))
+
+        if self.background_bytes_per_second and nbytes:
+            with self._lock:
+                now = self.clock()
+                start = max(now, self._next_allowed)
+                self._next_allowed = start + nbytes / self.background_bytes_per_second
+            delay = min(start - now, max(0.0, deadline - now))
+            if delay > 0:
+                self.sleep(delay)
+        self.background_waits += self.clock() - started
+
+io_coordinator = IoCoordinator()
+
+def configure_io(io_config=None):
+    """
+    Apply the "io" configuration section to the shared coordinator.
+
+    Args:
+        io_config (dict): The "io" section of config.json.
+    """
+    io_config = io_config or {}
+    io_coordinator.stall_seconds = io_config.get("capture_stall_ms", CAPTURE_STALL_SECONDS * 1000) / 1000.0
+    io_coordinator.background_bytes_per_second = int(io_config.get("background_mb_per_second", 0) * 1024 * 1024)
+
+def _fadvise(fd, advice, offset=0, length=0):
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, offset, length, advice)
+        except OSError:
+            pass  # Advisory only; some filesystems do not support it
+
+def advise_sequential(fd):
+    """
+    Hint that a file is about to be read once from start to end.
+    """
+    if hasattr(os, "POSIX_FADV_SEQUENTIAL"):
+        _fadvise(fd, os.POSIX_FADV_SEQUENTIAL)
+
+def drop_cache(path_or_fd):
+    """
+    Drop a file's clean pages from the page cache so background reads do not
+    evict the data capture and the logger are working with.
+
+    Args:
+        path_or_fd (str or int): File path or open file descriptor.
+    """
+    if not hasattr(os, "POSIX_FADV_DONTNEED"):
+        return
+    if isinstance(path_or_fd, int):
+        _fadvise(path_or_fd, os.POSIX_FADV_DONTNEED)
+        return
+    try:
+        fd = os.open(path_or_fd, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        _fadvise(fd, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+def background_command(command):
+    """
+    Prefix a subprocess command so it runs at idle I/O and low CPU priority.
+
+    Args:
+        command (list): The command, e.g. an ffmpeg invocation.
+
+    Returns:
+        list: The command wrapped in ionice/nice where those tools exist.
+    """
+    prefix = []
+    if shutil.which("ionice"):
+        prefix += ["ionice", "-c", "3"]  # Idle class: only gets the disk when nobody else wants it
+    if shutil.which("nice"):
+        prefix += ["nice", "-n", str(BACKGROUND_NICE)]
+    return prefix + list(command)
+
+def lower_thread_priority():
+    """
+    Lower the CPU priority of the calling thread (per-thread on Linux). The
+    kernel derives best-effort I/O priority from niceness, so this also puts
+    the thread's disk I/O behind capture.
+    """
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), BACKGROUND_NICE)
+    except (AttributeError, OSError) as e:
+        logger.debug("Could not lower thread priority: %s", e)
+
+def send_file(sock, file, count=None, coordinator=None, chunk_size=SEND_CHUNK_BYTES):
+    """
+    Send a file over a socket with sendfile, yielding to capture between chunks.
+
+    The file is copied by the kernel without passing through Python buffers,
+    and its pages are dropped from the cache once sent.
+
+    Args:
+        sock (socket.socket): Connected socket.
+        file: File object opened in binary mode, positioned at the start of the data.
+        count (int): Number of bytes to send (defaults to the rest of the file).
+        coordinator (IoCoordinator): Coordinator to throttle against (defaults to the shared one).
+        chunk_size (int): Bytes sent between throttling checks.
+
+    Returns:
+        int: Number of bytes sent.
+    """
+    coordinator = coordinator or io_coordinator
+    offset = file.tell()
+    if count is None:
+        count = os.fstat(file.fileno()).st_size - offset
+    advise_sequential(file.fileno())
+    sent = 0
+    while sent < count:
+        size = min(chunk_size, count - sent)
+        coordinator.throttle(size)
+        n = sock.sendfile(file, offset + sent, size)
+        if n == 0:
+            break
+        sent += n
+    drop_cache(file.fileno())
+    return sent
+
+class CoalescingWriter:
+    """
+    File writer that gathers small writes into large block-aligned ones.
+
+    Encoders emit output in small pieces; written as they come, those turn
+    into many small writes interleaved with capture writes on the SD card.
+    This writer only writes whole COALESCE_BYTES chunks (the remainder on
+    close), waits for the coordinator before each chunk, and regularly
+    flushes written data and drops it from the page cache, so writeback
+    happens in steady small steps rather than one large burst that stalls
+    capture.
+    """
+
+    def __init__(self, path, chunk_size=COALESCE_BYTES, sync_every=SYNC_EVERY_BYTES, coordinator=None):
+        """
+        Args:
+            path (str): File to create (truncated if it exists).
+            chunk_size (int): Write size; rounded up to a multiple of BLOCK_SIZE.
+            sync_every (int): Bytes between flushes to disk and cache drops (0 = only on close).
+            coordinator (IoCoordinator): Coordinator to throttle against (defaults to the shared one).
+        """
+        self.path = path
+        self.chunk_size = -(-chunk_size // BLOCK_SIZE) * BLOCK_SIZE
+        self.sync_every = sync_every
+        self.coordinator = coordinator or io_coordinator
+        self.bytes_written = 0
+        self.writes = 0
+        self._buffer = bytearray()
+        self._synced = 0
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._write_chunk(self.chunk_size)
+        return len(data)
+
+    def _write_chunk(self, size):
+        self.coordinator.throttle(size)
+        view = memoryview(self._buffer)[:size]
+        try:
+            written = 0
+            while written < size:
+                written += os.write(self._fd, view[written:])
+        finally:
+            view.release()
+        del self._buffer[:size]
+        self.bytes_written += size
+        self.writes += 1
+        if self.sync_every and self.bytes_written - self._synced >= self.sync_every:
+            self._sync()
+
+    def _sync(self):
+        os.fdatasync(self._fd)
+        _fadvise(self._fd, getattr(os, "POSIX_FADV_DONTNEED", 0), self._synced, self.bytes_written - self._synced)
+        self._synced = self.bytes_written
+
+    def close(self):
+        if self._fd is None:
+            return
+        try:
+            if self._buffer:
+                self._write_chunk(len(self._buffer))
+            self._sync()
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
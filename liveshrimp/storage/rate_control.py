@@ -0,0 +1,247 @@
+import os
+import logging
+import threading
+import subprocess
+
+import backends
+from io_scheduler import background_command
+from storage_handler import get_all_files
+
+logger = logging.getLogger(__name__)
+
+# Rate control settings
+PROBE_SECONDS = 3  # Length of the sample encoded to measure a segment's complexity
+PROBE_RESOLUTION = (320, 180)  # The sample is encoded this small; sizes at other resolutions are extrapolated
+PROBE_CRF = 28
+CRF_DOUBLING = 6  # x264 output roughly doubles for every 6 CRF steps down
+PIXEL_EXPONENT = 0.75  # Output grows slower than the pixel count: larger frames compress better
+DEFAULT_QUALITY = 25  # CRF used when the budget allows (video_storage.compression_quality)
+MAX_CRF = 36  # Worst quality before the resolution is lowered instead
+RESOLUTIONS = [(1280, 720), (960, 540), (640, 360), (480, 270)]  # Ladder, best first
+STORAGE_HORIZON_HOURS = 48  # Free space is spread over this much recording without any upload
+UPLOAD_SHARE = 0.8  # Share of the measured upload capacity the encoder may plan on
+STORAGE_REFRESH_SECONDS = 5 * 60  # Storage usage is re-counted at most this often (a stat per file)
+THROUGHPUT_SMOOTHING = 0.2  # Weight of the newest sample in the moving averages
+MIN_MAXRATE = 100_000  # Floor of the peak bitrate cap, in bits per second
+
+class ThroughputMeter:
+    """
+    Tracks how many bytes per hour the uplink actually carries.
+
+    The link rate while transferring and the share of connectivity checks
+    that found a network are kept as moving averages; their product is the
+    sustained rate at which recordings can leave the device.
+    """
+
+    def __init__(self, smoothing=THROUGHPUT_SMOOTHING):
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all measurements (e.g. at the start of a simulation run).
+        """
+        with self._lock:
+            self.bytes_per_second = None
+            self.online_share = None
+
+    def _average(self, current, sample):
+        return sample if current is None else current + self.smoothing * (sample - current)
+
+    def record_transfer(self, nbytes, seconds):
+        """
+        Record a finished upload of nbytes that took the given number of seconds.
+        """
+        if nbytes <= 0 or seconds <= 0:
+            return
+        with self._lock:
+            self.bytes_per_second = self._average(self.bytes_per_second, nbytes / seconds)
+
+    def record_connectivity(self, connected):
+        with self._lock:
+            self.online_share = self._average(self.online_share, 1.0 if connected else 0.0)
+
+    def bytes_per_hour(self):
+        """
+        Returns:
+            float: Sustained upload capacity, or 0.0 before anything was measured.
+        """
+        with self._lock:
+            if self.bytes_per_second is None:
+                return 0.0
+            online = 1.0 if self.online_share is None else self.online_share
+            return self.bytes_per_second * online * 3600
+
+upload_meter = ThroughputMeter()  # Shared by the upload paths and the rate controller
+
+def hourly_budget(free_bytes, upload_bytes_per_hour, streams=1, horizon_hours=STORAGE_HORIZON_HOURS,
+                  upload_share=UPLOAD_SHARE):
+    """
+    Bytes per hour and stream the encoder may produce.
+
+    Recordings either leave over the uplink or wait on the card, so the
+    budget is the usable upload rate plus the free space spread over the
+    horizon.
+
+    Args:
+        free_bytes (int): Space left under the storage limit.
+        upload_bytes_per_hour (float): Measured upload capacity.
+        streams (int): Cameras sharing the budget.
+        horizon_hours (float): Hours the free space must last without uploads.
+        upload_share (float): Share of the upload capacity to plan on.
+
+    Returns:
+        float: Budget in bytes per hour for one stream.
+    """
+    total = max(0, free_bytes) / horizon_hours + upload_bytes_per_hour * upload_share
+    return total / max(1, streams)
+
+def predict_bits_per_second(probe_bps, resolution, crf, probe_resolution=PROBE_RESOLUTION, probe_crf=PROBE_CRF):
+    """
+    Extrapolate the bitrate measured by the probe encode to another resolution and CRF.
+    """
+    pixels = (resolution[0] * resolution[1]) / (probe_resolution[0] * probe_resolution[1])
+    return probe_bps * pixels ** PIXEL_EXPONENT * 2 ** ((probe_crf - crf) / CRF_DOUBLING)
+
+def choose_encoding(probe_bps, budget_bps, resolutions=RESOLUTIONS, quality=DEFAULT_QUALITY, max_crf=MAX_CRF):
+    """
+    Pick the largest resolution, then the best CRF, whose predicted bitrate fits the budget.
+
+    Args:
+        probe_bps (float): Bitrate of the probe encode.
+        budget_bps (float): Bitrate the segment may use.
+        resolutions (list): (width, height) ladder, best first.
+        quality (int): Best CRF to use, however large the budget.
+        max_crf (int): Worst CRF before the resolution is lowered.
+
+    Returns:
+        tuple: ((width, height), crf). The smallest resolution at max_crf if nothing fits.
+    """
+    for resolution in resolutions:
+        for crf in range(quality, max_crf + 1):
+            if predict_bits_per_second(probe_bps, resolution, crf) <= budget_bps:
+                return tuple(resolution), crf
+    return tuple(resolutions[-1]), max_crf
+
+def probe_bitrate(input_file, start=0.0, seconds=PROBE_SECONDS, resolution=PROBE_RESOLUTION, crf=PROBE_CRF):
+    """
+    Measure a segment's complexity with a small sample encode.
+
+    A few seconds of the segment are encoded at a low resolution with the
+    fastest preset; the output size says how hard the scene is to compress
+    (murky, still water encodes to very little).
+
+    Args:
+        input_file (str): Segment to measure.
+        start (float): Offset of the sample; segments shorter than that are sampled from the start.
+        seconds (float): Length of the sample.
+        resolution (tuple): Sample resolution.
+        crf (int): Sample CRF.
+
+    Returns:
+        float: Bits per second of the sample, or None if it could not be encoded.
+    """
+    command = [
+        "ffmpeg", "-v", "error", "-ss", str(start),
+        "-i", input_file, "-t", str(seconds), "-an",
+        "-vf", f"scale={resolution[0]}:{resolution[1]}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-crf", str(crf),
+        "-f", "h264", "pipe:1",
+    ]
+    try:
+        result = subprocess.run(background_command(command), capture_output=True, timeout=60, check=True)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning("Complexity probe of %s failed: %s", input_file, e)
+        return None
+    if not result.stdout:
+        # Seeking past the end of a short segment (e.g. the last one before shutdown) yields nothing
+        return probe_bitrate(input_file, 0.0, seconds, resolution, crf) if start else None
+    return len(result.stdout) * 8 / seconds
+
+class RateController:
+    """
+    Chooses CRF and resolution per segment to stay within a bytes-per-hour budget.
+    """
+
+    def __init__(self, storage_dir, max_storage_bytes, streams=1, quality=DEFAULT_QUALITY, max_crf=MAX_CRF,
+                 resolutions=RESOLUTIONS, horizon_hours=STORAGE_HORIZON_HOURS, segment_seconds=60,
+                 meter=upload_meter):
+        """
+        Args:
+            storage_dir (str): Directory counted against the storage limit.
+            max_storage_bytes (int): Storage limit (video_storage.max_storage_limit).
+            streams (int): Cameras sharing the budget.
+            quality (int): Best CRF to use (video_storage.compression_quality).
+            max_crf (int): Worst CRF before the resolution is lowered.
+            resolutions (list): (width, height) ladder, best first.
+            horizon_hours (float): Hours the free space must last without uploads.
+            segment_seconds (float): Segment length; the probe samples the middle.
+            meter (ThroughputMeter): Source of the measured upload capacity.
+        """
+        self.storage_dir = storage_dir
+        self.max_storage_bytes = max_storage_bytes
+        self.streams = streams
+        self.quality = quality
+        self.max_crf = max_crf
+        self.resolutions = [tuple(r) for r in resolutions]
+        self.horizon_hours = horizon_hours
+        self.segment_seconds = segment_seconds
+        self.meter = meter
+        self._used_bytes = 0
+        self._counted = None
+        self._lock = threading.Lock()
+
+    def used_bytes(self):
+        with self._lock:
+            now = backends.clock.monotonic()
+            if self._counted is None or now - self._counted >= STORAGE_REFRESH_SECONDS:
+                used = 0
+                for path in get_all_files(self.storage_dir):
+                    try:
+                        used += backends.filesystem.getsize(path)
+                    except FileNotFoundError:
+                        pass  # Deleted or uploaded since it was listed
+                self._used_bytes = used
+                self._counted = now
+            return self._used_bytes
+
+    def budget_bytes_per_hour(self):
+        free = self.max_storage_bytes - self.used_bytes()
+        return hourly_budget(free, self.meter.bytes_per_hour(), self.streams, self.horizon_hours)
+
+    def plan(self, input_file, source_resolution=None):
+        """
+        Choose the encoding of one segment.
+
+        Args:
+            input_file (str): Segment to compress.
+            source_resolution (tuple): Capture resolution; the segment is never scaled up.
+
+        Returns:
+            dict: "resolution" ("WxH"), "crf", "maxrate" (bits per second, caps
+                bursts the probe missed), "complexity" (probe bits per second)
+                and "budget" (bytes per hour).
+        """
+        budget = self.budget_bytes_per_hour()
+        budget_bps = budget * 8 / 3600
+        resolutions = self.resolutions
+        if source_resolution:
+            source_pixels = source_resolution[0] * source_resolution[1]
+            resolutions = [r for r in resolutions if r[0] * r[1] <= source_pixels] or resolutions[-1:]
+
+        probe_bps = probe_bitrate(input_file, start=max(0.0, (self.segment_seconds - PROBE_SECONDS) / 2))
+        if probe_bps is None:
+            resolution, crf = resolutions[-1], self.max_crf  # Unknown content: the cheapest setting is safe
+        else:
+            resolution, crf = choose_encoding(probe_bps, budget_bps, resolutions, self.quality, self.max_crf)
+        logger.info("Encoding %s at %dx%d CRF %d (budget %.0f MB/h, probe %s kbit/s)",
+                    os.path.basename(input_file), resolution[0], resolution[1], crf, budget / (1024 * 1024),
+                    "?" if probe_bps is None else f"{probe_bps / 1000:.0f}")
+        return {
+            "resolution": f"{resolution[0]}x{resolution[1]}",
+            "crf": crf,
+            "maxrate": max(MIN_MAXRATE, int(budget_bps * 2)),
+            "complexity": None if probe_bps is None else round(probe_bps),
+            "budget": round(budget),
+        }
@@ -1,18 +1,35 @@
 import os
-import shutil
+import json
+import logging
+import threading
 from datetime import datetime
 
+import backends
+
+logger = logging.getLogger(__name__)
+
 # Directory structure for storing videos
 STORAGE_DIR = "video_storage"
 
+# Per-segment metadata (thumbnails, time-lapse frames, ...) lives next to the segments
+INDEX_FILE = "index.json"
+# Per-second activity scores of a segment are kept out of the index, in "<segment>.activity.json"
+ACTIVITY_SUFFIX = ".activity.json"
+# Compressed copies are kept in this subdirectory of a camera directory, named "compressed_<segment>"
+COMPRESSED_DIR = "compressed"
+COMPRESSED_PREFIX = "compressed_"
+# Databases kept under the storage directory that must never be deleted to free space
+PROTECTED_DIRS = {"gps_track"}
+_index_lock = threading.Lock()
+
 def initialize_storage():
     """
     Initialize the storage directory structure.
     Creates the base directory if it doesn't exist.
     """
-    if not os.path.exists(STORAGE_DIR):
-        os.makedirs(STORAGE_DIR)
-    print(f"Storage initialized at: {STORAGE_DIR}")
+    if not backends.filesystem.exists(STORAGE_DIR):
+        backends.filesystem.makedirs(STORAGE_DIR)
+    logger.info("Storage initialized at: %s", STORAGE_DIR)
 
 def save_video_segment(segment_data, filename=None):
     """
@@ -30,64 +47,249 @@ def save_video_segment(segment_data, filename=None):
         filename = f"{timestamp}.mp4"
 
     file_path = os.path.join(STORAGE_DIR, filename)
-    with open(file_path, "wb") as f:
+    with backends.filesystem.open(file_path, "wb") as f:
         f.write(segment_data)
-    print(f"Video segment saved: {file_path}")
+    logger.info("Video segment saved: %s", file_path)
     return file_path
 
-def get_all_files():
+def get_all_files(storage_dir=STORAGE_DIR):
     """
-    Get a list of all files in the storage directory.
+    Get a list of all files in the storage directory, including per-camera subdirectories.
+
+    Args:
+        storage_dir (str): Directory to list.
 
     Returns:
         list: List of file paths in the storage directory.
     """
-    return [os.path.join(STORAGE_DIR, f) for f in os.listdir(STORAGE_DIR) if os.path.isfile(os.path.join(STORAGE_DIR, f))]
+    found = []
+    for root, dirs, files in backends.filesystem.walk(storage_dir):
+        dirs[:] = [d for d in dirs if d not in PROTECTED_DIRS]
+        # Activity files are removed together with their segment
+        found.extend(os.path.join(root, f) for f in files if f != INDEX_FILE and not f.endswith(ACTIVITY_SUFFIX))
+    return found
 
-def delete_oldest_file():
+def delete_oldest_file(storage_dir=STORAGE_DIR):
     """
     Delete the oldest file in the storage directory to free up space.
 
+    Args:
+        storage_dir (str): Directory to free space in.
+
     Returns:
         str: The path of the deleted file.
     """
-    files = get_all_files()
+    files = get_all_files(storage_dir)
     if not files:
-        print("No files to delete.")
+        logger.warning("No files to delete.")
         return None
 
-    oldest_file = min(files, key=os.path.getctime)
-    os.remove(oldest_file)
-    print(f"Deleted oldest file: {oldest_file}")
+    oldest_file = min(files, key=backends.filesystem.getctime)
+    backends.filesystem.remove(oldest_file)
+    logger.info("Deleted oldest file: %s", oldest_file)
     return oldest_file
 
-def check_storage_limit(max_storage_mb):
+def check_storage_limit(max_storage_mb, storage_dir=STORAGE_DIR):
     """
     Check if the total storage exceeds a limit and delete old files if necessary.
 
     Args:
         max_storage_mb (int): Maximum allowed storage in megabytes.
+        storage_dir (str): Directory to check.
 
     Returns:
         None
     """
-    total_size = sum(os.path.getsize(f) for f in get_all_files()) / (1024 * 1024)  # Convert bytes to MB
-    print(f"Current storage usage: {total_size:.2f} MB")
+    files = []
+    for path in get_all_files(storage_dir):
+        try:
+            files.append((backends.filesystem.getctime(path), backends.filesystem.getsize(path), path))
+        except FileNotFoundError:
+            continue  # Uploaded or deleted since it was listed
+    total_size = sum(size for _, size, _ in files) / (1024 * 1024)  # Convert bytes to MB
+    logger.info("Current storage usage: %.2f MB", total_size)
 
-    while total_size > max_storage_mb:
-        delete_oldest_file()
-        total_size = sum(os.path.getsize(f) for f in get_all_files()) / (1024 * 1024)
+    # Oldest first. Sizes are taken once, so a directory of many small files is not rescanned per deletion
+    deleted = []
+    for _, size, path in sorted(files):
+        if total_size <= max_storage_mb:
+            break
+        try:
+            backends.filesystem.remove(path)
+            logger.info("Deleted oldest file: %s", path)
+            deleted.append(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size / (1024 * 1024)
+    remove_from_index(deleted)
 
-def get_storage_stats():
+def get_storage_stats(storage_dir=STORAGE_DIR):
     """
     Get storage statistics including total, used, and free space.
 
+    Args:
+        storage_dir (str): Directory on the filesystem to report on.
+
     Returns:
         dict: A dictionary with storage stats.
     """
-    total, used, free = shutil.disk_usage(STORAGE_DIR)
+    total, used, free = backends.filesystem.disk_usage(storage_dir)
     return {
         "total": total / (1024 * 1024),  # Convert bytes to MB
         "used": used / (1024 * 1024),
         "free": free / (1024 * 1024)
     }
+
+def load_index(storage_dir=STORAGE_DIR):
+    """
+    Load the storage index for a directory.
+
+    Args:
+        storage_dir (str): Directory holding the segments and their index.
+
+    Returns:
+        dict: Mapping of segment file name to its metadata entry.
+    """
+    try:
+        with backends.filesystem.open(os.path.join(storage_dir, INDEX_FILE), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def update_index(segment_name, storage_dir=STORAGE_DIR, **fields):
+    """
+    Merge fields into a segment's index entry.
+
+    The index is rewritten to a temporary file and renamed into place so a
+    power cut never leaves a truncated index behind.
+
+    Args:
+        segment_name (str): File name of the segment.
+        storage_dir (str): Directory holding the segments and their index.
+        **fields: Metadata to store for the segment.
+
+    Returns:
+        dict: The updated index entry.
+    """
+    with _index_lock:
+        index = load_index(storage_dir)
+        entry = index.setdefault(segment_name, {})
+        entry.update(fields)
+        _write_index(storage_dir, index)
+    return entry
+
+def _write_index(storage_dir, index):
+    index_path = os.path.join(storage_dir, INDEX_FILE)
+    with backends.filesystem.open(index_path + ".tmp", "w") as f:
+        f.write(json.dumps(index))  # One write from the C encoder; json.dump() writes piece by piece
+    backends.filesystem.replace(index_path + ".tmp", index_path)
+
+def store_activity(segment_name, storage_dir, summary):
+    """
+    Store a segment's activity analysis.
+
+    The per-second scores go to the segment's own activity file; the index
+    only keeps the summary (mean, peak, blob count and the analysed span),
+    so it stays small enough to reload on every upload pass.
+
+    Args:
+        segment_name (str): File name of the segment.
+        storage_dir (str): Directory holding the segment and its index.
+        summary (dict): Analysis summary with the per-second rows under "activity".
+
+    Returns:
+        dict: The updated index entry.
+    """
+    fields = dict(summary)
+    per_second = fields.pop("activity", [])
+    activity_path = os.path.join(storage_dir, segment_name + ACTIVITY_SUFFIX)
+    with backends.filesystem.open(activity_path + ".tmp", "w") as f:
+        f.write(json.dumps(per_second))
+    backends.filesystem.replace(activity_path + ".tmp", activity_path)
+    return update_index(segment_name, storage_dir, **fields)
+
+def load_activity(segment_name, storage_dir=STORAGE_DIR):
+    """
+    Load the per-second activity scores of a segment.
+
+    Args:
+        segment_name (str): File name of the segment.
+        storage_dir (str): Directory holding the segment.
+
+    Returns:
+        list: [second, activity, blobs] rows, empty if the segment was not analysed.
+    """
+    try:
+        with backends.filesystem.open(os.path.join(storage_dir, segment_name + ACTIVITY_SUFFIX), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+def remove_from_index(deleted_paths):
+    """
+    Drop the index entries of segments that no longer have any file on the card.
+
+    Called by every path that deletes recordings, so the index only ever
+    describes what is stored. A compressed copy ("<camera>/compressed/
+    compressed_X.mp4") belongs to the entry of X.mp4 in the camera
+    directory; the entry stays while either the segment or its copy exists.
+    The segment's activity file goes with its entry.
+
+    Args:
+        deleted_paths (list): Paths of files that were just deleted.
+
+    Returns:
+        list: Names of the dropped entries.
+    """
+    by_dir = {}
+    for path in deleted_paths:
+        folder, name = os.path.split(path)
+        if os.path.basename(folder) == COMPRESSED_DIR:
+            folder = os.path.dirname(folder)
+            if name.startswith(COMPRESSED_PREFIX):
+                name = name[len(COMPRESSED_PREFIX):]
+        by_dir.setdefault(folder, set()).add(name)
+
+    dropped = []
+    for folder, names in by_dir.items():
+        with _index_lock:
+            index = load_index(folder)
+            gone = [name for name in sorted(names) if name in index
+                    and not backends.filesystem.exists(os.path.join(folder, name))
+                    and not backends.filesystem.exists(os.path.join(folder, COMPRESSED_DIR, COMPRESSED_PREFIX + name))]
+            if not gone:
+                continue
+            for name in gone:
+                del index[name]
+            _write_index(folder, index)
+        for name in gone:
+            try:
+                backends.filesystem.remove(os.path.join(folder, name + ACTIVITY_SUFFIX))
+            except FileNotFoundError:
+                pass
+        dropped.extend(gone)
+    return dropped
+
+def find_active_segments(storage_dir=STORAGE_DIR, min_activity=0.0, start=None, end=None):
+    """
+    Search the index for segments with analysed activity, busiest first.
+
+    Args:
+        storage_dir (str): Directory holding the segments and their index.
+        min_activity (float): Lowest mean activity score to include.
+        start (float): Optional Unix time; only segments with activity at or after it.
+        end (float): Optional Unix time; only segments with activity before it.
+
+    Returns:
+        list: (segment name, index entry) pairs ordered by mean activity, highest first.
+    """
+    found = []
+    for segment_name, entry in load_index(storage_dir).items():
+        if "activity_start" not in entry or entry["activity_mean"] < min_activity:
+            continue
+        if start is not None and entry["activity_end"] < start:
+            continue
+        if end is not None and entry["activity_start"] >= end:
+            continue
+        found.append((segment_name, entry))
+    return sorted(found, key=lambda item: item[1]["activity_mean"], reverse=True)
@@ -0,0 +1,231 @@
+import os
+import time
+import glob
+import shutil
+import logging
+import subprocess
+from datetime import datetime, date
+
+from storage_handler import load_index, update_index
+from io_scheduler import background_command
+
+logger = logging.getLogger(__name__)
+
+# Thumbnail settings
+THUMBNAIL_WIDTH = 320
+SHEET_COLUMNS = 4
+SHEET_ROWS = 4
+TIMELAPSE_INTERVAL = 10  # Seconds of footage between time-lapse frames
+TIMELAPSE_FPS = 30
+SETTLE_SECONDS = 10  # A segment untouched for this long is considered closed
+
+def probe_duration(input_file):
+    """
+    Read the duration of a video file with FFprobe.
+
+    Args:
+        input_file (str): Path to the video file.
+
+    Returns:
+        float: Duration in seconds, or None if it could not be determined.
+    """
+    command = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        input_file
+    ]
+    try:
+        result = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return float(result.stdout.strip())
+    except (subprocess.CalledProcessError, ValueError):
+        return None
+
+def _keyframe_filter(interval, width):
+    """
+    Build a filter that keeps at most one keyframe per interval and scales it down.
+
+    Args:
+        interval (float): Minimum spacing between kept frames in seconds.
+        width (int): Output width in pixels (height keeps the aspect ratio).
+
+    Returns:
+        str: FFmpeg filter expression.
+    """
+    return f"select=isnan(prev_selected_t)+gte(t-prev_selected_t\\,{interval:.3f}),scale={width}:-2"
+
+def build_contact_sheet(input_file, output_file, columns=SHEET_COLUMNS, rows=SHEET_ROWS, width=THUMBNAIL_WIDTH):
+    """
+    Build a JPEG contact sheet from the keyframes of a segment.
+
+    Only keyframes are decoded (``-skip_frame nokey``), so this costs a small
+    fraction of a full decode.
+
+    Args:
+        input_file (str): Path to the closed video segment.
+        output_file (str): Path to save the contact sheet.
+        columns (int): Number of thumbnails per row.
+        rows (int): Number of rows.
+        width (int): Width of each thumbnail in pixels.
+
+    Returns:
+        bool: True if the sheet was written, False otherwise.
+    """
+    duration = probe_duration(input_file) or 0
+    interval = duration / (columns * rows)
+    command = [
+        "ffmpeg", "-y", "-v", "error",
+        "-skip_frame", "nokey",
+        "-i", input_file,
+        "-vf", f"{_keyframe_filter(interval, width)},tile={columns}x{rows}",
+        "-frames:v", "1",
+        "-q:v", "5",
+        output_file
+    ]
+    try:
+        subprocess.run(background_command(command), check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        logger.info("Contact sheet built: %s -> %s", input_file, output_file)
+        return True
+    except subprocess.CalledProcessError as e:
+        logger.error("Failed to build contact sheet for %s: %s", input_file, e)
+        return False
+
+def extract_timelapse_frames(input_file, frame_dir, interval=TIMELAPSE_INTERVAL, width=THUMBNAIL_WIDTH):
+    """
+    Extract one keyframe per interval from a segment for the day's time-lapse.
+
+    Args:
+        input_file (str): Path to the closed video segment.
+        frame_dir (str): Directory collecting the day's time-lapse frames.
+        interval (float): Seconds of footage between extracted frames.
+        width (int): Width of the extracted frames in pixels.
+
+    Returns:
+        int: Number of frames extracted.
+    """
+    os.makedirs(frame_dir, exist_ok=True)
+    prefix = os.path.splitext(os.path.basename(input_file))[0]
+    command = [
+        "ffmpeg", "-y", "-v", "error",
+        "-skip_frame", "nokey",
+        "-i", input_file,
+        "-vf", _keyframe_filter(interval, width),
+        "-vsync", "vfr",
+        "-q:v", "5",
+        os.path.join(frame_dir, f"{prefix}_%04d.jpg")
+    ]
+    try:
+        subprocess.run(background_command(command), check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError as e:
+        logger.error("Failed to extract time-lapse frames from %s: %s", input_file, e)
+        return 0
+    return len(glob.glob(os.path.join(frame_dir, f"{prefix}_*.jpg")))
+
+def build_timelapse(frame_dir, output_file, fps=TIMELAPSE_FPS):
+    """
+    Encode a directory of time-lapse frames into a video.
+
+    Args:
+        frame_dir (str): Directory containing the frames, named in time order.
+        output_file (str): Path to save the time-lapse video.
+        fps (int): Playback frame rate.
+
+    Returns:
+        bool: True if the time-lapse was written, False otherwise.
+    """
+    command = [
+        "ffmpeg", "-y", "-v", "error",
+        "-framerate", str(fps),
+        "-pattern_type", "glob",
+        "-i", os.path.join(frame_dir, "*.jpg"),
+        "-c:v", "libx264",
+        "-preset", "veryfast",
+        "-pix_fmt", "yuv420p",
+        "-movflags", "faststart",
+        output_file
+    ]
+    try:
+        subprocess.run(background_command(command), check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        logger.info("Time-lapse built: %s", output_file)
+        return True
+    except subprocess.CalledProcessError as e:
+        logger.error("Failed to build time-lapse %s: %s", output_file, e)
+        return False
+
+def is_segment(file_name):
+    """
+    Check whether a file in the video folder is a recorded segment.
+
+    Args:
+        file_name (str): Name of the file.
+
+    Returns:
+        bool: True for segments, False for derived files such as time-lapses.
+    """
+    return (file_name.endswith(".mp4")
+            and not file_name.startswith("timelapse_")
+            and not file_name.startswith("compressed_"))
+
+def process_closed_segments(video_folder, settle_seconds=SETTLE_SECONDS, preview_folder=None):
+    """
+    Build contact sheets and time-lapse frames for segments that are no longer being written.
+
+    Contact sheets are written next to the segments so the uploader sends them
+    ahead of the full video. Once a day is over, its time-lapse is encoded too.
+
+    Args:
+        video_folder (str): Directory containing the video segments.
+        settle_seconds (int): Age in seconds after which a segment counts as closed.
+        preview_folder (str): Where sheets and time-lapses are written for upload
+            (defaults to the video folder).
+
+    Returns:
+        None
+    """
+    preview_folder = preview_folder or video_folder
+    os.makedirs(preview_folder, exist_ok=True)
+    index = load_index(video_folder)
+    now = time.time()
+
+    for file_name in sorted(os.listdir(video_folder)):
+        if not is_segment(file_name) or "contact_sheet" in index.get(file_name, {}):
+            continue
+        file_path = os.path.join(video_folder, file_name)
+        modified = os.path.getmtime(file_path)
+        if now - modified < settle_seconds:
+            continue  # Still being recorded
+
+        day = datetime.fromtimestamp(modified).strftime("%Y%m%d")
+        sheet_name = f"{os.path.splitext(file_name)[0]}_sheet.jpg"
+        if not build_contact_sheet(file_path, os.path.join(preview_folder, sheet_name)):
+            continue
+        frames = extract_timelapse_frames(file_path, os.path.join(video_folder, "timelapse", day))
+        update_index(file_name, video_folder, contact_sheet=sheet_name, timelapse_day=day, timelapse_frames=frames)
+
+    build_finished_timelapses(video_folder, preview_folder)
+
+def build_finished_timelapses(video_folder, preview_folder=None):
+    """
+    Encode the time-lapse of every completed day that does not have one yet.
+
+    Args:
+        video_folder (str): Directory containing the video segments.
+        preview_folder (str): Where time-lapses are written (defaults to the video folder).
+
+    Returns:
+        None
+    """
+    frame_root = os.path.join(video_folder, "timelapse")
+    if not os.path.isdir(frame_root):
+        return
+
+    today = date.today().strftime("%Y%m%d")
+    index = load_index(video_folder)
+    for day in sorted(os.listdir(frame_root)):
+        output_name = f"timelapse_{day}.mp4"
+        if day >= today or output_name in index:
+            continue
+        frame_dir = os.path.join(frame_root, day)
+        if build_timelapse(frame_dir, os.path.join(preview_folder or video_folder, output_name)):
+            update_index(output_name, video_folder, timelapse_day=day)
+            shutil.rmtree(frame_dir, ignore_errors=True)
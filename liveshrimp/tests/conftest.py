@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Modules import each other by bare name (as main.py does), so put every package directory on the path
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for subdir in ("camera", "network", "server", "simulation", "storage", "utilities"):
+    sys.path.insert(0, os.path.join(PACKAGE_DIR, subdir))
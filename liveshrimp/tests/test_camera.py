@@ -1,9 +1,15 @@
+import os
+import sys
 import argparse
 import cv2
 import picamera
 import picamera.array
 import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "network"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "storage"))
+from preview_server import PreviewHub, start_preview_server
+
 def pi_cam_to_monitor():
     """Display live feed from the Pi Camera on the monitor."""
     with picamera.PiCamera() as camera:
@@ -17,11 +23,20 @@ def pi_cam_to_monitor():
                 output.truncate(0)
     cv2.destroyAllWindows()
 
-def pi_cam_to_stream():
-    """Stream live feed from the Pi Camera to a server."""
-    # Placeholder for streaming logic (e.g., using FFmpeg or RTMP setup)
-    print("Pi Camera streaming is not yet implemented.")
-    # Future: Integrate with FFmpeg or a streaming library.
+def pi_cam_to_stream(port=8080):
+    """Serve a live MJPEG preview of the Pi Camera on http://<pi>:<port>/."""
+    hub = PreviewHub()
+    start_preview_server(hub, port=port)
+    print(f"Preview at http://0.0.0.0:{port}/ (Ctrl-C to stop)")
+    with picamera.PiCamera() as camera:
+        camera.resolution = (640, 480)
+        with picamera.array.PiRGBArray(camera) as output:
+            try:
+                for frame in camera.capture_continuous(output, format="bgr", use_video_port=True):
+                    hub.publish("picam", frame.array.copy())
+                    output.truncate(0)
+            except KeyboardInterrupt:
+                pass
 
 def other_cam_to_monitor(camera_index=0):
     """Display live feed from an external camera (e.g., USB webcam) on the monitor."""
@@ -41,11 +56,26 @@ def other_cam_to_monitor(camera_index=0):
     cap.release()
     cv2.destroyAllWindows()
 
-def other_cam_to_stream(camera_index=0):
-    """Stream live feed from an external camera (e.g., USB webcam) to a server."""
-    # Placeholder for streaming logic (e.g., using FFmpeg or RTMP setup)
-    print("External camera streaming is not yet implemented.")
-    # Future: Integrate with FFmpeg or a streaming library.
+def other_cam_to_stream(camera_index=0, port=8080):
+    """Serve a live MJPEG preview of an external camera (e.g., USB webcam) on http://<pi>:<port>/."""
+    cap = cv2.VideoCapture(camera_index)
+    if not cap.isOpened():
+        print("Error: Could not open the external camera.")
+        return
+
+    hub = PreviewHub()
+    start_preview_server(hub, port=port)
+    print(f"Preview at http://0.0.0.0:{port}/ (Ctrl-C to stop)")
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                print("Error: Failed to capture frame from external camera.")
+                break
+            hub.publish(f"camera{camera_index}", frame)
+    except KeyboardInterrupt:
+        pass
+    cap.release()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Test different camera modes.")
@@ -60,15 +90,21 @@ if __name__ == "__main__":
         default=0, 
         help="Index of the external camera (default is 0)."
     )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8080,
+        help="Port of the preview server in stream modes (default is 8080)."
+    )
     args = parser.parse_args()
 
     if args.mode == "pi_cam_monitor":
         pi_cam_to_monitor()
     elif args.mode == "pi_cam_stream":
-        pi_cam_to_stream()
+        pi_cam_to_stream(args.port)
     elif args.mode == "other_cam_monitor":
         other_cam_to_monitor(args.camera_index)
     elif args.mode == "other_cam_stream":
-        other_cam_to_stream(args.camera_index)
+        other_cam_to_stream(args.camera_index, args.port)
     else:
         print("Invalid mode selected.")
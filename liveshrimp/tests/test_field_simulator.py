@@ -0,0 +1,23 @@
+import backends
+from field_simulator import FieldSimulation, LatencyTrace
+
+def test_trace_repeats_and_reports_changes():
+    trace = LatencyTrace.periodic(base=1.0, peak=5.0, period=100, peak_seconds=10)
+
+    assert [trace.at(t) for t in (0, 9.9, 10, 99, 100, 215)] == [5.0, 5.0, 1.0, 1.0, 5.0, 1.0]
+    assert trace.next_change(5) == 10
+    assert trace.next_change(50) == 100
+
+def test_simulation_is_deterministic_and_restores_backends():
+    def run():
+        summary = FieldSimulation(existing_files=500, seed=1).run(hours=3)
+        summary.pop("real_seconds")
+        return summary
+
+    first = run()
+
+    assert first == run()
+    assert first["segments"] == 180
+    assert first["uploaded_files"] > 500  # The old files and then new segments went out while the link was up
+    assert first["jobs"]["storage"]["runs"] > 0
+    assert isinstance(backends.filesystem, backends.LocalFileSystem)
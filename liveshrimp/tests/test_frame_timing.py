@@ -0,0 +1,40 @@
+from frame_timing import FixedRateWriter
+
+class ListWriter:
+    def __init__(self):
+        self.frames = []
+
+    def write(self, frame):
+        self.frames.append(frame)
+
+    def release(self):
+        pass
+
+def test_slow_capture_repeats_frames():
+    sink = ListWriter()
+    writer = FixedRateWriter(sink, fps=10, start_time=0.0)
+    for i, t in enumerate([0.0, 0.3, 0.6]):
+        writer.write(i, t)
+    writer.finish(1.0)
+
+    assert sink.frames == [0, 0, 0, 1, 1, 1, 2, 2, 2, 2]
+    assert writer.stats()["duplicated"] == 7
+
+def test_fast_capture_drops_frames():
+    sink = ListWriter()
+    writer = FixedRateWriter(sink, fps=10, start_time=0.0)
+    for i in range(10):
+        writer.write(i, i * 0.05)
+
+    assert sink.frames == [0, 2, 4, 6, 8]
+    assert writer.stats()["dropped"] == 5
+
+def test_long_stall_is_filled_up_to_limit():
+    sink = ListWriter()
+    writer = FixedRateWriter(sink, fps=10, start_time=0.0, max_fill=1.0)
+    writer.write("a", 0.0)
+    writer.write("b", 5.0)
+    writer.write("c", 5.1)
+
+    assert sink.frames == ["a"] * 11 + ["b", "c"]
+    assert writer.stats()["skipped"] == 39
@@ -0,0 +1,54 @@
+from gps_track_store import GpsTrackStore, geohash_encode
+
+def record_track(store):
+    store.start_segment("cam0/a.mp4", start_time=100)
+    store.append(37.7749, -122.4194, timestamp=101)
+    store.append(37.7750, -122.4195, timestamp=130)
+    store.end_segment("cam0/a.mp4", end_time=160)
+
+    store.start_segment("cam0/b.mp4", start_time=200)
+    store.append(34.0522, -118.2437, timestamp=210)
+    store.end_segment("cam0/b.mp4", end_time=260)
+
+def test_geohash_matches_reference():
+    assert geohash_encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+
+def test_time_and_bbox_queries(tmp_path):
+    store = GpsTrackStore(str(tmp_path))
+    record_track(store)
+
+    assert store.segments_between(150, 205) == ["cam0/a.mp4", "cam0/b.mp4"]
+    assert store.segments_between(240, 300) == ["cam0/b.mp4"]
+    assert store.segments_in_bbox(37.7, -122.5, 37.8, -122.4) == ["cam0/a.mp4"]
+    assert store.segments_in_bbox(30, -125, 40, -115) == ["cam0/a.mp4", "cam0/b.mp4"]
+    assert store.segments_in_bbox(30, -125, 40, -115, start=240, end=250) == ["cam0/b.mp4"]
+    assert [round(f[1], 4) for f in store.fixes_between(100, 150)] == [37.7749, 37.775]
+
+def test_store_survives_reopen(tmp_path):
+    store = GpsTrackStore(str(tmp_path))
+    record_track(store)
+    store.start_segment("cam0/c.mp4", start_time=260)
+    store.append(34.0523, -118.2438, timestamp=270)
+    store.close()
+
+    reopened = GpsTrackStore(str(tmp_path))
+    assert reopened.segments_in_bbox(34.0, -118.3, 34.1, -118.2) == ["cam0/b.mp4", "cam0/c.mp4"]
+    assert reopened.segment_summary("cam0/c.mp4")["end"] == 270
+
+def test_recovered_segment_stays_closed(tmp_path):
+    store = GpsTrackStore(str(tmp_path))
+    store.start_segment("a", start_time=100)
+    store.append(10, 10, timestamp=101)
+    store.close()  # Stopped without ending "a"
+
+    store = GpsTrackStore(str(tmp_path))
+    store.start_segment("b", start_time=99_990)
+    store.append(50, 50, timestamp=100_000)
+    store.end_segment("b", end_time=100_010)
+    store.close()
+
+    reopened = GpsTrackStore(str(tmp_path))
+    assert reopened.segment_summary("a")["end"] == 101
+    assert reopened.segment_summary("a")["bbox"] == [10, 10, 10, 10]
+    assert reopened.segments_in_bbox(49, 49, 51, 51) == ["b"]
+    assert reopened.segments_between(200, 300) == []
@@ -0,0 +1,88 @@
+import asyncio
+
+from ingest_server import DeviceLimits, IngestServer, TokenBucket
+from load_generator import run_load
+from upload_bundler import bundle_stream, upload_bundle
+from upload_handler import generate_metadata, get_device_id, post_file
+
+def test_token_bucket_allows_burst_then_throttles():
+    now = [0.0]
+    bucket = TokenBucket(rate=100, burst=200, clock=lambda: now[0])
+
+    assert bucket.delay(150) == 0.0
+    assert bucket.delay(100) == 0.5
+    now[0] += 0.5
+    assert bucket.delay(50) == 0.5
+
+def test_devices_upload_concurrently_and_are_indexed(tmp_path):
+    async def scenario():
+        server = IngestServer(str(tmp_path), limits=DeviceLimits(max_requests=1))
+        port = await server.start("127.0.0.1", 0)
+        try:
+            summary = await run_load(f"http://127.0.0.1:{port}/upload", devices=4, files=3, size=100_000, parallel=2)
+            rows = server.index.query("SELECT device_id, size FROM uploads")
+        finally:
+            await server.close()
+        return summary, rows
+
+    summary, rows = asyncio.run(scenario())
+
+    assert summary["uploads_ok"] == 12
+    assert summary["connection_errors"] == 0
+    assert len(rows) == 12
+    assert {device for device, _ in rows} == {f"sim-{n:05d}" for n in range(4)}
+    assert all(size == 100_000 for _, size in rows)
+
+def test_device_uploads_are_filed_under_its_id(tmp_path):
+    (tmp_path / "cam0").mkdir()
+    for name in ("20240101_120000.mp4", "20240101_120000_sheet.jpg"):
+        (tmp_path / "cam0" / name).write_bytes(b"x" * 1000)
+
+    async def scenario():
+        server = IngestServer(str(tmp_path / "server"))
+        port = await server.start("127.0.0.1", 0)
+        loop = asyncio.get_running_loop()
+        try:
+            metadata = generate_metadata("20240101_120000.mp4", camera_name="cam0")
+            uploaded = await loop.run_in_executor(None, post_file, str(tmp_path / "cam0" / "20240101_120000.mp4"),
+                                                  f"http://127.0.0.1:{port}/upload", metadata)
+            bundled = await loop.run_in_executor(None, upload_bundle, str(tmp_path / "cam0"),
+                                                 ["20240101_120000_sheet.jpg"], f"http://127.0.0.1:{port}/bundle",
+                                                 None, None, get_device_id())
+            rows = server.index.query("SELECT device_id, file_name FROM uploads ORDER BY file_name")
+        finally:
+            await server.close()
+        return uploaded, bundled, rows
+
+    uploaded, bundled, rows = asyncio.run(scenario())
+
+    device_id = get_device_id()
+    assert device_id and device_id != "raspberry_pi_4"
+    assert uploaded and bundled == ["20240101_120000_sheet.jpg"]
+    assert rows == [(device_id, "20240101_120000.mp4"), (device_id, "20240101_120000_sheet.jpg")]
+    assert get_device_id("tank-7") == "tank-7"
+
+def test_interrupted_bundle_leaves_no_parts(tmp_path):
+    (tmp_path / "cam0").mkdir()
+    (tmp_path / "cam0" / "1.mp4").write_bytes(b"x" * 100_000)
+    archive = b"".join(bundle_stream(str(tmp_path / "cam0"), ["1.mp4"]))
+
+    async def scenario():
+        server = IngestServer(str(tmp_path / "server"))
+        port = await server.start("127.0.0.1", 0)
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"POST /bundle HTTP/1.1\r\nX-Device-Id: dev1\r\nContent-Length: {len(archive)}\r\n\r\n".encode())
+            writer.write(archive[:50_000])  # Disconnect halfway through the file
+            await writer.drain()
+            writer.close()
+            for _ in range(500):
+                if server.stats["errors"]:
+                    break  # The server gave up on the request
+                await asyncio.sleep(0.01)
+        finally:
+            await server.close()
+
+    asyncio.run(scenario())
+
+    assert list((tmp_path / "server" / "dev1" / "incoming").iterdir()) == []
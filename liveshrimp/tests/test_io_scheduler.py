@@ -0,0 +1,41 @@
+from io_scheduler import CoalescingWriter, IoCoordinator, BLOCK_SIZE
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def test_small_writes_are_coalesced_into_aligned_chunks(tmp_path):
+    path = tmp_path / "out.mp4"
+    data = bytes(range(256)) * 1000
+    with CoalescingWriter(str(path), chunk_size=10000, sync_every=0) as writer:
+        for i in range(0, len(data), 100):
+            writer.write(data[i:i + 100])
+        assert writer.chunk_size % BLOCK_SIZE == 0
+        assert writer.bytes_written % writer.chunk_size == 0
+
+    assert path.read_bytes() == data
+    assert writer.writes == -(-len(data) // writer.chunk_size)
+
+def test_background_io_waits_while_capture_is_congested():
+    clock = FakeClock()
+    coordinator = IoCoordinator(stall_seconds=0.05, quiet_seconds=1.0, clock=clock, sleep=clock.sleep)
+
+    coordinator.record_capture_write(0.01)
+    coordinator.throttle()
+    assert clock.now == 0.0
+
+    coordinator.record_capture_write(0.2)
+    coordinator.throttle()
+    assert clock.now == 1.0
+    assert not coordinator.capture_congested()
+
+    coordinator.background_bytes_per_second = 1000
+    coordinator.throttle(500)
+    coordinator.throttle(500)
+    assert clock.now == 1.5
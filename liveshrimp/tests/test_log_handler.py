@@ -0,0 +1,45 @@
+import logging
+
+from log_handler import RateLimitFilter, BatchingRotatingFileHandler
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def make_record(msg, *args):
+    return logging.LogRecord("gps_utils", logging.WARNING, __file__, 1, msg, args, None)
+
+def test_repeated_messages_are_collapsed():
+    clock = FakeClock()
+    rate_filter = RateLimitFilter(window=10, clock=clock)
+
+    assert rate_filter.filter(make_record("Error retrieving GPS data: %s", "timeout"))
+    for _ in range(29):
+        assert not rate_filter.filter(make_record("Error retrieving GPS data: %s", "timeout"))
+
+    clock.now = 10
+    record = make_record("Error retrieving GPS data: %s", "timeout")
+    assert rate_filter.filter(record)
+    assert "suppressed 29 similar messages" in record.getMessage()
+
+def test_distinct_messages_pass_up_to_burst():
+    rate_filter = RateLimitFilter(window=10, burst=3, clock=FakeClock())
+    passed = [rate_filter.filter(make_record("Uploaded: %s", f"segment_{i}.mp4")) for i in range(5)]
+    assert passed == [True, True, True, False, False]
+
+def test_batching_handler_writes_in_batches(tmp_path):
+    log_file = tmp_path / "capture.log"
+    handler = BatchingRotatingFileHandler(str(log_file), batch_size=3, flush_interval=60)
+
+    handler.handle(make_record("first"))
+    handler.handle(make_record("second"))
+    assert not log_file.exists()
+    assert handler.pending.is_set()  # Wakes the flusher thread
+
+    handler.handle(make_record("third"))
+    assert log_file.read_text().splitlines() == ["first", "second", "third"]
+    assert not handler.pending.is_set()
+    handler.close()
@@ -0,0 +1,52 @@
+import io
+
+from mpegts import CLOCK_RATE, PACKET_SIZE, PTS_OFFSET, TransportStreamMuxer, VIDEO_PID, crc32_mpeg
+
+def parse_pes(stream):
+    """
+    Reassemble the video PES packets of a transport stream into (pts, payload) pairs.
+    """
+    pes = []
+    counters = {}
+    for offset in range(0, len(stream), PACKET_SIZE):
+        packet = stream[offset:offset + PACKET_SIZE]
+        assert len(packet) == PACKET_SIZE and packet[0] == 0x47
+        pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        counter = packet[3] & 0x0F
+        if pid in counters:
+            assert counter == (counters[pid] + 1) & 0x0F
+        counters[pid] = counter
+        if pid != VIDEO_PID:
+            continue
+        payload = packet[4:]
+        if packet[3] & 0x20:
+            payload = payload[1 + payload[0]:]
+        if packet[1] & 0x40:
+            pes.append(bytearray())
+        pes[-1] += payload
+
+    frames = []
+    for data in pes:
+        assert data[:4] == b"\x00\x00\x01\xe0"
+        p = data[9:14]
+        pts = ((p[0] >> 1) & 0x07) << 30 | p[1] << 22 | (p[2] >> 1) << 15 | p[3] << 7 | p[4] >> 1
+        frames.append((pts, bytes(data[9 + data[8]:])))
+    return frames
+
+def test_crc_matches_mpeg2_check_value():
+    assert crc32_mpeg(b"123456789") == 0x0376E6E7
+
+def test_packets_keep_their_capture_times():
+    output = io.BytesIO()
+    muxer = TransportStreamMuxer(output)
+    # Irregular capture times and sizes that do and do not fill whole transport packets
+    captured = [(1000.0, b"\x00\x00\x00\x01\x65" + b"k" * 5000, True),
+                (1000.041, b"\x00\x00\x00\x01\x41" + b"p" * 170, False),
+                (1000.075, b"\x00\x00\x00\x01\x41" + b"p", False),
+                (1000.2, b"\x00\x00\x00\x01\x41" + b"p" * 171, False)]
+    for timestamp, data, keyframe in captured:
+        muxer.write(data, timestamp, keyframe)
+
+    frames = parse_pes(output.getvalue())
+    assert [data for _, data in frames] == [data for _, data, _ in captured]
+    assert [pts - PTS_OFFSET for pts, _ in frames] == [round((t - 1000.0) * CLOCK_RATE) for t, _, _ in captured]
@@ -0,0 +1,51 @@
+import re
+import asyncio
+
+from preview_server import PreviewHub, PreviewServer
+
+async def read_frame(reader):
+    headers = await reader.readuntil(b"\r\n\r\n")
+    frame = await reader.readexactly(int(re.search(rb"Content-Length: (\d+)", headers).group(1)))
+    await reader.readexactly(2)  # CRLF after the frame
+    return frame
+
+def test_reconnecting_viewer_gets_fresh_frames():
+    async def scenario():
+        hub = PreviewHub(fps=50)
+        hub._encode = lambda frame: frame  # Frames are already "JPEG" bytes
+        label = ["first"]
+
+        async def camera():
+            count = 0
+            while True:
+                count += 1
+                hub.publish("cam0", f"{label[0]}-{count}".encode())
+                await asyncio.sleep(0.005)
+
+        publisher = asyncio.create_task(camera())
+        listener = await asyncio.start_server(PreviewServer(hub)._handle, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+
+        async def watch(frames):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /stream/cam0.mjpg HTTP/1.1\r\n\r\n")
+            await reader.readuntil(b"\r\n\r\n")
+            received = [await asyncio.wait_for(read_frame(reader), timeout=2) for _ in range(frames)]
+            writer.close()
+            return received
+
+        try:
+            first = await watch(20)
+            while "cam0" in hub._encoders:  # The server notices the disconnect on its next write
+                await asyncio.sleep(0.01)
+            label[0] = "second"
+            second = await watch(2)
+        finally:
+            publisher.cancel()
+            listener.close()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert all(frame.startswith(b"first-") for frame in first)
+    assert all(frame.startswith(b"second-") for frame in second)
@@ -0,0 +1,22 @@
+from rate_control import ThroughputMeter, choose_encoding, hourly_budget, predict_bits_per_second
+
+def test_budget_combines_free_space_and_upload_capacity():
+    meter = ThroughputMeter()
+    meter.record_transfer(1_000_000, 10)  # 100 kB/s while online
+    meter.record_connectivity(True)
+    meter.record_connectivity(False)  # Online 80% of the time
+
+    assert meter.bytes_per_hour() == 100_000 * 0.8 * 3600
+    assert hourly_budget(48_000_000, 0, streams=2, horizon_hours=48) == 500_000
+    assert hourly_budget(0, meter.bytes_per_hour(), upload_share=0.5) == 144_000_000
+
+def test_busy_scenes_lose_quality_before_resolution():
+    resolutions = [(1280, 720), (640, 360)]
+    budget = predict_bits_per_second(100_000, (1280, 720), 25)
+
+    # A static scene fits at the best quality and full resolution
+    assert choose_encoding(50_000, budget, resolutions, quality=25, max_crf=36) == ((1280, 720), 25)
+    # Four times the detail costs 12 CRF steps, more than allowed, so the resolution drops
+    assert choose_encoding(400_000, budget, resolutions, quality=25, max_crf=36) == ((640, 360), 28)
+    # Beyond anything that fits: smallest resolution, worst quality
+    assert choose_encoding(10_000_000, budget, resolutions, quality=25, max_crf=36) == ((640, 360), 36)
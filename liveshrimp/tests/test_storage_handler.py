@@ -0,0 +1,49 @@
+import os
+
+from storage_handler import (check_storage_limit, find_active_segments, load_activity, load_index, remove_from_index,
+                             store_activity, update_index)
+
+def activity_summary(rows):
+    scores = [activity for _, activity, _ in rows]
+    return {"activity": rows, "activity_mean": sum(scores) / len(scores), "activity_peak": max(scores),
+            "max_blobs": max(blobs for _, _, blobs in rows), "activity_start": rows[0][0], "activity_end": rows[-1][0]}
+
+def test_find_active_segments_orders_by_activity(tmp_path):
+    storage_dir = str(tmp_path)
+    store_activity("a.mp4", storage_dir, activity_summary([[100, 0.01, 1]]))
+    store_activity("b.mp4", storage_dir, activity_summary([[200, 0.2, 4], [201, 0.4, 6]]))
+    update_index("c.mp4", storage_dir, contact_sheet="c_sheet.jpg")
+
+    assert [name for name, _ in find_active_segments(storage_dir)] == ["b.mp4", "a.mp4"]
+    assert [name for name, _ in find_active_segments(storage_dir, min_activity=0.1)] == ["b.mp4"]
+    assert [name for name, _ in find_active_segments(storage_dir, start=150)] == ["b.mp4"]
+    assert [name for name, _ in find_active_segments(storage_dir, end=150)] == ["a.mp4"]
+
+    # Per-second rows stay out of the index
+    assert "activity" not in load_index(storage_dir)["b.mp4"]
+    assert load_activity("b.mp4", storage_dir) == [[200, 0.2, 4], [201, 0.4, 6]]
+    assert load_activity("c.mp4", storage_dir) == []
+
+def test_deleted_segments_leave_the_index(tmp_path):
+    camera_dir = tmp_path / "cam0"
+    (camera_dir / "compressed").mkdir(parents=True)
+    for name in ("a.mp4", "b.mp4", "compressed/compressed_b.mp4", "compressed/timelapse_20240101.mp4"):
+        (camera_dir / name).write_bytes(b"x" * 1024)
+    for name in ("a.mp4", "b.mp4", "timelapse_20240101.mp4"):
+        update_index(name, str(camera_dir), encoding={"crf": 25})
+    store_activity("a.mp4", str(camera_dir), activity_summary([[100, 0.5, 2]]))
+
+    # Over the limit: the oldest files go, and with them the entry and activity of a.mp4
+    check_storage_limit(3 * 1024 / (1024 * 1024), str(tmp_path))
+    assert not (camera_dir / "a.mp4").exists()
+    assert load_activity("a.mp4", str(camera_dir)) == []
+    assert set(load_index(str(camera_dir))) == {"b.mp4", "timelapse_20240101.mp4"}
+
+    # b.mp4 keeps its entry while its compressed copy waits for upload
+    os.remove(camera_dir / "b.mp4")
+    assert remove_from_index([str(camera_dir / "b.mp4")]) == []
+    os.remove(camera_dir / "compressed" / "compressed_b.mp4")
+    os.remove(camera_dir / "compressed" / "timelapse_20240101.mp4")
+    assert remove_from_index([str(camera_dir / "compressed" / "compressed_b.mp4"),
+                              str(camera_dir / "compressed" / "timelapse_20240101.mp4")]) == ["b.mp4", "timelapse_20240101.mp4"]
+    assert load_index(str(camera_dir)) == {}
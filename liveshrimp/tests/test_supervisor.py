@@ -0,0 +1,60 @@
+from supervisor import Supervisor
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+def test_stalled_worker_is_restarted():
+    clock = FakeClock()
+    beat = {"time": clock.now}
+    restarts = []
+
+    def restart():
+        restarts.append(clock.now)
+        beat["time"] = clock.now
+
+    supervisor = Supervisor(clock=clock)
+    supervisor.watch("capture", lambda: beat["time"], restart, stall_seconds=5)
+
+    clock.now += 4
+    assert supervisor.check() == []
+    clock.now += 2
+    assert supervisor.check() == ["capture"]
+    assert restarts == [106.0]
+    assert supervisor.status()["capture"]["restarts"] == 1
+
+def test_failing_restart_backs_off():
+    clock = FakeClock()
+    attempts = []
+
+    def restart():
+        attempts.append(clock.now)
+        raise RuntimeError("camera unplugged")
+
+    supervisor = Supervisor(clock=clock)
+    supervisor.watch("capture", lambda: None, restart, stall_seconds=5)
+    for _ in range(10):
+        supervisor.check()
+        clock.now += 1
+
+    assert attempts == [100.0, 102.0, 106.0]
+    assert supervisor.status()["capture"]["failures"] == 3
+
+def test_next_check_is_due_when_a_heartbeat_can_go_stale():
+    clock = FakeClock()
+    beats = {"capture": clock.now, "upload": clock.now}
+    supervisor = Supervisor(check_interval=30, clock=clock)
+    supervisor.watch("upload", lambda: beats["upload"], lambda: None, stall_seconds=900)
+    assert supervisor.next_delay() == 30
+
+    supervisor.watch("capture", lambda: beats["capture"], lambda: None, stall_seconds=5)
+    clock.now += 2
+    assert supervisor.next_delay() == 3
+
+    beats["capture"] = None  # Died: retried once its restart backoff has passed
+    supervisor.check()
+    clock.now += 0.5
+    assert supervisor.next_delay() == 1.5
@@ -0,0 +1,43 @@
+from task_scheduler import TaskScheduler
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+def test_jobs_run_at_their_intervals_without_drift():
+    clock = FakeClock()
+    runs = []
+    scheduler = TaskScheduler(workers=0, clock=clock, rng=lambda low, high: high)
+    scheduler.every(10, lambda: runs.append(clock.now), name="fast", jitter=2)
+    scheduler.every(60, lambda: None, name="slow")
+
+    assert scheduler.run_pending() == 12.0
+    for _ in range(3):
+        clock.now += scheduler.next_delay()
+        scheduler.run_pending()
+
+    assert runs == [112.0, 122.0, 132.0]
+    status = scheduler.status()
+    assert status["fast"]["runs"] == 3
+    assert status["slow"]["runs"] == 0
+
+def test_running_job_is_not_started_again_and_can_be_abandoned():
+    clock = FakeClock()
+    scheduler = TaskScheduler(workers=0, clock=clock)
+    job = scheduler.every(10, lambda: None, name="upload", delay=0)
+    job.running_since = clock.now  # As if a worker were still busy with it
+
+    clock.now += 10
+    scheduler.run_pending()
+    assert job.skipped == 1
+    assert job.runs == 0
+
+    scheduler.revive(max_age=10)
+    clock.now += 10
+    scheduler.run_pending()
+    assert job.abandoned == 1
+    assert job.runs == 1
+    scheduler.stop()
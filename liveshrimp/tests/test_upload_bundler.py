@@ -0,0 +1,40 @@
+import io
+
+from upload_bundler import bundle_stream, plan_uploads, unpack_bundle
+
+def test_plan_keeps_order_and_sends_large_files_alone():
+    sizes = [("a.jpg", 10), ("b.jpg", 10), ("big.mp4", 500), ("c.mp4", 60), ("d.mp4", 60), ("e.mp4", 10)]
+    plan = plan_uploads(sizes, target_bytes=100, small_file_bytes=100)
+
+    assert plan == [("bundle", ["a.jpg", "b.jpg"]), ("file", "big.mp4"),
+                    ("bundle", ["c.mp4", "d.mp4"]), ("bundle", ["e.mp4"])]
+
+def test_bundle_round_trip_with_manifest(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "1.mp4").write_bytes(b"x" * 1000)
+    (source / "1_sheet.jpg").write_bytes(b"jpeg")
+
+    archive = b"".join(bundle_stream(str(source), ["1.mp4", "1_sheet.jpg"],
+                                     metadata_callback=lambda name: {"filename": name}, telemetry={"battery": 80}))
+    received = unpack_bundle(io.BytesIO(archive), str(tmp_path / "server"))
+
+    assert received == ["1.mp4", "1_sheet.jpg"]
+    assert (tmp_path / "server" / "1.mp4").read_bytes() == b"x" * 1000
+    assert (tmp_path / "server" / "1.mp4.json").read_text() == '{"filename": "1.mp4"}'
+
+    # A second bundle within the same second keeps its own telemetry
+    unpack_bundle(io.BytesIO(archive), str(tmp_path / "server"))
+    assert len(list((tmp_path / "server").glob("telemetry_*.json"))) == 2
+
+def test_corrupt_file_in_bundle_is_rejected(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "1.mp4").write_bytes(b"x" * 1000)
+
+    archive = bytearray(b"".join(bundle_stream(str(source), ["1.mp4"])))
+    archive[archive.index(b"x" * 1000) + 10] = ord("y")
+    received = unpack_bundle(io.BytesIO(bytes(archive)), str(tmp_path / "server"))
+
+    assert received == []
+    assert not list((tmp_path / "server").iterdir())
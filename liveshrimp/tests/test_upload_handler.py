@@ -0,0 +1,23 @@
+import backends
+from upload_handler import upload_pending_files
+
+class RecordingTransport:
+    def __init__(self):
+        self.uploaded = []
+
+    def upload(self, file_path, upload_url, metadata=None):
+        self.uploaded.append(file_path)
+        return True
+
+def test_segment_being_recorded_is_not_uploaded(tmp_path):
+    # Compression disabled: the camera records straight into the upload folder
+    (tmp_path / "20240101_120000.mp4").write_bytes(b"done")
+    (tmp_path / "20240101_120100.mp4").write_bytes(b"still recording")
+    transport = RecordingTransport()
+
+    with backends.use_backends(transport=transport):
+        upload_pending_files(str(tmp_path), "http://server/upload", exclude=["20240101_120100.mp4"])
+
+    assert transport.uploaded == [str(tmp_path / "20240101_120000.mp4")]
+    assert not (tmp_path / "20240101_120000.mp4").exists()
+    assert (tmp_path / "20240101_120100.mp4").read_bytes() == b"still recording"
@@ -0,0 +1,142 @@
+import os
+import time
+import shutil
+import contextlib
+
+# The capture, storage and network code reach the outside world only through
+# the backends below, looked up at call time (``backends.filesystem.remove(...)``),
+# so a simulation or test can swap them with use_backends().
+
+class SystemClock:
+    """
+    Wall and monotonic time from the operating system.
+    """
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+class LocalFileSystem:
+    """
+    The subset of os, os.path and shutil used by the storage and upload code.
+    """
+
+    def walk(self, top):
+        return os.walk(top)
+
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def isdir(self, path):
+        return os.path.isdir(path)
+
+    def getsize(self, path):
+        return os.path.getsize(path)
+
+    def getctime(self, path):
+        return os.path.getctime(path)
+
+    def makedirs(self, path, exist_ok=True):
+        os.makedirs(path, exist_ok=exist_ok)
+
+    def remove(self, path):
+        os.remove(path)
+
+    def replace(self, source, target):
+        os.replace(source, target)
+
+    def open(self, path, mode="r"):
+        return open(path, mode)
+
+    def disk_usage(self, path):
+        return shutil.disk_usage(path)
+
+class HttpTransport:
+    """
+    Network access over HTTP.
+    """
+
+    def reachable(self, url, timeout):
+        """
+        Returns:
+            bool: True if the URL answered within the timeout.
+        """
+        import requests
+
+        try:
+            requests.get(url, timeout=timeout)
+            return True
+        except (requests.ConnectionError, requests.Timeout):
+            return False
+
+    def upload(self, file_path, upload_url, metadata=None):
+        """
+        Upload one file in the upload_handler multipart format.
+
+        Returns:
+            bool: True if the server accepted it.
+        """
+        from upload_handler import post_file
+
+        return post_file(file_path, upload_url, metadata)
+
+class OpenCvCameraSource:
+    """
+    Opens cameras with OpenCV.
+    """
+
+    def open(self, device, resolution, fps, fourcc=None):
+        """
+        Open a capture device.
+
+        Returns:
+            cv2.VideoCapture: The capture, which may not have opened (check isOpened()).
+        """
+        import cv2
+
+        camera = cv2.VideoCapture(device)
+        if fourcc:
+            camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        camera.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
+        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
+        camera.set(cv2.CAP_PROP_FPS, fps)  # Set frame rate
+        camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Always hand out the newest frame
+        return camera
+
+    def close(self, camera):
+        import cv2
+
+        camera.release()
+        cv2.destroyAllWindows()
+
+clock = SystemClock()
+filesystem = LocalFileSystem()
+transport = HttpTransport()
+camera_source = OpenCvCameraSource()
+
+@contextlib.contextmanager
+def use_backends(**replacements):
+    """
+    Swap backends for the duration of a with block.
+
+    Args:
+        **replacements: Any of clock, filesystem, transport and camera_source.
+    """
+    names = ("clock", "filesystem", "transport", "camera_source")
+    unknown = set(replacements) - set(names)
+    if unknown:
+        raise TypeError(f"Unknown backends: {', '.join(sorted(unknown))}")
+    previous = {name: globals()[name] for name in replacements}
+    globals().update(replacements)
+    try:
+        yield
+    finally:
+        globals().update(previous)
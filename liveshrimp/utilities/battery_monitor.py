@@ -1,5 +1,9 @@
 import psutil
-import time
+import logging
+
+from task_scheduler import TaskScheduler
+
+logger = logging.getLogger(__name__)
 
 # Battery monitoring constants
 LOW_BATTERY_THRESHOLD = 20  # Threshold for low battery warning (percentage)
@@ -24,24 +28,19 @@ def get_battery_status():
 
 def display_battery_status():
     """
-    Display the current battery status on the console or log.
+    Log the current battery status.
     """
     battery_status = get_battery_status()
 
     if battery_status is None:
-        print("Battery information not available.")
+        logger.info("Battery information not available.")
         return
 
-    print(f"Battery Percentage: {battery_status['percentage']}%")
-    if battery_status['plugged']:
-        print("Power source: External (plugged in)")
-    else:
-        print("Power source: Battery")
-
-    if battery_status['time_left'] is not None:
-        print(f"Time left: {battery_status['time_left']} minutes")
-    else:
-        print("Battery time left: Unknown")
+    power_source = "External (plugged in)" if battery_status['plugged'] else "Battery"
+    time_left = battery_status['time_left']
+    logger.info("Battery Percentage: %s%%, power source: %s, time left: %s",
+                battery_status['percentage'], power_source,
+                f"{time_left:.0f} minutes" if time_left is not None else "Unknown")
 
 def is_battery_low():
     """
@@ -61,22 +60,33 @@ def alert_on_low_battery():
     Display an alert if the battery is below the low battery threshold.
     """
     if is_battery_low():
-        print("Warning: Battery is below the threshold! Consider charging or plugging in.")
+        logger.warning("Battery is below the threshold! Consider charging or plugging in.")
     else:
-        print("Battery level is sufficient.")
+        logger.debug("Battery level is sufficient.")
+
+def check_battery():
+    alert_on_low_battery()
+    display_battery_status()
 
-def monitor_battery(interval=60):
+def monitor_battery(interval=60, scheduler=None):
     """
     Periodically check battery status and take appropriate action.
 
     Args:
         interval (int): Interval in seconds between each check (default 60 seconds).
+        scheduler (TaskScheduler): Scheduler to add the check to. Without one,
+            the checks run in the calling thread, which does not return.
+
+    Returns:
+        Job: The scheduled job, when a scheduler is given.
     """
-    while True:
-        alert_on_low_battery()
-        display_battery_status()
-        time.sleep(interval)
+    if scheduler is not None:
+        return scheduler.every(interval, check_battery, name="battery", delay=0)
+    scheduler = TaskScheduler(workers=0)
+    scheduler.every(interval, check_battery, name="battery", delay=0)
+    scheduler.run()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     # Run battery monitor every 60 seconds
     monitor_battery(interval=60)
@@ -0,0 +1,22 @@
+import re
+import json
+
+# Matches either a JSON string (kept) or a // comment (dropped)
+_COMMENT_PATTERN = re.compile(r'("(?:\\.|[^"\\])*")|//[^\n]*')
+
+def load_config(config_path="config.json"):
+    """
+    Load the device configuration.
+
+    config.json carries // comments next to each setting, which plain JSON
+    does not allow, so they are stripped before parsing.
+
+    Args:
+        config_path (str): Path to the configuration file.
+
+    Returns:
+        dict: The parsed configuration.
+    """
+    with open(config_path, "r") as f:
+        text = f.read()
+    return json.loads(_COMMENT_PATTERN.sub(lambda m: m.group(1) or "", text))
@@ -0,0 +1,354 @@
+import os
+import json
+import mmap
+import time
+import bisect
+import struct
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# One fix per record: unix time, latitude and longitude in 1e-7 degrees (~1 cm)
+FIX_RECORD = struct.Struct("<dii")
+COORD_SCALE = 10_000_000
+GEOHASH_PRECISION = 6  # ~1.2 km x 0.6 km cells
+MAX_COVER_CELLS = 1024  # Larger queries scan the segment summaries instead of the cell index
+RECENT_FIX_SECONDS = 60  # A new segment inherits the last fix's position if it is at most this old
+
+FIXES_FILE = "fixes.bin"
+SEGMENTS_FILE = "segments.log"
+CELLS_FILE = "cells.log"
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    """
+    Encode a coordinate as a geohash.
+
+    Args:
+        lat (float): Latitude in degrees.
+        lon (float): Longitude in degrees.
+        precision (int): Number of characters.
+
+    Returns:
+        str: The geohash.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+def geohash_cover(min_lat, min_lon, max_lat, max_lon, precision=GEOHASH_PRECISION):
+    """
+    List the geohash cells that overlap a bounding box.
+
+    Args:
+        min_lat, min_lon, max_lat, max_lon (float): Bounding box in degrees.
+        precision (int): Geohash length.
+
+    Returns:
+        set: Geohashes covering the box, or None if more than MAX_COVER_CELLS are needed.
+    """
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    lat_step = 180.0 / (1 << lat_bits)
+    lon_step = 360.0 / (1 << lon_bits)
+    rows = int((max_lat - min_lat) / lat_step) + 2
+    cols = int((max_lon - min_lon) / lon_step) + 2
+    if rows * cols > MAX_COVER_CELLS:
+        return None
+
+    cells = set()
+    for row in range(rows):
+        lat = min(min_lat + row * lat_step, max_lat)
+        for col in range(cols):
+            lon = min(min_lon + col * lon_step, max_lon)
+            cells.add(geohash_encode(lat, lon, precision))
+    return cells
+
+def _bbox_intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+class GpsTrackStore:
+    """
+    Persistent GPS track linked to recorded segments.
+
+    Fixes are appended to a fixed-size binary log in time order, so time
+    ranges are found by binary search over a memory map. Every segment has
+    a summary (time span, record range and bounding box) and a geohash cell
+    index maps each cell to the segments recorded in it. Summaries and cells
+    are small append-only text logs loaded into memory on open.
+    """
+
+    def __init__(self, store_dir, precision=GEOHASH_PRECISION):
+        self.store_dir = store_dir
+        self.precision = precision
+        os.makedirs(store_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._fixes = open(os.path.join(store_dir, FIXES_FILE), "ab")
+        self._segments_log = open(os.path.join(store_dir, SEGMENTS_FILE), "a")
+        self._cells_log = open(os.path.join(store_dir, CELLS_FILE), "a")
+        self._count = self._fixes.tell() // FIX_RECORD.size
+        self._last = None  # (timestamp, lat, lon, cell) of the newest fix
+        self.segments = {}  # name -> summary dict
+        self._order = []  # Segment names sorted by start time
+        self._starts = []  # Start times matching self._order
+        self._cells = {}  # geohash -> set of segment names
+        self._active = set()
+        self._max_span = 0.0  # Longest finished segment, bounds the time-range search
+        self._load()
+
+    def _load(self):
+        with open(os.path.join(self.store_dir, SEGMENTS_FILE)) as f:
+            for line in f:
+                entry = json.loads(line)
+                summary = self.segments.setdefault(entry["name"], {})
+                summary.update(entry)
+        with open(os.path.join(self.store_dir, CELLS_FILE)) as f:
+            for line in f:
+                cell, name = line.rstrip("\n").split("\t", 1)
+                self._cells.setdefault(cell, set()).add(name)
+
+        if self._count:
+            with open(os.path.join(self.store_dir, FIXES_FILE), "rb") as f:
+                f.seek((self._count - 1) * FIX_RECORD.size)
+                timestamp, lat, lon = FIX_RECORD.unpack(f.read(FIX_RECORD.size))
+            lat, lon = lat / COORD_SCALE, lon / COORD_SCALE
+            self._last = (timestamp, lat, lon, geohash_encode(lat, lon, self.precision))
+
+        # Segments that were still recording when the process stopped end at the last fix;
+        # their bounding box and cells are rebuilt from the fixes recorded since they started.
+        # The end is written to the log at once, or the next reopen would extend the segment
+        # over every fix recorded in between
+        for name, summary in self.segments.items():
+            if "end" not in summary:
+                for timestamp, lat, lon in self._read_fixes(summary["first_record"], self._count):
+                    self._extend_bbox(summary, lat, lon)
+                    self._index_cell(geohash_encode(lat, lon, self.precision), name)
+                summary["end"] = max(summary["start"], self._last[0]) if self._last else summary["start"]
+                summary["end_record"] = self._count
+                self._write_segment_event({k: summary[k] for k in ("name", "end", "end_record", "bbox") if k in summary})
+                logger.warning("Segment %s was not closed; ended it at the last GPS fix.", name)
+        self._cells_log.flush()
+        for name in sorted(self.segments, key=lambda n: self.segments[n]["start"]):
+            self._order.append(name)
+            self._starts.append(self.segments[name]["start"])
+            self._max_span = max(self._max_span, self.segments[name]["end"] - self.segments[name]["start"])
+
+    def _read_fixes(self, first, last):
+        with open(os.path.join(self.store_dir, FIXES_FILE), "rb") as f:
+            f.seek(first * FIX_RECORD.size)
+            data = f.read((last - first) * FIX_RECORD.size)
+        return [(timestamp, lat / COORD_SCALE, lon / COORD_SCALE)
+                for timestamp, lat, lon in FIX_RECORD.iter_unpack(data)]
+
+    def _index_cell(self, cell, name):
+        names = self._cells.setdefault(cell, set())
+        if name not in names:
+            names.add(name)
+            self._cells_log.write(f"{cell}\t{name}\n")
+
+    def _write_segment_event(self, entry):
+        self._segments_log.write(json.dumps(entry) + "\n")
+        self._segments_log.flush()
+
+    def start_segment(self, name, start_time=None):
+        """
+        Mark a segment as recording; fixes appended from now on are linked to it.
+
+        Args:
+            name (str): Segment ID, e.g. "cam0/20240101_120000.mp4".
+            start_time (float): Unix time the segment started (defaults to now).
+        """
+        start_time = time.time() if start_time is None else start_time
+        with self._lock:
+            entry = {"name": name, "start": start_time, "first_record": self._count}
+            self.segments[name] = dict(entry)
+            self._write_segment_event(entry)
+            index = bisect.bisect_right(self._starts, start_time)
+            self._starts.insert(index, start_time)
+            self._order.insert(index, name)
+            self._active.add(name)
+            if self._last is not None and start_time - self._last[0] <= RECENT_FIX_SECONDS:
+                # The rig is still where the last fix put it
+                self._extend_bbox(self.segments[name], self._last[1], self._last[2])
+                self._index_cell(self._last[3], name)
+
+    def end_segment(self, name, end_time=None):
+        """
+        Close a segment and persist its summary.
+
+        Args:
+            name (str): Segment ID passed to start_segment().
+            end_time (float): Unix time the segment ended (defaults to now).
+        """
+        end_time = time.time() if end_time is None else end_time
+        with self._lock:
+            summary = self.segments.get(name)
+            if summary is None or name not in self._active:
+                return
+            self._active.discard(name)
+            summary["end"] = end_time
+            summary["end_record"] = self._count
+            self._max_span = max(self._max_span, end_time - summary["start"])
+            self._write_segment_event({k: summary[k] for k in ("name", "end", "end_record", "bbox") if k in summary})
+            self._cells_log.flush()
+
+    @staticmethod
+    def _extend_bbox(summary, lat, lon):
+        bbox = summary.get("bbox")
+        if bbox is None:
+            summary["bbox"] = [lat, lon, lat, lon]
+        else:
+            bbox[0], bbox[1] = min(bbox[0], lat), min(bbox[1], lon)
+            bbox[2], bbox[3] = max(bbox[2], lat), max(bbox[3], lon)
+
+    def append(self, lat, lon, timestamp=None):
+        """
+        Append a fix and link it to every segment currently recording.
+
+        Args:
+            lat (float): Latitude in degrees.
+            lon (float): Longitude in degrees.
+            timestamp (float): Unix time of the fix (defaults to now).
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            if self._last is not None:
+                timestamp = max(timestamp, self._last[0])  # Keep the log sorted for binary search
+            cell = geohash_encode(lat, lon, self.precision)
+            self._fixes.write(FIX_RECORD.pack(timestamp, round(lat * COORD_SCALE), round(lon * COORD_SCALE)))
+            self._count += 1
+            self._last = (timestamp, lat, lon, cell)
+            for name in self._active:
+                self._extend_bbox(self.segments[name], lat, lon)
+                self._index_cell(cell, name)
+
+    def append_fix(self, gps_data):
+        """
+        Append a fix as returned by gps_utils.get_gps_data(); missing fixes are ignored.
+        """
+        if gps_data and gps_data.get("latitude") is not None and gps_data.get("longitude") is not None:
+            self.append(gps_data["latitude"], gps_data["longitude"])
+
+    def flush(self):
+        with self._lock:
+            self._fixes.flush()
+            self._cells_log.flush()
+
+    def fixes_between(self, start, end):
+        """
+        Read all fixes recorded in a time range.
+
+        Args:
+            start (float): Unix start time (inclusive).
+            end (float): Unix end time (inclusive).
+
+        Returns:
+            list: (timestamp, latitude, longitude) tuples in time order.
+        """
+        self.flush()
+        if not self._count:
+            return []
+        with open(os.path.join(self.store_dir, FIXES_FILE), "rb") as f:
+            with mmap.mmap(f.fileno(), self._count * FIX_RECORD.size, access=mmap.ACCESS_READ) as data:
+                def timestamp_at(i):
+                    return FIX_RECORD.unpack_from(data, i * FIX_RECORD.size)[0]
+
+                lo, hi = 0, self._count
+                while lo < hi:  # First record at or after start
+                    mid = (lo + hi) // 2
+                    if timestamp_at(mid) < start:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                fixes = []
+                for i in range(lo, self._count):
+                    timestamp, lat, lon = FIX_RECORD.unpack_from(data, i * FIX_RECORD.size)
+                    if timestamp > end:
+                        break
+                    fixes.append((timestamp, lat / COORD_SCALE, lon / COORD_SCALE))
+                return fixes
+
+    def segments_between(self, start, end):
+        """
+        Find the segments that were recording at any time in a range.
+
+        Args:
+            start (float): Unix start time.
+            end (float): Unix end time.
+
+        Returns:
+            list: Segment IDs ordered by start time.
+        """
+        with self._lock:
+            # Only segments starting within one maximum segment length before the range can overlap it
+            first = bisect.bisect_left(self._starts, start - self._max_span)
+            last = bisect.bisect_right(self._starts, end)
+            found = [name for name in self._order[first:last] if self.segments[name].get("end", float("inf")) >= start]
+            found += [name for name in self._active
+                      if self.segments[name]["start"] < start - self._max_span]
+            return sorted(found, key=lambda n: self.segments[n]["start"])
+
+    def segments_in_bbox(self, min_lat, min_lon, max_lat, max_lon, start=None, end=None):
+        """
+        Find the segments recorded inside a bounding box, optionally within a time range.
+
+        Args:
+            min_lat, min_lon, max_lat, max_lon (float): Bounding box in degrees.
+            start (float): Optional Unix start time.
+            end (float): Optional Unix end time.
+
+        Returns:
+            list: Segment IDs ordered by start time.
+        """
+        query = (min_lat, min_lon, max_lat, max_lon)
+        cells = geohash_cover(min_lat, min_lon, max_lat, max_lon, self.precision)
+        with self._lock:
+            if cells is None:
+                candidates = set(self.segments)
+            else:
+                candidates = set()
+                for cell in cells:
+                    candidates |= self._cells.get(cell, set())
+            matches = [name for name in candidates
+                       if "bbox" in self.segments[name] and _bbox_intersects(self.segments[name]["bbox"], query)]
+        if start is not None or end is not None:
+            in_time = set(self.segments_between(start if start is not None else float("-inf"),
+                                                end if end is not None else float("inf")))
+            matches = [name for name in matches if name in in_time]
+        return sorted(matches, key=lambda n: self.segments[n]["start"])
+
+    def segment_summary(self, name):
+        """
+        Returns:
+            dict: Start/end time and bounding box of a segment, or None if unknown.
+        """
+        with self._lock:
+            summary = self.segments.get(name)
+            return dict(summary) if summary else None
+
+    def close(self):
+        with self._lock:
+            self._fixes.close()
+            self._segments_log.close()
+            self._cells_log.close()
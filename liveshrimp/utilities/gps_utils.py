@@ -1,5 +1,9 @@
 import gpsd
-import time
+import logging
+
+from task_scheduler import TaskScheduler
+
+logger = logging.getLogger(__name__)
 
 # Connect to the GPSD service
 def connect_to_gpsd():
@@ -8,9 +12,9 @@ def connect_to_gpsd():
     """
     try:
         gpsd.connect()
-        print("Connected to GPSD.")
+        logger.info("Connected to GPSD.")
     except Exception as e:
-        print(f"Failed to connect to GPSD: {e}")
+        logger.error("Failed to connect to GPSD: %s", e)
 
 # Retrieve the current GPS data
 def get_gps_data():
@@ -34,7 +38,7 @@ def get_gps_data():
         }
         return gps_info
     except Exception as e:
-        print(f"Error retrieving GPS data: {e}")
+        logger.warning("Error retrieving GPS data: %s", e)
         return None
 
 # Format GPS data for display
@@ -89,7 +93,6 @@ if __name__ == "__main__":
     # Example: Connect to GPS and get GPS data every 5 seconds
     connect_to_gpsd()
 
-    while True:
-        gps_data = get_and_format_gps_data()
-        print(gps_data)
-        time.sleep(5)  # Sleep for 5 seconds before checking again
+    scheduler = TaskScheduler(workers=0)
+    scheduler.every(5, lambda: print(get_and_format_gps_data()), name="gps", delay=0)
+    scheduler.run()
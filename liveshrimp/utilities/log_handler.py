@@ -0,0 +1,215 @@
+import os
+import sys
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+# Logging defaults (overridable from the "logging" section of config.json)
+DEFAULT_LOG_FILE = "video_capture.log"
+MAX_BYTES = 5 * 1024 * 1024  # Rotate the log file at 5 MB
+BACKUP_COUNT = 3
+BATCH_SIZE = 100  # Records buffered before a single write to the SD card
+FLUSH_INTERVAL = 5.0  # Seconds a record may sit in the buffer
+RATE_LIMIT_WINDOW = 10.0  # Seconds over which repeated messages are collapsed
+RATE_LIMIT_BURST = 20  # Distinct messages allowed per call site and window
+QUEUE_SIZE = 10000
+
+class RateLimitFilter(logging.Filter):
+    """
+    Collapse repeated log messages.
+
+    Identical messages are dropped for the rest of the window, and each call
+    site (message template) may emit at most ``burst`` distinct messages per
+    window. The next message let through after a window reports how many
+    were suppressed.
+    """
+
+    def __init__(self, window=RATE_LIMIT_WINDOW, burst=RATE_LIMIT_BURST, clock=time.monotonic):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.clock = clock
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        now = self.clock()
+        message = record.getMessage()
+        key = (record.name, record.levelno, str(record.msg))
+
+        with self._lock:
+            state = self._windows.get(key)
+            suppressed = 0
+            if state is None or now - state["start"] >= self.window:
+                suppressed = state["suppressed"] if state else 0
+                state = {"start": now, "messages": set(), "suppressed": 0}
+                self._windows[key] = state
+
+            if message in state["messages"] or len(state["messages"]) >= self.burst:
+                state["suppressed"] += 1
+                return False
+            state["messages"].add(message)
+
+        if suppressed:
+            record.msg = f"{message} (suppressed {suppressed} similar messages in the last {self.window:.0f}s)"
+            record.args = None
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that drops records instead of blocking when the queue is full.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class BatchingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Size-rotated file handler that batches records into few large writes.
+
+    Records are flushed when the batch is full, when the oldest buffered
+    record exceeds the flush interval, or immediately for errors.
+    """
+
+    def __init__(self, filename, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT,
+                 batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._buffer_started = None
+        self.pending = threading.Event()  # Set while records wait in the buffer
+
+    def emit(self, record):
+        try:
+            self._buffer.append(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+            return
+        if self._buffer_started is None:
+            self._buffer_started = time.monotonic()
+            self.pending.set()
+        if (len(self._buffer) >= self.batch_size or record.levelno >= logging.ERROR
+                or time.monotonic() - self._buffer_started >= self.flush_interval):
+            self._write_buffer()
+
+    def _write_buffer(self):
+        if not self._buffer:
+            return
+        data = "".join(self._buffer)
+        self._buffer = []
+        self._buffer_started = None
+        self.pending.clear()
+        if self.stream is None:
+            self.stream = self._open()
+        if self.maxBytes > 0 and self.stream.tell() + len(data) >= self.maxBytes:
+            self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+        self.stream.write(data)
+        self.stream.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            self._write_buffer()
+        finally:
+            self.release()
+
+    def flush_if_stale(self):
+        """
+        Write the buffer out if its oldest record is older than the flush interval.
+        """
+        self.acquire()
+        try:
+            if self._buffer_started is not None and time.monotonic() - self._buffer_started >= self.flush_interval:
+                self._write_buffer()
+        finally:
+            self.release()
+
+def _flush_periodically(handler, stop_event):
+    """
+    Flush buffered records that would otherwise wait for the next log call.
+
+    Sleeps until a record is buffered, so an idle logger causes no wakeups.
+    """
+    while True:
+        handler.pending.wait()
+        if stop_event.wait(handler.flush_interval):
+            return
+        handler.flush_if_stale()
+
+def setup_logging(log_config=None):
+    """
+    Route all logging through a background queue to a batched, rotating log file.
+
+    Callers only format the message and push it on a queue; file writes happen
+    on a listener thread. Warnings and errors are also echoed to stderr.
+
+    Args:
+        log_config (dict): The "logging" section of config.json.
+
+    Returns:
+        logging.handlers.QueueListener: The running listener, or None if logging is disabled.
+    """
+    log_config = log_config or {}
+    root = logging.getLogger()
+    if not log_config.get("enabled", True):
+        root.setLevel(logging.CRITICAL + 1)
+        return None
+
+    log_file = log_config.get("log_file", DEFAULT_LOG_FILE)
+    log_dir = os.path.dirname(log_file)
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    file_handler = BatchingRotatingFileHandler(
+        log_file,
+        max_bytes=log_config.get("max_bytes", MAX_BYTES),
+        backup_count=log_config.get("backup_count", BACKUP_COUNT),
+        batch_size=log_config.get("batch_size", BATCH_SIZE),
+        flush_interval=log_config.get("flush_interval_seconds", FLUSH_INTERVAL),
+    )
+    file_handler.setFormatter(formatter)
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setLevel(logging.WARNING)
+    console_handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(
+        window=log_config.get("rate_limit_seconds", RATE_LIMIT_WINDOW),
+        burst=log_config.get("rate_limit_burst", RATE_LIMIT_BURST),
+    ))
+
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(log_config.get("level", "INFO"))
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+
+    stop_event = threading.Event()
+    threading.Thread(target=_flush_periodically, args=(file_handler, stop_event), daemon=True).start()
+
+    def shutdown():
+        stop_event.set()
+        file_handler.pending.set()
+        listener.stop()
+        file_handler.flush()
+        file_handler.close()
+
+    atexit.register(shutdown)
+    return listener
@@ -0,0 +1,158 @@
+import time
+import signal
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+CHECK_INTERVAL = 30.0  # Longest time between health checks; checks are otherwise due when a heartbeat can go stale
+MIN_CHECK_INTERVAL = 0.1  # Shortest time between health checks
+MIN_BACKOFF = 2.0  # Wait after a restart before a worker may be restarted again
+MAX_BACKOFF = 60.0  # Upper bound for the doubling restart backoff
+
+class Watch:
+    """
+    A supervised worker: how to tell it is alive and how to restart it.
+    """
+
+    def __init__(self, name, heartbeat, restart, stall_seconds):
+        """
+        Args:
+            name (str): Worker name for logs and status.
+            heartbeat (callable): Returns the monotonic time the worker last
+                showed progress, or None if it has died.
+            restart (callable): Restarts the worker; may raise to signal failure.
+            stall_seconds (float): Heartbeat age at which the worker counts as stalled.
+        """
+        self.name = name
+        self.heartbeat = heartbeat
+        self.restart = restart
+        self.stall_seconds = stall_seconds
+        self.restarts = 0
+        self.failures = 0
+        self.backoff = MIN_BACKOFF
+        self.next_restart = 0.0
+
+class Supervisor:
+    """
+    Monitors workers by their heartbeats and restarts those that die or stall.
+
+    A worker whose restart fails (e.g. a camera that is unplugged) is retried
+    with a doubling backoff; the backoff resets once it is healthy again.
+    Rather than polling, the supervisor sleeps until the earliest moment a
+    heartbeat could go stale or a backed-off restart becomes due; a worker
+    that dies is noticed by then at the latest.
+    """
+
+    def __init__(self, check_interval=CHECK_INTERVAL, clock=time.monotonic):
+        self.check_interval = check_interval
+        self.clock = clock
+        self.watches = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def watch(self, name, heartbeat, restart, stall_seconds):
+        """
+        Supervise a worker. See Watch for the arguments.
+        """
+        self.watches.append(Watch(name, heartbeat, restart, stall_seconds))
+        self._wakeup.set()  # Recompute the next check with the new worker
+
+    def check(self):
+        """
+        Check every worker once, restarting any that died or stalled.
+
+        Returns:
+            list: Names of the workers restarted.
+        """
+        now = self.clock()
+        restarted = []
+        for watch in self.watches:
+            beat = watch.heartbeat()
+            if beat is not None and now - beat < watch.stall_seconds:
+                watch.backoff = MIN_BACKOFF
+                continue
+            if now < watch.next_restart:
+                continue
+            if beat is None:
+                logger.error("Worker %s is not running; restarting.", watch.name)
+            else:
+                logger.error("Worker %s stalled for %.1fs; restarting.", watch.name, now - beat)
+            watch.next_restart = now + watch.backoff
+            watch.backoff = min(watch.backoff * 2, MAX_BACKOFF)
+            try:
+                watch.restart()
+                watch.restarts += 1
+                restarted.append(watch.name)
+            except Exception as e:
+                watch.failures += 1
+                logger.error("Restarting %s failed (retry in %.0fs): %s", watch.name, watch.next_restart - now, e)
+        return restarted
+
+    def next_delay(self):
+        """
+        Returns:
+            float: Seconds until the next check is due: when the freshest
+                possible heartbeat of a worker would count as stalled, or when a
+                backed-off restart may be retried.
+        """
+        now = self.clock()
+        delay = self.check_interval
+        for watch in self.watches:
+            beat = watch.heartbeat()
+            if beat is not None and now - beat < watch.stall_seconds:
+                delay = min(delay, beat + watch.stall_seconds - now)
+            else:
+                delay = min(delay, watch.next_restart - now)
+        return max(delay, MIN_CHECK_INTERVAL)
+
+    def status(self):
+        """
+        Returns:
+            dict: Per worker, the heartbeat age in seconds (None if dead) and the restart count.
+        """
+        now = self.clock()
+        result = {}
+        for watch in self.watches:
+            beat = watch.heartbeat()
+            result[watch.name] = {"age": None if beat is None else round(now - beat, 1),
+                                  "restarts": watch.restarts, "failures": watch.failures}
+        return result
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+                delay = self.next_delay()
+            except Exception:
+                logger.exception("Supervisor check failed")
+                delay = self.check_interval
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="supervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+
+def install_shutdown_handlers(shutdown_event):
+    """
+    Turn SIGTERM (systemd stop, power-button scripts) and SIGINT into a shutdown request.
+
+    Must be called from the main thread.
+
+    Args:
+        shutdown_event (threading.Event): Set when a shutdown signal arrives.
+    """
+    def request_shutdown(signum, frame):
+        logger.info("Received %s; shutting down.", signal.Signals(signum).name)
+        shutdown_event.set()
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
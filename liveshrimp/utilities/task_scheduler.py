@@ -0,0 +1,252 @@
+import time
+import heapq
+import random
+import logging
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+WORKER_THREADS = 2  # Jobs that may run at once, so one slow job does not hold up the others
+
+class Job:
+    """
+    A periodic job and its runtime metrics.
+    """
+
+    def __init__(self, name, interval, func, args, kwargs, jitter):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.jitter = jitter
+        self.base = 0.0  # Unjittered time of the next run, so jitter does not accumulate as drift
+        self.next_run = 0.0
+        self.running_since = None
+        self.cancelled = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.abandoned = 0
+        self.last_duration = None
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+
+    def metrics(self, now):
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "abandoned": self.abandoned,
+            "last_duration": None if self.last_duration is None else round(self.last_duration, 3),
+            "max_duration": round(self.max_duration, 3),
+            "mean_duration": round(self.total_duration / self.runs, 3) if self.runs else None,
+            "running_for": None if self.running_since is None else round(now - self.running_since, 1),
+            "next_in": round(max(0.0, self.next_run - now), 1),
+        }
+
+class TaskScheduler:
+    """
+    Runs every periodic job from one timer thread instead of a polling loop per job.
+
+    Jobs wait in a heap ordered by their next run time; the timer thread
+    sleeps until the earliest one is due, so an idle device wakes only when
+    there is work. Due jobs are handed to a small worker pool. A job that is
+    still running when it comes due again is skipped rather than started a
+    second time, and every job keeps run, failure and duration metrics.
+    """
+
+    def __init__(self, workers=WORKER_THREADS, clock=time.monotonic, rng=random.uniform):
+        """
+        Args:
+            workers (int): Worker threads; 0 runs jobs on the timer thread itself.
+            clock (callable): Monotonic time source.
+            rng (callable): Returns a random float between its two arguments (for jitter).
+        """
+        self.workers = workers
+        self.clock = clock
+        self.rng = rng
+        self.jobs = {}
+        self._heap = []
+        self._sequence = itertools.count()  # Breaks ties between jobs due at the same time
+        self._condition = threading.Condition()
+        self._stop = False
+        self._thread = None
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="job") if workers else None
+
+    def every(self, interval, func, *args, name=None, jitter=0.0, delay=None, **kwargs):
+        """
+        Run func(*args, **kwargs) every interval seconds.
+
+        Args:
+            interval (float): Seconds between runs.
+            func (callable): The job.
+            name (str): Job name for metrics and logs; defaults to the function name.
+            jitter (float): Each run is delayed by a random 0 to jitter seconds,
+                so a fleet of devices does not hit the server in step.
+            delay (float): Seconds until the first run; defaults to one interval.
+
+        Returns:
+            Job: The scheduled job.
+        """
+        job = Job(name or func.__name__, interval, func, args, kwargs, jitter)
+        with self._condition:
+            if job.name in self.jobs:
+                self.jobs[job.name].cancelled = True
+            self.jobs[job.name] = job
+            job.base = self.clock() + (interval if delay is None else delay)
+            self._push(job)
+            self._condition.notify()
+        return job
+
+    def cancel(self, name):
+        with self._condition:
+            job = self.jobs.pop(name, None)
+            if job:
+                job.cancelled = True
+
+    def _push(self, job):
+        job.next_run = job.base + (self.rng(0.0, job.jitter) if job.jitter else 0.0)
+        heapq.heappush(self._heap, (job.next_run, next(self._sequence), job))
+
+    def run_pending(self):
+        """
+        Start every job that is due.
+
+        Returns:
+            float: Seconds until the next job is due, or None if there are no jobs.
+        """
+        due = []
+        with self._condition:
+            now = self.clock()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, job = heapq.heappop(self._heap)
+                if job.cancelled:
+                    continue
+                if job.running_since is not None:
+                    job.skipped += 1
+                    logger.warning("Job %s is still running after %.0fs; skipping this run.",
+                                   job.name, now - job.running_since)
+                else:
+                    job.running_since = now
+                    due.append(job)
+                job.base += job.interval
+                if job.base <= now:
+                    job.base = now + job.interval  # Fell behind (e.g. suspend); do not run a burst to catch up
+                self._push(job)
+            executor = self._executor
+        for job in due:
+            if executor:
+                executor.submit(self._run_job, job)
+            else:
+                self._run_job(job)
+        return self.next_delay()
+
+    def next_delay(self):
+        with self._condition:
+            while self._heap and self._heap[0][2].cancelled:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - self.clock())
+
+    def _run_job(self, job):
+        with self._condition:
+            if job.running_since is None:
+                return  # Abandoned by revive() while it waited for a worker
+            # Timed from here, not from when it was due, so waiting for a worker is not counted as runtime
+            started = job.running_since = self.clock()
+        failed = False
+        try:
+            job.func(*job.args, **job.kwargs)
+        except Exception:
+            failed = True
+            logger.exception("Scheduled job %s failed", job.name)
+        with self._condition:
+            if job.running_since != started:
+                return  # Abandoned by revive(); its metrics were settled then
+            duration = self.clock() - started
+            job.running_since = None
+            job.runs += 1
+            job.failures += failed
+            job.last_duration = duration
+            job.max_duration = max(job.max_duration, duration)
+            job.total_duration += duration
+
+    def run(self):
+        """
+        Run jobs in the calling thread until stop() is called.
+        """
+        while True:
+            delay = self.run_pending()
+            with self._condition:
+                if self._stop:
+                    return
+                # Woken early by every() (a new job may be due sooner) or stop()
+                self._condition.wait(delay)
+                if self._stop:
+                    return
+
+    def start(self):
+        with self._condition:
+            self._stop = False
+        self._thread = threading.Thread(target=self.run, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        if self._executor:
+            self._executor.shutdown(wait=timeout is None or timeout > 0, cancel_futures=True)
+
+    def heartbeat(self):
+        """
+        Report liveness for the Supervisor.
+
+        Returns:
+            float: The current time, or the start of the longest-running job,
+                so a job stuck for longer than the stall time counts as a stall;
+                None if the timer thread has died.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return None
+        with self._condition:
+            running = [job.running_since for job in self.jobs.values() if job.running_since is not None]
+        return min(running, default=self.clock())
+
+    def revive(self, max_age):
+        """
+        Restart a dead timer thread and give up on jobs running longer than max_age.
+
+        A stuck job's thread cannot be killed; the worker pool is replaced so
+        the other jobs keep running, and the stuck job may be started again
+        on its next run.
+        """
+        with self._condition:
+            now = self.clock()
+            stuck = [job for job in self.jobs.values()
+                     if job.running_since is not None and now - job.running_since >= max_age]
+            for job in stuck:
+                logger.error("Job %s has run for %.0fs; abandoning it.", job.name, now - job.running_since)
+                job.running_since = None
+                job.abandoned += 1
+            if stuck and self._executor:
+                self._executor.shutdown(wait=False)
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="job")
+        if self._thread is not None and not self._thread.is_alive():
+            self.start()
+
+    def status(self):
+        """
+        Returns:
+            dict: Per job, its run counts and durations.
+        """
+        with self._condition:
+            now = self.clock()
+            return {name: job.metrics(now) for name, job in self.jobs.items()}
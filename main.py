@@ -1,119 +1,402 @@
-import cv2
 import time
-import json
+
+BOOT_STARTED = time.monotonic()  # Taken before the heavy imports so boot-to-first-frame includes them
+
 import os
-import schedule
+import logging
 import threading
-from camera_handler import start_camera, stop_camera
-from gps_utils import get_gps_data
-from battery_monitor import check_battery
-from storage_handler import save_video_segment, manage_storage
-from network_handler import check_network_connection, upload_video
-from compress_video import compress_video
-from overlay import overlay_gps_data, overlay_battery_status
+import functools
+from camera_manager import CameraManager, camera_configs
+from config_loader import load_config
+from log_handler import setup_logging
+from overlay import add_overlay
+from gps_track_store import GpsTrackStore
+from io_scheduler import configure_io
+from supervisor import Supervisor, install_shutdown_handlers
+from task_scheduler import TaskScheduler
+
+# Only what the capture path needs is imported above. GPS, battery, network,
+# upload, compression and preview modules pull in gpsd, psutil and requests,
+# so they are imported where they are used, after the cameras run.
 
 # Load configuration from config.json
-with open('config.json', 'r') as f:
-    config = json.load(f)
+config = load_config('config.json')
+
+logger = logging.getLogger(__name__)
 
 # Initialize global variables
-camera = None
-video_writer = None
-video_segment_count = 0
+camera_manager = None
+track_store = None
 is_recording = False
-gps_data = ""
-battery_status = ""
-video_storage_path = "/home/pi/videos/"
-
-# Initialize camera
-def initialize_camera():
-    global camera
-    camera = start_camera()
+gps_data = None
+gps_checked = 0.0
+battery_status = None
+analytics = None
+rate_controller = None
+supervisor = None
+scheduler = TaskScheduler()
+shutdown_requested = threading.Event()
+gps_connected = threading.Event()
+first_frame_at = None
+video_storage_path = config.get("video_storage", {}).get("path", "/home/pi/videos/")
+GPS_REFRESH_SECONDS = 1.0  # Shared GPS fix reused by every camera's overlay
+CAPTURE_STALL_SECONDS = 5  # A camera without a frame for this long is reopened
+COMPRESSION_STALL_SECONDS = 30 * 60  # Longest a single compression job may run
+UPLOAD_STALL_SECONDS = 15 * 60  # Longest a single upload may run
+TASK_STALL_SECONDS = 15 * 60  # Longest a scheduled task may run
+SHUTDOWN_JOB_SECONDS = 20  # Time given to running compression/upload jobs on shutdown
 
 # Check battery status and network connection
 def check_device_status():
+    from battery_monitor import get_battery_status
+    from network_handler import check_connectivity
+    from rate_control import upload_meter
+
     global battery_status
-    battery_status = check_battery()  # Returns battery percentage or status (e.g., charging/discharging)
+    battery_status = get_battery_status()  # Returns battery percentage and whether plugged in
 
     # If network is available, upload the videos
-    if check_network_connection():
-        print("Network connected, uploading video...")
-        upload_video(video_storage_path)
+    connected = check_connectivity()
+    upload_meter.record_connectivity(connected)  # How often the uplink is there feeds the encoder's budget
+    if connected:
+        logger.info("Network connected, uploading video...")
+        for pipeline in camera_manager.pipelines:
+            camera_manager.submit_upload(pipeline.name, upload_camera_backlog, pipeline.output_dir)
     else:
-        print("No network connection. Saving videos locally.")
+        logger.info("No network connection. Saving videos locally.")
+
+def current_gps():
+    """
+    Get the latest GPS fix, polling gpsd at most once per GPS_REFRESH_SECONDS.
+
+    Returns None until gpsd has been connected by the background boot stage.
+    """
+    global gps_data, gps_checked
+    if not gps_connected.is_set():
+        return None
+    from gps_utils import get_gps_data
+
+    now = time.monotonic()
+    if now - gps_checked >= GPS_REFRESH_SECONDS:
+        gps_checked = now
+        gps_data = get_gps_data()
+        if track_store:
+            track_store.append_fix(gps_data)
+    return gps_data
+
+def segment_id(camera_name, segment_path):
+    return f"{camera_name}/{os.path.basename(segment_path)}"
+
+def system_uptime():
+    """
+    Get the seconds since the system booted, or None where /proc/uptime is unavailable.
+    """
+    try:
+        with open("/proc/uptime") as f:
+            return float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+def segment_opened(camera_name, segment_path):
+    global first_frame_at
+    track_store.start_segment(segment_id(camera_name, segment_path))
+    if analytics:
+        analytics.segment_opened(camera_name, segment_path)
+    if first_frame_at is None:
+        # A segment opens right before its first frame is written
+        first_frame_at = time.monotonic()
+        uptime = system_uptime()
+        logger.info("First frame from camera %s %.2fs after start%s.", camera_name, first_frame_at - BOOT_STARTED,
+                    f" ({uptime:.1f}s after power-on)" if uptime is not None else "")
+
+def segment_finished(camera_name, segment_path):
+    track_store.end_segment(segment_id(camera_name, segment_path))
+    if analytics:
+        analytics.segment_finished(camera_name, segment_path)
+
+def store_activity(camera_name, segment_path, summary):
+    """
+    Store a segment's activity scores next to it and summarise them in its camera's storage index.
+    """
+    from storage_handler import store_activity as store_segment_activity
+
+    if summary["activity"]:
+        store_segment_activity(os.path.basename(segment_path), os.path.dirname(segment_path), summary)
+
+def overlay_frame(camera_name, frame):
+    """
+    Draw GPS and battery overlays on a captured frame.
+    """
+    gps = current_gps()
+    if gps:
+        return add_overlay(frame, (gps["latitude"], gps["longitude"]), gps["speed"], gps["elevation"], battery_status)
+    return add_overlay(frame, battery=battery_status)
+
+def upload_dir(camera_dir):
+    """
+    Get the directory uploads are sent from: compressed copies if compression is enabled.
+    """
+    if config.get("video_storage", {}).get("compression_enabled"):
+        return os.path.join(camera_dir, "compressed")
+    return camera_dir
+
+def device_telemetry():
+    """
+    Collect the device status sent along with upload bundles.
+    """
+    from storage_handler import get_storage_stats
+
+    return {
+        "time": time.time(),
+        "battery": battery_status,
+        "storage": get_storage_stats(video_storage_path),
+        "capture_fps": {pipeline.name: round(pipeline.effective_fps, 2) for pipeline in camera_manager.pipelines},
+        "workers": supervisor.status() if supervisor else None,
+        "jobs": scheduler.status(),
+    }
+
+def upload_camera_backlog(camera_dir):
+    """
+    Upload everything waiting for a camera, previews first.
+    """
+    from upload_handler import upload_pending_files, generate_metadata, get_device_id
+    from storage_handler import load_index
+
+    folder = upload_dir(camera_dir)
+    if os.path.isdir(folder):
+        index = load_index(camera_dir)
+        activity = {name: entry["activity_mean"] for name, entry in index.items() if "activity_mean" in entry}
+        device_id = get_device_id(config["network"].get("device_id"))
+        metadata_callback = functools.partial(generate_metadata, track_store=track_store,
+                                              camera_name=os.path.basename(camera_dir), index=index,
+                                              device_id=device_id)
+        # Without compression the camera records into the upload folder; its open segment is not done yet
+        recording = [os.path.basename(pipeline.current_segment) for pipeline in camera_manager.pipelines
+                     if pipeline.current_segment
+                     and os.path.normpath(os.path.dirname(pipeline.current_segment)) == os.path.normpath(folder)]
+        bundle_url = config["network"].get("bundle_url")
+        upload_pending_files(folder, config["network"]["upload_url"], metadata_callback, activity,
+                             bundle_url=bundle_url, telemetry=device_telemetry() if bundle_url else None,
+                             device_id=device_id, exclude=recording)
+
+def handle_closed_segment(camera_name, segment_path):
+    """
+    Compress a finished segment on the shared compression pool, then queue its upload.
+    """
+    camera_dir = os.path.dirname(segment_path)
+    storage_config = config.get("video_storage", {})
+    if storage_config.get("compression_enabled"):
+        from compress_video import compress_video
+
+        compressed_dir = upload_dir(camera_dir)
+        os.makedirs(compressed_dir, exist_ok=True)
+        output_file = os.path.join(compressed_dir, f"compressed_{os.path.basename(segment_path)}")
+        if storage_config.get("rate_control", True):
+            from storage_handler import update_index
+
+            pipeline = next((p for p in camera_manager.pipelines if p.name == camera_name), None)
+            plan = encoding_controller().plan(segment_path, pipeline.resolution if pipeline else None)
+            compress_video(segment_path, output_file, plan["resolution"], crf=plan["crf"], maxrate=plan["maxrate"])
+            update_index(os.path.basename(segment_path), camera_dir, encoding=plan)
+        else:
+            compress_video(segment_path, output_file)
+    camera_manager.submit_upload(camera_name, upload_camera_backlog, camera_dir)
+
+def encoding_controller():
+    """
+    Get the rate controller that sizes compressed segments to the storage and upload budget.
+    """
+    from rate_control import RateController, DEFAULT_QUALITY, MAX_CRF, STORAGE_HORIZON_HOURS
+
+    global rate_controller
+    if rate_controller is None:
+        storage_config = config.get("video_storage", {})
+        rate_controller = RateController(
+            video_storage_path,
+            storage_config.get("max_storage_limit", 10000000000),
+            streams=len(camera_manager.pipelines),
+            quality=storage_config.get("compression_quality", DEFAULT_QUALITY),
+            max_crf=storage_config.get("max_crf", MAX_CRF),
+            horizon_hours=storage_config.get("storage_horizon_hours", STORAGE_HORIZON_HOURS),
+            segment_seconds=camera_manager.pipelines[0].segment_seconds,
+        )
+    return rate_controller
 
 # Capture video
 def capture_video():
-    global video_writer, video_segment_count, is_recording
-    print("Starting video capture...")
-
-    # Set up video file
-    video_segment_count += 1
-    output_file = f"{video_storage_path}/video_segment_{video_segment_count}.mp4"
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # Use 'mp4v' codec for .mp4 files
-    video_writer = cv2.VideoWriter(output_file, fourcc, 30.0, (1920, 1080))
-
-    # Capture frames from the camera
-    while is_recording:
-        ret, frame = camera.read()
-        if not ret:
-            break
-
-        # Get GPS data and overlay it on the video
-        gps_data = get_gps_data()
-        frame_with_overlay = overlay_gps_data(frame, gps_data)
+    """
+    Open every camera and start recording. This is the only boot stage on the path to the first frame.
+    """
+    global camera_manager, track_store
+    logger.info("Starting video capture...")
+    track_store = GpsTrackStore(os.path.join(video_storage_path, "gps_track"))
+    # Without a "cameras" list only the default device is opened here; discovery runs in start_services()
+    camera_manager = CameraManager(
+        camera_configs(config, discover=False),
+        video_storage_path,
+        frame_callback=overlay_frame,
+        on_segment_closed=handle_closed_segment,
+        on_segment_opened=segment_opened,
+        on_segment_finished=segment_finished,
+    )
+    if not camera_manager.start():
+        if config.get("cameras"):
+            raise RuntimeError("No camera could be started.")
+        # The default device is not a camera on this rig; look for one now rather than record nothing
+        camera_manager.pipelines.clear()
+        if not add_discovered_cameras():
+            raise RuntimeError("No camera could be started.")
+    logger.info("Cameras started %.2fs after start.", time.monotonic() - BOOT_STARTED)
+
+def add_discovered_cameras():
+    """
+    Start recording from every discovered camera that is not recording yet.
+
+    Only used without a "cameras" list in the configuration.
+
+    Returns:
+        list: The pipelines added.
+    """
+    running = {pipeline.device for pipeline in camera_manager.pipelines}
+    names = {pipeline.name for pipeline in camera_manager.pipelines}
+    added = []
+    for settings in camera_configs(config):
+        if settings["device"] in running:
+            continue
+        number = len(names)
+        while settings["name"] in names:
+            settings["name"] = f"cam{number}"
+            number += 1
+        try:
+            pipeline = camera_manager.add_camera(settings)
+        except RuntimeError as e:
+            logger.error("Camera %s not started: %s", settings["name"], e)
+            continue
+        names.add(pipeline.name)
+        added.append(pipeline)
+        logger.info("Added discovered camera %s (device %s).", pipeline.name, pipeline.device)
+        if supervisor:
+            watch_pipeline(pipeline)
+    return added
 
-        # Add battery status overlay
-        frame_with_overlay = overlay_battery_status(frame_with_overlay, battery_status)
+def start_services():
+    """
+    Second boot stage, run in the background once recording: camera discovery, GPS, battery, analytics,
+    preview and scheduled tasks.
+    """
+    from gps_utils import connect_to_gpsd
 
-        # Write the frame with overlays to video file
-        video_writer.write(frame_with_overlay)
+    global battery_status, analytics
+    if not config.get("cameras"):
+        add_discovered_cameras()  # Before analytics and preview attach to the pipelines
 
-        # Check device status periodically
-        check_device_status()
+    connect_to_gpsd()
+    gps_connected.set()
 
-    # Release resources
-    video_writer.release()
+    from battery_monitor import get_battery_status
+    battery_status = get_battery_status()
+
+    analytics_config = config.get("analytics", {})
+    if analytics_config.get("enabled"):
+        from activity_analytics import AnalyticsStage
+
+        stage = AnalyticsStage(store_activity, analytics_config.get("analyzer", "activity_analytics.MotionAnalyzer"),
+                               fps=analytics_config.get("fps", 2), width=analytics_config.get("width", 160))
+        stage.start()
+        analytics = stage
+        for pipeline in camera_manager.pipelines:
+            stage.attach(pipeline)
+
+    preview_config = config.get("preview", {})
+    if preview_config.get("enabled"):
+        from preview_server import PreviewHub, start_preview_server
+
+        hub = PreviewHub(preview_config.get("width", 640), preview_config.get("fps", 5))
+        for pipeline in camera_manager.pipelines:
+            pipeline.add_frame_listener(hub.publish)
+        start_preview_server(hub, camera_manager.pipelines, port=preview_config.get("port", 8080))
+
+    schedule_tasks()
+    supervisor.watch("scheduler", scheduler.heartbeat, functools.partial(scheduler.revive, TASK_STALL_SECONDS),
+                     TASK_STALL_SECONDS)
+    logger.info("Background services started %.2fs after start.", time.monotonic() - BOOT_STARTED)
+
+def start_supervisor():
+    """
+    Watch every capture pipeline and the shared job pools, restarting any that stall.
+    """
+    global supervisor
+    supervisor = Supervisor()
+    for pipeline in camera_manager.pipelines:
+        watch_pipeline(pipeline)
+    supervisor.watch("compression", camera_manager.compression_queue.heartbeat,
+                     functools.partial(camera_manager.compression_queue.revive, COMPRESSION_STALL_SECONDS),
+                     COMPRESSION_STALL_SECONDS)
+    supervisor.watch("upload", camera_manager.upload_queue.heartbeat,
+                     functools.partial(camera_manager.upload_queue.revive, UPLOAD_STALL_SECONDS),
+                     UPLOAD_STALL_SECONDS)
+    supervisor.start()
+
+def watch_pipeline(pipeline):
+    supervisor.watch(f"capture-{pipeline.name}", pipeline.heartbeat, pipeline.restart, CAPTURE_STALL_SECONDS)
 
 # Stop video capture
 def stop_video_capture():
+    """
+    Flush and close every active segment, then give background jobs a short time to finish.
+    """
     global is_recording
     is_recording = False
-    print("Stopping video capture...")
+    logger.info("Stopping video capture...")
+    if supervisor:
+        supervisor.stop()  # Nothing may be restarted while it is being stopped
+    scheduler.stop(timeout=0)
+    if camera_manager:
+        camera_manager.stop(job_timeout=SHUTDOWN_JOB_SECONDS)
+    if analytics:
+        analytics.stop()
+    if track_store:
+        track_store.close()
+
+def process_all_closed_segments():
+    from thumbnail_extractor import process_closed_segments
+
+    for pipeline in camera_manager.pipelines:
+        process_closed_segments(pipeline.output_dir, preview_folder=upload_dir(pipeline.output_dir))
 
 # Schedule periodic tasks (e.g., checking battery, storage management)
 def schedule_tasks():
-    schedule.every(5).minutes.do(manage_storage)  # Manage storage every 5 minutes
-    schedule.every(10).minutes.do(check_device_status)  # Check battery and network every 10 minutes
+    from storage_handler import check_storage_limit
 
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    max_storage_mb = config.get("video_storage", {}).get("max_storage_limit", 10000000000) / (1024 * 1024)
+    # Jitter spreads the work of a fleet of devices, e.g. uploads after a network check
+    scheduler.every(5 * 60, check_storage_limit, max_storage_mb, video_storage_path, name="storage", jitter=30)  # Manage storage every 5 minutes
+    scheduler.every(10 * 60, check_device_status, name="device-status", jitter=60)  # Check battery and network every 10 minutes
+    scheduler.every(60, process_all_closed_segments, name="closed-segments", jitter=5)  # Thumbnails and time-lapse for closed segments
+    scheduler.start()
 
 # Main function to start the process
 def main():
-    # Initialize camera
-    initialize_camera()
+    # Route logs through the background writer before anything else logs
+    setup_logging(config.get("logging"))
+    configure_io(config.get("io"))
+    install_shutdown_handlers(shutdown_requested)
 
-    # Start recording video (by default, it starts recording on launch)
+    # Start recording video on every camera first (by default, it starts recording on launch)
     global is_recording
     is_recording = True
-    video_thread = threading.Thread(target=capture_video)
-    video_thread.start()
+    capture_video()
+    start_supervisor()
 
-    # Start scheduled tasks (battery check, storage management, etc.)
-    schedule_thread = threading.Thread(target=schedule_tasks)
-    schedule_thread.start()
+    # Then bring up GPS, preview and scheduled tasks (battery check, storage management, etc.)
+    services_thread = threading.Thread(target=start_services, name="services", daemon=True)
+    services_thread.start()
 
-    try:
-        # Keep running the main loop while recording is active
-        while is_recording:
-            time.sleep(1)
-
-    except KeyboardInterrupt:
-        print("Terminating the video recording...")
-        stop_video_capture()
-        camera.release()
+    # Wait for SIGTERM or Ctrl-C; short waits keep the main thread responsive to signals
+    while not shutdown_requested.wait(1):
+        pass
+    logger.info("Terminating the video recording...")
+    stop_video_capture()
 
 if __name__ == "__main__":
     main()